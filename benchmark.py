@@ -0,0 +1,339 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Copyright (C) 2010 Vincent Ollivier <contact@vincentollivier.com>
+
+This file is part of OpenNMS Configuration Tools.
+
+OpenNMS Configuration Tools is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Foobar is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with OpenNMS Configuration Tools. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import gc
+import optparse
+import os
+import random
+import sys
+import time
+import xml.dom.minidom
+
+from lib import xmlbackend
+from lib import ip
+from lib.ip import IP
+from lib.xmltemplate import XMLTemplate
+
+##########################################
+#            Sample generators           #
+##########################################
+
+def sample_xml(services):
+    """
+    Return a poller-configuration like document with the given number of
+    services.
+    """
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>',
+             '<!-- Sample configuration generated by benchmark.py -->',
+             '<poller-configuration threads="30" '
+             'xmlns="http://xmlns.opennms.org/xsd/config/poller">',
+             '  <package name="example1">',
+             '    <filter>IPADDR != \'0.0.0.0\'</filter>']
+    for i in range(services):
+        lines.extend([
+            '    <service name="Service-%d" interval="300000" '
+            'user-defined="false" status="on">' % i,
+            '      <parameter key="retry" value="1"/>',
+            '      <parameter key="timeout" value="3000"/>',
+            '      <parameter key="port" value="%d"/>' % (1024 + i),
+            '    </service>'])
+    lines.append('  </package>')
+    for i in range(services):
+        lines.append('  <monitor service="Service-%d" class-name='
+                     '"org.opennms.netmgt.poller.monitors.TcpMonitor"/>' % i)
+    lines.append('</poller-configuration>')
+    return "\n".join(lines)
+
+def sample_addresses(count, distinct):
+    """
+    Return count IPv4 addresses in dot-decimal notation, picked among
+    distinct addresses of a few subnets.
+    """
+    random.seed(count)
+    addresses = ["10.%d.%d.%d" % (i / 65536 % 4, i / 256 % 256, i % 256)
+                 for i in random.sample(xrange(4 * 65536), distinct)]
+    return [random.choice(addresses) for i in range(count)]
+
+# Fragment of the template benchmark, like the services of the plugins
+SAMPLE_FRAGMENT = """
+<service name="%(name)s-Process" interval="300000" user-defined="false"
+    status="on">
+    <parameter key="retry" value="1"/>
+    <parameter key="timeout" value="3000"/>
+    <parameter key="service-name" value="%(value)s"/>
+    <parameter key="run-level" value="2"/>
+    <parameter key="match-all" value="true"/>
+</service>
+"""
+
+def build_fragment(doc, name, value):
+    """
+    Return SAMPLE_FRAGMENT built one element and one attribute at a time.
+    """
+    service = doc.createElement("service")
+    service.setAttribute("name", "%s-Process" % name)
+    service.setAttribute("interval", "300000")
+    service.setAttribute("user-defined", "false")
+    service.setAttribute("status", "on")
+    for key, parameter_value in [("retry", "1"), ("timeout", "3000"),
+                                 ("service-name", value),
+                                 ("run-level", "2"), ("match-all", "true")]:
+        parameter = doc.createElement("parameter")
+        parameter.setAttribute("key", key)
+        parameter.setAttribute("value", parameter_value)
+        service.appendChild(parameter)
+    return service
+
+
+class ReferenceIP:
+    """
+    The previous implementation of lib.ip.IP, the reference of bench_ip().
+    """
+
+    def __init__(self, ip_address):
+        try:
+            ip_list = ip_address.split('.')
+        except AttributeError:
+            self._ip_integer = ip_address
+        else:
+            self._ip_integer = 0
+            assert len(ip_list) == 4
+            for index, number in enumerate(ip_list):
+                self._ip_integer += int(number) * 256 ** (3 - index)
+
+    def __str__(self):
+        ip_integer = self._ip_integer
+        ip_string = ""
+        for exp in range(3, -1, -1):
+            ip_string += str(ip_integer / ( 256 ** exp )) + "."
+            ip_integer %= 256 ** exp
+        return(ip_string.rstrip('.'))
+
+    def __cmp__(self, other):
+        ret = self._ip_integer - other._ip_integer
+        return sys.maxint if ret > sys.maxint else -sys.maxint \
+                          if ret < -sys.maxint else ret
+
+##########################################
+#               Benchmarks               #
+##########################################
+
+def timed(func, *args):
+    """
+    Return the result of func(*args) and the time it took in milliseconds.
+    The garbage left by the previous benchmarks is collected first.
+    """
+    gc.collect()
+    start = time.time()
+    result = func(*args)
+    return result, (time.time() - start) * 1000
+
+def mutate(doc):
+    """
+    Modifications typical of 'config.py': lookups and appends.
+    """
+    root = doc.documentElement
+    for service in doc.getElementsByTagName("service"):
+        if service.getAttribute("name").endswith("0"):
+            service.setAttribute("status", "off")
+    for i in range(100):
+        monitor = doc.createElement("monitor")
+        monitor.setAttribute("service", "New-%d" % i)
+        root.appendChild(monitor)
+
+def bench_xml(string, repeat):
+    """
+    Compare parse, mutate and serialize times of the XML backends.
+    """
+    print "XML backends (%d bytes, best of %d):" % (len(string), repeat)
+    print "%-10s %12s %12s %12s" % ("backend", "parse (ms)", "mutate (ms)",
+                                    "write (ms)")
+    for name in xmlbackend.available_backends():
+        backend = xmlbackend.get_backend(name)
+        times = [[], [], []]
+        for i in range(repeat):
+            doc, t = timed(backend.parse_string, string)
+            times[0].append(t)
+            t = timed(mutate, doc)[1]
+            times[1].append(t)
+            t = timed(backend.serialize, doc)[1]
+            times[2].append(t)
+            doc.unlink()
+        print "%-10s %12.1f %12.1f %12.1f" % tuple([name] +
+                                                   [min(t) for t in times])
+
+def construct(cls, addresses):
+    return [cls(address) for address in addresses]
+
+def compare(ips):
+    previous = ips[0]
+    for ip in ips:
+        previous <= ip
+        previous = ip
+
+def to_strings(ips):
+    return [str(ip) for ip in ips]
+
+# Strings which must be rejected by both parsers of lib.ip
+INVALID_ADDRESSES = ["+1.2.3.4", "1. 2.3.4", "-0.1.2.3", "0001.2.3.4",
+                     "1.2.3", "1.2.3.4.5", "256.1.1.1", "1..2.3", "a.b.c.d",
+                     "", "1.2.3.4 5", u"\u0661.2.3.4"]
+
+def check_parse_ips(addresses):
+    """
+    Check that lib.ip.parse_ips(), which uses NumPy if it is installed,
+    gives the same values as lib.ip.parse_ip() for addresses, and rejects
+    the same invalid strings. Return the list of the differences.
+    """
+    errors = list()
+    expected = [ip.parse_ip(address.strip()) for address in addresses]
+    if ip.parse_ips(addresses).tolist() != expected:
+        errors.append("parse_ips() and parse_ip() give different values")
+    for address in INVALID_ADDRESSES:
+        for name, func in [("parse_ips()", lambda a: ip.parse_ips([a])),
+                           ("parse_ip()", ip.parse_ip)]:
+            try:
+                func(address)
+            except ValueError:
+                continue
+            errors.append("%s accepts %r" % (name, address))
+    return errors
+
+def bench_ip(count, repeat):
+    """
+    Compare the construction, comparison and formatting throughput of
+    lib.ip.IP and of its previous implementation. The addresses are
+    constructed from distinct strings, then from strings among a thousand
+    as when the same ranges are parsed again and again, and the distinct
+    strings are parsed at once by lib.ip.parse_ips().
+    """
+    distinct = sample_addresses(count, count)
+    repeated = sample_addresses(count, 1000)
+    print "IP addresses (%d addresses, best of %d, in thousands per " \
+          "second):" % (count, repeat)
+    print "%-10s %12s %12s %12s %12s" % ("class", "distinct", "repeated",
+                                         "compare", "format")
+    for name, cls in [("previous", ReferenceIP), ("lib.ip", IP)]:
+        times = [[], [], [], []]
+        for i in range(repeat):
+            ips, t = timed(construct, cls, distinct)
+            times[0].append(t)
+            times[1].append(timed(construct, cls, repeated)[1])
+            times[2].append(timed(compare, ips)[1])
+            times[3].append(timed(to_strings, ips)[1])
+        print "%-10s %12.0f %12.0f %12.0f %12.0f" \
+              % tuple([name] + [count / max(min(t), 0.001) for t in times])
+    # The whole list is parsed at once, and sorted without duplicates
+    times = [[], []]
+    for i in range(repeat):
+        times[0].append(timed(ip.parse_ips, distinct)[1])
+        times[1].append(timed(ip.parse_ips, distinct, True, True)[1])
+    print "%-10s %12.0f %12s (parse_ips with %s, %.0f sorted unique)" \
+          % ("batch", count / max(min(times[0]), 0.001), "",
+             ip.numpy is not None and "NumPy" or "array",
+             count / max(min(times[1]), 0.001))
+
+def parse_fragments(count):
+    for i in xrange(count):
+        xml.dom.minidom.parseString(SAMPLE_FRAGMENT % {"name": "P%d" % i,
+                                                       "value": "p%d" % i})
+
+def build_fragments(doc, count):
+    for i in xrange(count):
+        build_fragment(doc, "P%d" % i, "p%d" % i)
+
+def create_fragments(doc, template, count):
+    for i in xrange(count):
+        template.create(doc, name="P%d" % i, value="p%d" % i)
+
+def bench_templates(count, repeat):
+    """
+    Compare the cost of creating count copies of a fragment by parsing its
+    formatted text as the plugins did, by building it one element at a time,
+    and with lib.xmltemplate, which parses it only once.
+    """
+    doc = xml.dom.minidom.Document()
+    times = [[], [], [], []]
+    for i in range(repeat):
+        template, t = timed(XMLTemplate, SAMPLE_FRAGMENT)
+        times[0].append(t)
+        times[1].append(timed(parse_fragments, count)[1])
+        times[2].append(timed(build_fragments, doc, count)[1])
+        times[3].append(timed(create_fragments, doc, template, count)[1])
+    print "XML fragments (%d fragments, best of %d, in thousands per " \
+          "second, template parsed in %.2f ms):" % (count, repeat,
+                                                    min(times[0]))
+    print "%-10s %12s %12s %12s" % ("", "parse", "build", "template")
+    print "%-10s %12.1f %12.1f %12.1f" \
+          % tuple(["created"] + [count / max(min(t), 0.001)
+                                 for t in times[1:]])
+
+##########################################
+#             Main Function              #
+##########################################
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options] [<xml-file> ...]",
+                                   version="%prog 0.1.1")
+    parser.add_option("-n", "--repeat",
+        help = "Number of runs of each benchmark, the best is kept.",
+        metavar = "<number>",
+        type = "int",
+        default = 5)
+    parser.add_option("-s", "--size",
+        help = "Number of services of the generated sample document used " \
+               "when no file is given.",
+        metavar = "<number>",
+        type = "int",
+        default = 2000)
+    parser.add_option("-a", "--addresses",
+        help = "Number of IP addresses of the IP benchmark.",
+        metavar = "<number>",
+        type = "int",
+        default = 100000)
+    parser.add_option("-t", "--fragments",
+        help = "Number of fragments created by the XML template benchmark.",
+        metavar = "<number>",
+        type = "int",
+        default = 5000)
+
+    (options, args) = parser.parse_args()
+
+    if args:
+        for filename in args:
+            if not os.path.isfile(filename):
+                sys.exit("Cannot open file '%s'" % filename)
+            print "'%s'" % filename
+            bench_xml(open(filename).read(), options.repeat)
+    else:
+        bench_xml(sample_xml(options.size), options.repeat)
+    errors = check_parse_ips(sample_addresses(1000, 1000) +
+                             ["0.0.0.0", "255.255.255.255", "010.1.1.1",
+                              " 1.2.3.4 "])
+    if errors:
+        sys.exit("Error: %s" % "\nError: ".join(errors))
+    bench_ip(options.addresses, options.repeat)
+    bench_templates(options.fragments, options.repeat)
+
+if __name__ == "__main__":
+
+    main()
+    sys.exit(os.EX_OK)
@@ -22,17 +22,28 @@ along with OpenNMS Configuration Tools. If not, see <http://www.gnu.org/licenses
 from __future__ import with_statement
 
 # Standard library
-import fileinput
+import bisect
+import itertools
 import optparse
 import os
 import re
 import sys
+import time
 import xml.dom.minidom
 
 import params
 import lib.distrib
-from lib.ip import IP
-from lib.xmlfile import XMLFile
+from lib.intervals import IntervalMap, IntervalSet
+from lib.ip import IP, IPMatch, parse_ips
+from lib.properties import PropertiesFile
+from lib.sources import chain_rules, chunks
+from lib.system import UTF8Output
+from lib.xmlcache import XMLCache
+from lib.xmldiff import TreeDiff
+from lib.xmlfile import XMLFile, XMLRegistry
+from lib.xmlindex import key_of
+from lib.xmltemplate import XMLTemplate
+from lib import xmlvalidate
 
 try:
     # Python version >= 2.5
@@ -43,23 +54,30 @@ except:
 # This file need the ternary operator from Python 2.5.0
 assert sys.version_info[:3] >= (2, 5, 0)
 
-def add_to_admins(filename, username):
+def add_to_admins(filename, usernames):
     """
-    Add username to the users' list granted by admin roles defined in filename
-    where filename is usualy "/etc/opennms/magic-users.properties".
+    Add usernames to the users' list granted by admin roles defined in
+    filename where filename is usualy "/etc/opennms/magic-users.properties".
+    The file is written once, and only if some of the users are new admins.
     """
-    role = "role.admin.users"
+    magic_users = PropertiesFile(filename)
+    magic_users.append("role.admin.users", usernames)
     try:
-        for line in fileinput.input(filename, inplace = 1):
-            if line[:len(role)] == role:
-                admins = line[len(role)+1:len(line)-1].replace(" ", "").split(",")
-                if not username in admins:
-                    admins.append(username)
-                    line = "%s=%s\n" % (role, ", ".join(admins))
-            sys.stdout.write(line)
-    except OSError, e:
+        magic_users.write()
+    except (IOError, OSError), e:
         sys.exit("%s: '%s'" % (e, filename))
 
+def get_rules(config_rules, name):
+    """
+    Iterate over the rules of the list name of config_rules, then over those
+    of the files listed by name_FILES, relative to the directory of
+    config_rules. The files are read as the rules are used.
+    """
+    path = os.path.dirname(os.path.abspath(config_rules.__file__))
+    filenames = [os.path.join(path, filename) for filename
+                 in getattr(config_rules, "%s_FILES" % name, [])]
+    return chain_rules(getattr(config_rules, name, []), filenames)
+
 
 class XMLConfig(object):
     def __init__(self, xml_file, root_name = None):
@@ -67,11 +85,14 @@ class XMLConfig(object):
         self.xml_tree = XMLFile.open(xml_file, "w")
         self.xml_tree.set_root(root_name)
         self._doc = self.xml_tree.get_document()
+        # Indexes of the elements, every modification of the tree is done
+        # through them
+        self._index = self.xml_tree.get_index()
         # root_conf is usualy the real root but not always.
         # root_conf's tag name is the same as filename
-        root_conf = self._doc.getElementsByTagName(root_name)
-        assert root_conf.length == 1
-        self._config = root_conf.item(0)
+        root_conf = self._index.elements(root_name)
+        assert len(root_conf) == 1
+        self._config = root_conf[0]
 
     def get_overwrite(self):
         return self._overwrite
@@ -89,23 +110,88 @@ class XMLConfig(object):
         self.xml_tree.write()
 
     def pretty_print(self):
-        print "Printing '%s' with modifications made to it ..." % self._xml_file
-        print "#" * 80
-        print
-        print self.xml_tree.read()
-        print "#" * 80
+        print "Printing modifications made to '%s' ..." % self._xml_file
+        try:
+            on_disk = XMLFile.parse_document(self._xml_file)
+        except (IOError, xml.parsers.expat.ExpatError):
+            on_disk = None
+        diff = TreeDiff(on_disk, self._doc)
+        for change in diff.changes:
+            print "\t%s" % change
+        print "'%s': %s" % (self._xml_file, diff.summary())
+        if self.verbosity > 2:
+            print "#" * 80
+            print self.xml_tree.read()
+            print "#" * 80
+
+    def _upsert(self, parent, child, *key_names):
+        """
+        Set child in parent, replacing the elements with the same tag and
+        key_names (see XMLIndex.upsert()). An identical element is kept as it
+        is, so applying the same configuration again changes nothing.
+        """
+        return self._index.upsert(parent, child, key_names)
+
+    def _set_child(self, parent, tag, keys, attributes=()):
+        """
+        Set in parent the element tag whose key attributes are keys, a list
+        of (name, value), with the other attributes given in attributes.
+        """
+        child = self._doc.createElement(tag)
+        for name, value in list(keys) + list(attributes):
+            child.setAttribute(name, value)
+        return self._upsert(parent, child, *[name for name, value in keys])
 
     def remove_all(self):
         while self._config.firstChild is not None:
-            self._config.removeChild(self._config.firstChild)
+            self._index.remove(self._config.firstChild)
     def clean(self):
         self._doc.normalize()
 
 
+class ImportSummary(object):
+    """
+    This class count the elements created, replaced and skipped by a bulk
+    import, and the time it took.
+    """
+
+    def __init__(self):
+        self.created = 0
+        self.replaced = 0
+        self.skipped = 0
+        self.elapsed = 0.0
+
+    def __str__(self):
+        return "%d created, %d replaced, %d skipped in %.2fs" \
+               % (self.created, self.replaced, self.skipped, self.elapsed)
+
+
+class NormalizeSummary(object):
+    """
+    This class count the elements of each tag of tags before and after a
+    normalization.
+    """
+
+    def __init__(self, tags):
+        self.tags = tags
+        self.before = dict()
+        self.after = dict()
+
+    def count(self, index, counts):
+        for tag in self.tags:
+            counts[tag] = len(index.elements(tag))
+
+    def __str__(self):
+        return ", ".join(["%d %s(s) -> %d" % (self.before[tag], tag,
+                                               self.after[tag])
+                          for tag in self.tags])
+
+
 class Users(XMLConfig):
-    def add(self, uid, pwd, name=None, mail=None, ro=False):
-        if self.verbosity > 1:
-            print "\tAdding user '%s' ..." % uid
+    def _create_user(self, uid, pwd, name=None, mail=None, ro=False):
+        """
+        Return a new user node, not yet added to the configuration.
+        """
         # Create node
         new_user = self._doc.createElement("user")
         # Configure id
@@ -118,7 +204,9 @@ class Users(XMLConfig):
             # If password is already hashed, remove header and use the hash
             md5_pwd = pwd[5:]
         else:
-            # Otherwize, compute the hash and use it
+            # Otherwize, compute the hash of its UTF-8 bytes and use it
+            if isinstance(pwd, unicode):
+                pwd = pwd.encode("utf-8")
             md5_pwd = md5.md5(pwd).hexdigest().upper()
         password.appendChild(self._doc.createTextNode(md5_pwd))
         new_user.appendChild(password)
@@ -133,70 +221,139 @@ class Users(XMLConfig):
             contact.setAttribute("info", mail)
             contact.setAttribute("type", "email")
             new_user.appendChild(contact)
-        # Configure permissions
-        if ro:
+        # Configure permissions, 'ro' can be read from a file as a string
+        if ro and ("%s" % ro).lower() not in ("false", "no", "0"):
             new_user.setAttribute("read-only", "true")
+        return new_user
+
+    def add(self, uid, pwd, name=None, mail=None, ro=False):
+        if self.verbosity > 1:
+            print "\tAdding user '%s' ..." % uid
+        new_user = self._create_user(uid, pwd, name, mail, ro)
         # Search for all users and user-ids
-        users = self._doc.getElementsByTagName("users").item(0)
+        users = self._index.first("users")
 
-        e_uids = self._doc.getElementsByTagName("user-id")
         # If a node have the same user-id, replace it
-        old_users_matching = [e_uid.parentNode for e_uid in e_uids
-                              if e_uid.firstChild.nodeValue == uid]
+        old_users_matching = self._index.find_all("user", "user-id", uid)
         if old_users_matching:
             assert len(old_users_matching) == 1
             if self.overwrite:
-                users.replaceChild(new_user, old_users_matching[0])
+                self._index.replace(new_user, old_users_matching[0])
             else:
                 if self.verbosity > 1:
                     print "\t\tUser '%s' already exist but will not be " \
                           "overwritten!" % uid
         else: # Otherwise, add the node
-            users.appendChild(new_user)
+            self._index.append(users, new_user)
+
+    def add_many(self, new_users):
+        """
+        Add the users of new_users, each one given as a dictionary of the
+        arguments of add(), and return an ImportSummary.
+        The existing users are mapped by user-id once for the whole import.
+        """
+        summary = ImportSummary()
+        start = time.time()
+        users = self._index.first("users")
+        old_users = dict()
+        for old_user in self._index.elements("user"):
+            old_users.setdefault(key_of(old_user, "user-id"), old_user)
+        for user in new_users:
+            uid = user["uid"]
+            if self.verbosity > 1:
+                print "\tAdding user '%s' ..." % uid
+            old_user = old_users.get(uid)
+            if old_user is not None and not self.overwrite:
+                if self.verbosity > 1:
+                    print "\t\tUser '%s' already exist but will not be " \
+                          "overwritten!" % uid
+                summary.skipped += 1
+                continue
+            new_user = self._create_user(**user)
+            if old_user is None:
+                self._index.append(users, new_user)
+                summary.created += 1
+            else:
+                self._index.replace(new_user, old_user)
+                summary.replaced += 1
+            old_users[uid] = new_user
+        summary.elapsed = time.time() - start
+        return summary
 
 
 class Groups(XMLConfig):
+    def __init__(self, xml_file, root_name = None):
+        XMLConfig.__init__(self, xml_file, root_name)
+        # Members of the admin groups, granted admin roles on save()
+        self._admins = list()
+        self._admin_set = set()
+
+    def save(self):
+        XMLConfig.save(self)
+        if self._admins:
+            admin_conf = "%s/magic-users.properties" \
+                         % os.path.dirname(self._xml_file)
+            add_to_admins(admin_conf, self._admins)
+
     def add(self, name, comments = "", users = None, level = 2):
         if users is None:
             users = []
         if self.verbosity > 1:
             print "\tAdding group '%s' ..." % name
         # Search in all groups if one have the same name
-        g_names = self._doc.getElementsByTagName("name")
         # If so, merge it
-        old_groups_matching = [g_name.parentNode for g_name in g_names
-                               if g_name.firstChild.nodeValue == name]
+        old_groups_matching = self._index.find_all("group", "name", name)
         if old_groups_matching:
             assert len(old_groups_matching) == 1
             new_group = old_groups_matching[0]
         else:
             new_group = self._doc.createElement("group")
-            groups = self._doc.getElementsByTagName("groups").item(0)
-            groups.appendChild(new_group)
+            groups = self._index.first("groups")
+            self._index.append(groups, new_group)
             # Configure name
             group_name = self._doc.createElement("name")
             group_name.appendChild(self._doc.createTextNode(name))
-            new_group.appendChild(group_name)
-        # Configure comments
-        for group_comments in new_group.getElementsByTagName("comments"):
-            new_group.removeChild(group_comments)
+            self._index.append(new_group, group_name)
+        # Configure comments, just after the name
+        old_comments = new_group.getElementsByTagName("comments")
         group_comments = self._doc.createElement("comments")
         group_comments.appendChild(self._doc.createTextNode(comments))
-        new_group.appendChild(group_comments)
-        # Configure users
+        if not old_comments:
+            group_name = new_group.getElementsByTagName("name").item(0)
+            self._index.insert_before(new_group, group_comments,
+                                      group_name.nextSibling)
+        elif key_of(old_comments[0], None) != comments:
+            self._index.replace(group_comments, old_comments[0])
+        else:
+            group_comments = old_comments[0]
+        for old_group_comments in old_comments[1:]:
+            self._index.remove(old_group_comments)
+        # Configure users, only the members who join or leave the group are
+        # added or removed
+        wanted = set(users)
+        members = set()
+        last_element = group_comments
         for old_user in new_group.getElementsByTagName("user"):
-            new_group.removeChild(old_user)
+            user = key_of(old_user, None)
+            if user in wanted and user not in members:
+                members.add(user)
+                last_element = old_user
+            else:
+                self._index.remove(old_user)
+        # The new members follow the old ones
+        reference = last_element.nextSibling
         for user in users:
-            new_user = self._doc.createElement("user")
-            new_user.appendChild(self._doc.createTextNode(user))
-            new_group.appendChild(new_user)
+            if user not in members:
+                members.add(user)
+                new_user = self._doc.createElement("user")
+                new_user.appendChild(self._doc.createTextNode(user))
+                self._index.insert_before(new_group, new_user, reference)
             # If the group is admin
-            if level == 3:
+            if level == 3 and user not in self._admin_set:
                 if self.verbosity > 1:
                     print "\tAdding user '%s' to admins ..." % user
-                admin_conf = "%s/magic-users.properties" \
-                             % os.path.dirname(self._xml_file)
-                add_to_admins(admin_conf, user)
+                self._admins.append(user)
+                self._admin_set.add(user)
 
 
 class Roles(XMLConfig):
@@ -210,25 +367,110 @@ class Roles(XMLConfig):
         new_role.setAttribute("supervisor", supervisor)
         new_role.setAttribute("description", description)
         # Get roles or create it if it doesn't exist
-        roles = self._doc.getElementsByTagName("roles").item(0)
+        roles = self._index.first("roles")
         if roles is None:
-            groupinfo = self._doc.getElementsByTagName("groupinfo").item(0)
+            groupinfo = self._index.first("groupinfo")
             roles = self._doc.createElement("roles")
-            groupinfo.appendChild(roles)
+            self._index.append(groupinfo, roles)
         else:
             # Remove role with the same name if exist
-            #for role in roles.childNodes:
-            for role in self._doc.getElementsByTagName("role"):
-                if role.getAttribute("name") == name:
-                    try:
-                        roles.removeChild(role)
-                    except xml.dom.NotFoundErr:
-                        # Dont complain if we try to remove more than once
-                        # the new range
-                        pass
+            for role in self._index.find_all("role", "name", name):
+                if role.parentNode.isSameNode(roles):
+                    self._index.remove(role)
 
         # Add the new role
-        roles.appendChild(new_role)
+        self._index.append(roles, new_role)
+
+
+def format_duration(seconds):
+    """
+    Return a duration in seconds as '1d 2h 3m 4s'.
+    """
+    seconds = int(round(seconds))
+    parts = list()
+    for unit, length in [("d", 86400), ("h", 3600), ("m", 60)]:
+        if seconds >= length:
+            parts.append("%d%s" % (seconds / length, unit))
+            seconds %= length
+    if seconds or not parts:
+        parts.append("%ds" % seconds)
+    return " ".join(parts)
+
+
+class ScanCost(object):
+    """
+    This class estimate the cost of a discovery cycle: the addresses are
+    probed one after the other at packets_per_second, and an address which
+    does not answer is probed again retries times, timeout milliseconds after
+    the previous probe. The best case is when every address answers at once,
+    the worst case when none answers.
+    """
+
+    def __init__(self, packets_per_second, initial_sleep_time,
+                 restart_sleep_time):
+        self.packets_per_second = packets_per_second
+        self.initial_sleep_time = initial_sleep_time
+        self.restart_sleep_time = restart_sleep_time
+        self.addresses = 0
+        self.excluded = 0
+        # Number of addresses by (retries, timeout)
+        self.settings = dict()
+
+    def add(self, count, retries, timeout):
+        self.addresses += count
+        self.settings[(retries, timeout)] = \
+            self.settings.get((retries, timeout), 0) + count
+
+    def get_packets(self):
+        """
+        Return the number of packets sent in the best and the worst case.
+        """
+        worst = 0
+        for (retries, timeout), count in self.settings.items():
+            worst += count * (retries + 1)
+        return self.addresses, worst
+
+    def get_duration(self):
+        """
+        Return the duration of a cycle in seconds in the best and the worst
+        case.
+        """
+        duration = self.addresses / float(self.packets_per_second)
+        wait = 0
+        for retries, timeout in self.settings:
+            wait = max(wait, timeout * (retries + 1) / 1000.0)
+        return duration, duration + wait
+
+    def get_peak_rate(self):
+        """
+        Return the peak number of packets sent per second, reached in the
+        worst case when the retries of the previous addresses are sent with
+        the first probe of the next ones.
+        """
+        if not self.settings:
+            return 0
+        retries = max([retries for retries, timeout in self.settings])
+        return self.packets_per_second * (retries + 1)
+
+    def __str__(self):
+        best_packets, worst_packets = self.get_packets()
+        best_duration, worst_duration = self.get_duration()
+        lines = [
+            "%d address(es) probed per cycle, %d excluded"
+            % (self.addresses, self.excluded),
+            "%d to %d packet(s) per cycle" % (best_packets, worst_packets),
+            "Cycle duration: %s to %s at %d packet(s) per second"
+            % (format_duration(best_duration),
+               format_duration(worst_duration), self.packets_per_second),
+            "Peak packet rate: %d packet(s) per second" % self.get_peak_rate(),
+            "First cycle after %s, then every %s to %s"
+            % (format_duration(self.initial_sleep_time / 1000.0),
+               format_duration(best_duration +
+                               self.restart_sleep_time / 1000.0),
+               format_duration(worst_duration +
+                               self.restart_sleep_time / 1000.0)),
+        ]
+        return "\n".join(lines)
 
 
 class Discovery(XMLConfig):
@@ -236,6 +478,18 @@ class Discovery(XMLConfig):
     This class allow to manage the list of IPv4 address monitored by OpenNMS.
     """
 
+    # Minimum number of consecutive specific addresses replaced by a range
+    min_run = 3
+
+    # Default values of the settings of the schema
+    defaults = {
+        "packets-per-second": 1,
+        "initial-sleep-time": 30000,
+        "restart-sleep-time": 86400000,
+        "retries": 1,
+        "timeout": 800,
+    }
+
     def add(self, addr, retries=1, timeout=2000):
         """
         Add an IPv4 address in dot-decimal notation.
@@ -250,66 +504,226 @@ class Discovery(XMLConfig):
         new_address.setAttribute("timeout", str(timeout))
         # Search for all IP addresses
         discovery_configuration = \
-            self._doc.getElementsByTagName("discovery-configuration").item(0)
-        addresses = self._doc.getElementsByTagName("specific")
-        old_addresses_matching = [address for address in addresses
-                                  if address.firstChild.nodeValue == addr]
+            self._index.first("discovery-configuration")
+        old_addresses_matching = self._index.find_all("specific", None, addr)
         # If the address is already configured, replace it
         if old_addresses_matching:
             assert len(old_addresses_matching) == 1
-            discovery_configuration.replaceChild(new_address,
-                                                 old_addresses_matching[0])
+            self._index.replace(new_address, old_addresses_matching[0])
         else: # Otherwise, add the address
-            discovery_configuration.appendChild(new_address)
+            self._index.append(discovery_configuration, new_address)
 
-    def manage_range(self, action, begin, end, retries=None, timeout=None):
+    def _get_range(self, element):
         """
-        Include or exclude an IPv4 address range in dot-decimal notation.
+        Return the begin and end of a range element as integers.
         """
-        if self.verbosity > 1:
-            print "\t%sing range from '%s' to '%s' ..." \
-                  % (action.title()[:len(action)-1], begin, end)
-        # Create range
+        bounds = list()
+        for border in ["begin", "end"]:
+            node = element.getElementsByTagName(border).item(0)
+            bounds.append(int(IP(node.firstChild.nodeValue.strip())))
+        return tuple(bounds)
+
+    def _create_range(self, action, begin, end, retries=None, timeout=None):
         new_range = self._doc.createElement("%s-range" % action)
         # Configure border
-        for border in ["begin", "end"]:
+        for border, ip in [("begin", begin), ("end", end)]:
             range_border = self._doc.createElement(border)
-            range_border.appendChild(self._doc.createTextNode(locals()[border]))
+            range_border.appendChild(self._doc.createTextNode(str(IP(ip))))
             new_range.appendChild(range_border)
         # Configure attributes
         if retries is not None:
-            new_range.setAttribute("retries", str(retries))
+            new_range.setAttribute("retries", retries)
         if timeout is not None:
-            new_range.setAttribute("timeout", str(timeout))
-        # Add the new range
+            new_range.setAttribute("timeout", timeout)
+        return new_range
+
+    def manage_ranges(self, includes=(), excludes=()):
+        """
+        Include and exclude IPv4 address ranges, given as the arguments of
+        include() and exclude(), and replace all the ranges configured by the
+        minimal set of sorted disjoint ranges: the overlapping or adjacent
+        include ranges with the same retries and timeout are merged (the last
+        one given wins where they differ), and the exclude ranges are merged
+        and subtracted from the include ranges.
+        """
         discovery_configuration = \
-            self._doc.getElementsByTagName("discovery-configuration").item(0)
-        discovery_configuration.appendChild(new_range)
-        # Search in all ranges
-        for range in self._doc.getElementsByTagName("%s-range" % action):
-            range_begin = range.getElementsByTagName("begin").item(0)\
-                .firstChild.nodeValue
-            range_end = range.getElementsByTagName("end").item(0)\
-                .firstChild.nodeValue
-            # If the new range extend some old ranges, remove them
-            if IP(begin) <= IP(range_begin) and IP(end) >= IP(range_end) and \
-               not new_range.isSameNode(range):
-                   discovery_configuration.removeChild(range)
-            # BTW check if the new range is useless, and if so remove it
-            elif IP(begin) >= IP(range_begin) and IP(end) <= IP(range_end) and \
-                 not new_range.isSameNode(range):
-                     try:
-                         discovery_configuration.removeChild(new_range)
-                     except xml.dom.NotFoundErr:
-                         # Dont complain if we try to remove more than once
-                         # the new range
-                         pass
+            self._index.first("discovery-configuration")
+        # The ranges already configured come first, so the new ones win
+        old_ranges = list()
+        include_items = list()
+        exclude_items = list()
+        for action, items in [("include", include_items),
+                              ("exclude", exclude_items)]:
+            for element in self._index.elements("%s-range" % action):
+                begin, end = self._get_range(element)
+                attributes = (element.getAttribute("retries") or None,
+                              element.getAttribute("timeout") or None)
+                old_ranges.append(((action, begin, end, attributes), element))
+                items.append((begin, end, attributes))
+        for action, items, ranges in [("include", include_items, includes),
+                                      ("exclude", exclude_items, excludes)]:
+            for new_range in ranges:
+                if self.verbosity > 1:
+                    print "\t%sing range from '%s' to '%s' ..." \
+                          % (action.title()[:len(action)-1],
+                             new_range["begin"], new_range["end"])
+                begin = int(IP(new_range["begin"]))
+                end = int(IP(new_range["end"]))
+                assert begin <= end
+                if action == "include":
+                    attributes = tuple([value is not None and str(value) or None
+                                        for value in
+                                        (new_range.get("retries", 1),
+                                         new_range.get("timeout", 2000))])
+                else:
+                    attributes = (None, None)
+                items.append((begin, end, attributes))
+        exclude_set = IntervalSet([(begin, end)
+                                   for begin, end, _ in exclude_items])
+        include_map = IntervalMap(include_items).difference(exclude_set)
+        wanted = [("include", begin, end, attributes)
+                  for begin, end, attributes in include_map]
+        wanted.extend([("exclude", begin, end, (None, None))
+                       for begin, end in exclude_set])
+        # Keep the ranges which are still wanted and replace the others
+        wanted_keys = set(wanted)
+        kept = {"include": list(), "exclude": list()}
+        removed = list()
+        for key, element in old_ranges:
+            if key in wanted_keys:
+                wanted_keys.remove(key)
+                kept[key[0]].append((key[1], element))
+            else:
+                removed.append(element)
+        self._index.remove_many(removed)
+        for action in kept:
+            kept[action].sort()
+        # The elements following the ranges of each kind in the schema
+        tails = dict()
+        for action, tags in [("include", ["exclude-range", "include-url"]),
+                             ("exclude", ["include-url"])]:
+            tails[action] = None
+            for node in discovery_configuration.childNodes:
+                if node.nodeType == node.ELEMENT_NODE and \
+                   node.tagName in tags:
+                    tails[action] = node
+                    break
+        # Insert each new range before the first kept range of the same kind
+        # following it, the wanted ranges being sorted
+        insertions = list()
+        for key in wanted:
+            if key not in wanted_keys:
+                continue
+            action, begin, end, (retries, timeout) = key
+            new_range = self._create_range(action, begin, end, retries,
+                                           timeout)
+            i = bisect.bisect_right(kept[action], (begin, None))
+            if i == len(kept[action]):
+                following = tails[action]
+            else:
+                following = kept[action][i][1]
+            insertions.append((new_range, following))
+        self._index.insert_many(discovery_configuration, insertions)
+
+    def compact(self):
+        """
+        Remove the specific addresses covered by an include range, and replace
+        the runs of at least min_run consecutive specific addresses with the
+        same retries and timeout by include ranges. The specific addresses in
+        an exclude range are kept as they are.
+        """
+        ranges = dict()
+        for action in ["include", "exclude"]:
+            ranges[action] = IntervalSet([self._get_range(element) for element
+                                          in self._index.elements("%s-range"
+                                                                  % action)])
+        covered = list()
+        specifics = list()
+        for element, addr in self._get_specifics():
+            if addr in ranges["include"]:
+                covered.append(element)
+            elif addr not in ranges["exclude"]:
+                attributes = (element.getAttribute("retries") or None,
+                              element.getAttribute("timeout") or None)
+                specifics.append((addr, attributes, element))
+        specifics.sort()
+        # Group the consecutive addresses with the same attributes
+        runs = list()
+        for addr, attributes, element in specifics:
+            if runs and runs[-1][1] == attributes and \
+               runs[-1][2][-1][0] + 1 >= addr:
+                runs[-1][2].append((addr, element))
+            else:
+                runs.append((addr, attributes, [(addr, element)]))
+        new_ranges = list()
+        collapsed = list()
+        for begin, (retries, timeout), addresses in runs:
+            end = addresses[-1][0]
+            if end - begin + 1 < self.min_run:
+                continue
+            new_ranges.append(dict(begin=str(IP(begin)), end=str(IP(end)),
+                                   retries=retries, timeout=timeout))
+            collapsed.extend([element for addr, element in addresses])
+        if self.verbosity > 1:
+            print "\tCompacting specific addresses: %d covered by a range " \
+                  "removed, %d replaced by %d range(s) ..." \
+                  % (len(covered), len(collapsed), len(new_ranges))
+        self._index.remove_many(covered + collapsed)
+        self.manage_ranges(includes=new_ranges)
+
+    def _get_specifics(self):
+        """
+        Return the list of the specific elements with their address, parsed
+        at once.
+        """
+        elements = self._index.elements("specific")
+        addresses = parse_ips([key_of(element, None) for element in elements])
+        return zip(elements, addresses.tolist())
+
+    def _get_setting(self, element, name):
+        """
+        Return the value of the setting name of element, inherited from the
+        root element or the defaults if element doesn't define it.
+        """
+        for node in [element, self._index.first("discovery-configuration")]:
+            if node.getAttribute(name):
+                return int(float(node.getAttribute(name)))
+        return self.defaults[name]
+
+    def estimate_cost(self):
+        """
+        Return the ScanCost of the configuration: the addresses probed are
+        those of the include ranges and the specific addresses, without those
+        of the exclude ranges. They are counted by intervals, so the cost of
+        large ranges is computed at once.
+        """
+        root = self._index.first("discovery-configuration")
+        cost = ScanCost(*[self._get_setting(root, name) for name in
+                          ["packets-per-second", "initial-sleep-time",
+                           "restart-sleep-time"]])
+        items = list()
+        for element in self._index.elements("include-range"):
+            begin, end = self._get_range(element)
+            items.append((begin, end, (self._get_setting(element, "retries"),
+                                       self._get_setting(element, "timeout"))))
+        for element, addr in self._get_specifics():
+            items.append((addr, addr, (self._get_setting(element, "retries"),
+                                       self._get_setting(element, "timeout"))))
+        excludes = IntervalSet([self._get_range(element) for element in
+                                self._index.elements("exclude-range")])
+        addresses = IntervalMap(items)
+        for begin, end, (retries, timeout) in addresses.difference(excludes):
+            cost.add(end - begin + 1, retries, timeout)
+        cost.excluded = IntervalSet([(begin, end) for begin, end, _ in
+                                     addresses]).count() - cost.addresses
+        return cost
 
     def include(self, begin, end, retries = 1, timeout = 2000):
-        self.manage_range("include", begin, end, retries, timeout)
+        self.manage_ranges(includes=[dict(begin=begin, end=end,
+                                          retries=retries, timeout=timeout)])
 
     def exclude(self, begin, end):
-        self.manage_range("exclude", begin, end)
+        self.manage_ranges(excludes=[dict(begin=begin, end=end)])
 
 
 class Notification(XMLConfig):
@@ -317,14 +731,14 @@ class Notification(XMLConfig):
     This class allow checking the status of the OpenNMS notification daemon.
     """
     def get_status(self):
-        notifd = self._doc.getElementsByTagName("notifd-configuration").item(0)
+        notifd = self._index.first("notifd-configuration")
         return True if notifd.getAttribute("status") == "on" else False
     def set_status(self, value):
-        notifd = self._doc.getElementsByTagName("notifd-configuration").item(0)
+        notifd = self._index.first("notifd-configuration")
         status = "on" if value else "off"
         if self.verbosity > 1:
             print "\tSetting notification status to '%s' ..." % status
-        notifd.setAttribute("status", status)
+        self._index.set_attribute(notifd, "status", status)
     status = property(get_status, set_status)
 
 
@@ -336,26 +750,21 @@ class Collector(XMLConfig):
     
     def get_protocol_status(self, protocol):
         """ Generic method to get the status of the given protocol """
-        assert self._doc.getElementsByTagName("package").length == 1
-        for service in self._doc.getElementsByTagName("service"):
-            if service.getAttribute("name") != protocol:
-                continue
+        assert len(self._index.elements("package")) == 1
+        for service in self._index.find_all("service", "name", protocol):
             return True if service.getAttribute("status") == "on" else False
     def set_protocol_status(self, protocol, value):
         """ Generic method to set the status of the given protocol """
-        assert self._doc.getElementsByTagName("package").length == 1
-        for service in self._doc.getElementsByTagName("service"):
-            if service.getAttribute("name") != protocol:
-                continue
+        assert len(self._index.elements("package")) == 1
+        for service in self._index.find_all("service", "name", protocol):
             status = "on" if value else "off"
             if self.verbosity > 1:
                 print "\tSetting %s status to '%s' ..." % (protocol, status)
-            service.setAttribute("status", status)
+            self._index.set_attribute(service, "status", status)
             if self.get_thresholding_status(protocol):
-                parameter = self._doc.createElement("parameter")
-                service.appendChild(parameter)
-                parameter.setAttribute("key", "thresholding-enabled")
-                parameter.setAttribute("value", "true")
+                self._set_child(service, "parameter",
+                                [("key", "thresholding-enabled")],
+                                [("value", "true")])
                 if self.verbosity > 1:
                     print "\tEnabling %s thresholding ..." % protocol
 
@@ -395,194 +804,383 @@ class Collector(XMLConfig):
     wmi = property(get_wmi, set_wmi)
 
 
+class DefinitionLookup(object):
+    """
+    This class find the first definition of a credential file, in document
+    order, containing an address: its ranges and specific addresses are
+    searched in O(log n), and the 'ip-match' patterns of the definitions
+    before the one found are tested in order.
+    """
+
+    def __init__(self, ranges, matches, positions):
+        # IntervalMap of the addresses to (position, definition)
+        self._ranges = ranges
+        # (position, IPMatch, definition) of the patterns in document order
+        self._matches = matches
+        # Position of each definition in document order
+        self._positions = positions
+
+    def position(self, definition):
+        """
+        Return the position of definition in document order, from 0.
+        """
+        return self._positions[definition]
+
+    def get(self, key, default=None):
+        """
+        Return the definition used for the integer value of an address.
+        """
+        found = self._ranges.get(key)
+        for position, match, definition in self._matches:
+            if found is not None and position >= found[0]:
+                break
+            if key in match:
+                return definition
+        if found is None:
+            return default
+        return found[1]
+
+
 class Credentials(XMLConfig):
     """
     This class allow to define credential for for an address or a range of
     addresses for the SNMP or WMI protocol.
     """
 
-    def _add_specific(self, node, value):
-        child = self._doc.createElement("specific")
-        child.appendChild(self._doc.createTextNode(str(value)))
-        node.appendChild(child)
-        return child
+    # Number of credentials whose addresses are parsed at once
+    chunk_size = 10000
+
+    # Attributes hidden by describe()
+    secret_attributes = ("password", "write-community", "auth-passphrase",
+                         "privacy-passphrase")
 
-    def _add_range(self, node, left_value, right_value):
-        child = self._doc.createElement("range")
-        child.setAttribute("begin", str(left_value))
-        child.setAttribute("end", str(right_value))
-        node.appendChild(child)
+    def _create_child(self, begin, end):
+        """
+        Return a new specific address or range of addresses given as
+        integers.
+        """
+        if begin == end:
+            child = self._doc.createElement("specific")
+            child.appendChild(self._doc.createTextNode(str(IP(begin))))
+        else:
+            child = self._doc.createElement("range")
+            child.setAttribute("begin", str(IP(begin)))
+            child.setAttribute("end", str(IP(end)))
         return child
 
+    def _get_child(self, child):
+        """
+        Return the addresses of a specific address or range element as a
+        (begin, end) pair of integers, or None for other nodes.
+        """
+        if child.nodeType != child.ELEMENT_NODE:
+            return None
+        if child.tagName == "range":
+            return (int(IP(child.getAttribute("begin").strip())),
+                    int(IP(child.getAttribute("end").strip())))
+        if child.tagName == "specific":
+            addr = int(IP(key_of(child, None).strip()))
+            return (addr, addr)
+        return None
+
+    def _set_addresses(self, definition, addresses):
+        """
+        Add to definition the (begin, end) pairs of addresses it doesn't
+        have, and return its address elements which are not in addresses.
+        """
+        addresses = set(addresses)
+        removed = list()
+        for child in definition.childNodes:
+            child_addresses = self._get_child(child)
+            if child_addresses in addresses:
+                addresses.remove(child_addresses)
+            elif child_addresses is not None:
+                removed.append(child)
+        for begin, end in sorted(addresses):
+            self._index.append(definition, self._create_child(begin, end))
+        return removed
+
+    def _get_addresses(self, definition):
+        """
+        Return the (begin, end) pairs of the addresses of definition, or None
+        if it has other children (such as 'ip-match') or no address.
+        """
+        addresses = list()
+        for child in definition.childNodes:
+            child_addresses = self._get_child(child)
+            if child_addresses is not None:
+                addresses.append(child_addresses)
+            elif child.nodeType == child.ELEMENT_NODE:
+                return None
+        return addresses or None
+
+    def _get_identity(self, attributes):
+        """
+        Return the identity of the definition of a credential: all its
+        attributes, so the definitions differing by any of them (such as the
+        security name and the passphrases of SNMPv3) are never merged.
+        """
+        return tuple(sorted(attributes.items()))
+
+    def _define(self, credentials):
+        """
+        Add credentials, dictionaries of attributes with the optional begin
+        and end of their addresses, in a single pass: the addresses of the
+        credentials are loaded into an interval map where the last one wins,
+        they are removed from the definitions holding them, and added to the
+        first definition with the same attributes or to a new one. The
+        definitions not holding these addresses are not modified, nor those
+        with other children (such as 'ip-match') or without address.
+        """
+        # Attributes of the new definitions by identity
+        attributes = dict()
+        # Identities of the new definitions, in order
+        new_identities = list()
+        items = list()
+        # The addresses of the credentials are parsed by chunks
+        for chunk in chunks(credentials, self.chunk_size):
+            bounds = list()
+            identities = list()
+            for credential in chunk:
+                credential = dict(credential)
+                begin = credential.pop("begin", None)
+                end = credential.pop("end", None)
+                if begin is None:
+                    # Default credential
+                    for attr in credential:
+                        self._index.set_attribute(self._config, attr,
+                                                  credential[attr])
+                    continue
+                if end is None:
+                    end = begin
+                identity = self._get_identity(credential)
+                if identity not in attributes:
+                    attributes[identity] = credential
+                    new_identities.append(identity)
+                bounds.extend([begin, end])
+                identities.append(identity)
+            bounds = parse_ips(bounds).tolist()
+            items.extend(zip(bounds[::2], bounds[1::2], identities))
+        # Addresses of each credential
+        wanted = dict()
+        for begin, end, identity in IntervalMap(items):
+            wanted.setdefault(identity, list()).append((begin, end))
+        covered = IntervalSet([(begin, end) for begin, end, identity in items])
+        # Update the definitions which already exist, keeping the addresses
+        # which have not changed
+        removed = list()
+        for definition in self._index.elements("definition"):
+            addresses = self._get_addresses(definition)
+            if addresses is None:
+                continue
+            identity = self._get_identity(dict(definition.attributes.items()))
+            old = IntervalSet(addresses)
+            new = old - covered
+            if identity in wanted:
+                new = new | IntervalSet(wanted.pop(identity))
+            if new == old:
+                continue
+            if len(new):
+                removed.extend(self._set_addresses(definition, new))
+            else:
+                removed.append(definition)
+        self._index.remove_many(removed)
+        for identity in new_identities:
+            if identity not in wanted:
+                continue
+            definition = self._doc.createElement("definition")
+            for attr, value in attributes[identity].items():
+                definition.setAttribute(attr, value)
+            for begin, end in wanted[identity]:
+                definition.appendChild(self._create_child(begin, end))
+            self._index.append(self._config, definition)
+
     def create_element(self, protocol, begin = None, end = None, **credential):
         """ Define a creditential and add it to the configuration """
-        element = None
-        if begin is None:
-            # Add default credential
-            element = self._config
-        else:
-            # Firs we need some lambda expressions ...
-            # Become true if 'dic' and 'elt' have the same 'key'
-            have_same_attr = lambda dic, elt, key: \
-                key in dic and \
-                elt.hasAttribute(key) and \
-                dic[key] == elt.getAttribute(key)
-            # Become true if 'dic' and 'elt' don't have 'key'
-            dont_have_attr = lambda dic, elt, key: \
-                key not in dic and \
-                not elt.hasAttribute(key)
-            # Become true if 'dic' and 'elt' have the same child text
-            have_same_spec = lambda dic, elt: \
-                "begin" in dic and \
-                elt.hasAttribute(key) and \
-                dic[key] == elt.getAttribute(key)
-            # Search if we can reuse a previous definition ...
-            for old_def in self._doc.getElementsByTagName("definition"):
-                if have_same_attr(credential, old_def, "read-community") and \
-                    (
-                        have_same_attr(credential, old_def, "version") or \
-                        dont_have_attr(credential, old_def, "version")
-                    ):
-                        # Reuse a SNMP definition
-                        element = old_def
-                elif have_same_attr(credential, old_def, "username") and \
-                     have_same_attr(credential, old_def, "domain"):
-                        # Reuse a WMI definition
-                        element = old_def
-                else:
-                    continue # the search for a reusable previous definition
-                # Quick check to see if we really need this entry
-                for old_range in element.getElementsByTagName("range"):
-                    old_lip = IP(old_range.getAttribute("begin"))
-                    old_rip = IP(old_range.getAttribute("end"))
-                    new_ip = IP(begin)
-                    assert old_lip < old_rip
-                    if end is not None:
-                        assert IP(begin) < IP(end)
-                    if old_lip <= new_ip and new_ip <= old_rip:
-                        warn_msg = lambda new, old: \
-                            "\tWarning: '%s' is in '%s', skipped!" % (new, old)
-                        # If begin is within an old range
-                        if end is None:
-                            # If it's a specific, then it is useless
-                            if self.verbosity > 1:
-                                print warn_msg(new_ip,
-                                               "%s-%s" % (old_lip, old_rip))
-                            return # We could stop here
-                        elif old_lip <= IP(end) and IP(end) <= old_rip:
-                            # If end is within the range too, then it's useless
-                            if self.verbosity > 1:
-                                print warn_msg("%s-%s" % (new_ip, IP(end)),
-                                               "%s-%s" % (old_lip, old_rip))
-                            return # We could stop here
-                    """
-                    #TODO: This introduce some bugs...
-                        elif old_rip <= IP(end):
-                            # Extend the right border of the old range
-                            old_range.setAttribute("end", end)
-                            return # We could stop here
-                    elif new_ip <= old_lip and end is not None:
-                        # If begin is at the left of the old range
-                        if old_lip <= IP(end) and IP(end) <= old_rip:
-                            # But end is within the range, then extend the left
-                            # border of the old range
-                            old_range.setAttribute("begin", begin)
-                            return # We could stop here
-                    """
-                break # No need to create a new definition, skip 'else'
-            else: # If we did not found any reusable definition
-                element = self._doc.createElement("definition")
-                self._config.appendChild(element)
-            # Search if we have to change some old ranges
-            for old_range in self._doc.getElementsByTagName("range"):
-                old_lip = IP(old_range.getAttribute("begin"))
-                old_rip = IP(old_range.getAttribute("end"))
-                new_lip = IP(begin)
-                new_rip = IP(end)
-                old_def = old_range.parentNode
-                # If old range borders are touching, create a new specific
-                if old_lip == old_rip:
-                    self._add_specific(old_def, old_lip)
-                # If the given ip or new range left border is in the old range
-                elif (old_lip <= new_lip and new_lip <= old_rip) or \
-                     (end is not None and new_lip <= old_lip and \
-                      old_lip <= new_rip):
-                    # And if there is room for a new left range, create it
-                    if old_lip < new_lip - 1:
-                        self._add_range(old_def, old_lip, (new_lip - 1))
-                    # Otherwise create a new ip for the old left border
-                    elif old_lip == new_lip - 1:
-                        self._add_specific(old_def, old_lip)
-                    # If we are adding a new ip
-                    if end is None:
-                        # And if there is room for a new right range, create it
-                        if new_lip + 1 < old_rip:
-                            self._add_range(old_def, new_lip + 1, old_rip)
-                        # Otherwise create a new ip for the old right border
-                        else:
-                            self._add_specific(old_def, old_rip)
-                    # If we are adding a new range
-                    else:
-                        # And if there is room for a new right range, create it
-                        if new_rip + 1 < old_rip:
-                            self._add_range(old_def, new_rip + 1, old_rip)
-                        # Otherwise if there is room for just a ip
-                        elif new_rip + 1 == old_rip:
-                            # create it for the old right border
-                            self._add_specific(old_def, old_rip)
-                else:
-                    # If we dont have changed the old range, stop here
+        if begin is not None:
+            credential["begin"] = begin
+        if end is not None:
+            credential["end"] = end
+        self._define([credential])
+
+    def _get_ranges(self):
+        """
+        Return an IntervalMap of the addresses to the first definition in
+        document order whose ranges or specific addresses contain them.
+        """
+        items = list()
+        for definition in self._index.elements("definition"):
+            for child in definition.childNodes:
+                addresses = self._get_child(child)
+                if addresses is not None:
+                    items.append(addresses + (definition,))
+        # The last item wins in the map
+        items.reverse()
+        return IntervalMap(items)
+
+    def get_lookup(self):
+        """
+        Return a DefinitionLookup of the definition OpenNMS uses for the
+        addresses: the first one in document order containing them.
+        """
+        positions = dict()
+        matches = list()
+        for position, definition in \
+            enumerate(self._index.elements("definition")):
+            positions[definition] = position
+            for child in definition.childNodes:
+                if child.nodeType != child.ELEMENT_NODE or \
+                   child.tagName != "ip-match":
+                    continue
+                try:
+                    match = IPMatch(key_of(child, None))
+                except ValueError, e:
+                    print >> sys.stderr, "Warning: %s, ignored" % e
                     continue
-                # Otherwise remove it
-                old_def.removeChild(old_range)
-            # Search if we could remove some old specific
-            for old_spec in self._doc.getElementsByTagName("specific"):
-                old_ip = IP(old_spec.firstChild.nodeValue)
-                new_ip = IP(begin)
-                old_def = old_spec.parentNode
-                if old_ip == new_ip:
-                    old_def.removeChild(old_spec)
-                    # Search if we could remove some empty definitions
-                for old_def in self._doc.getElementsByTagName("definition"):
-                    if not old_def.isSameNode(element):
-                        for child in old_def.childNodes:
-                            if child.nodeType is xml.dom.Node.ELEMENT_NODE:
-                                break
-                        else:
-                            self._config.removeChild(old_def)
-            child_element = None
-            if end is None:
-                # Add specific IP address
-                child_element = self._doc.createElement("specific")
-                child_element.appendChild(self._doc.createTextNode(begin))
+                matches.append((position, match, definition))
+        ranges = IntervalMap([(begin, end, (positions[definition],
+                                            definition))
+                              for begin, end, definition
+                              in self._get_ranges()])
+        return DefinitionLookup(ranges, matches, positions)
+
+    def normalize(self):
+        """
+        Rewrite the definitions with the minimal set of elements giving the
+        same credential to every address: the definitions with the same
+        attributes are merged in the first one, their overlapping or adjacent
+        ranges and specific addresses are merged, and the addresses of a
+        definition hidden by a previous one are removed, unless they join two
+        of its ranges. The definitions with other children (such as
+        'ip-match') are not modified, and the definitions are not merged
+        across them so they keep their place. Return a NormalizeSummary.
+        """
+        summary = NormalizeSummary(["definition", "range", "specific"])
+        summary.count(self._index, summary.before)
+        keys = dict()
+        # First definition of each key, and the keys in document order
+        kept = dict()
+        order = list()
+        # Number of definitions with other children before the current one
+        barriers = 0
+        for definition in self._index.elements("definition"):
+            for child in definition.childNodes:
+                if child.nodeType == child.ELEMENT_NODE and \
+                   self._get_child(child) is None:
+                    key = definition
+                    barriers += 1
+                    break
             else:
-                # Add range of IP addresses
-                child_element = self._doc.createElement("range")
-                for attr in ["begin", "end"]:
-                    child_element.setAttribute(attr, locals()[attr])
-            element.appendChild(child_element)
-        # Add or replace credential attributes
-        for attr in credential:
-            if element.hasAttribute(attr):
-                element.removeAttribute(attr)
-            element.setAttribute(attr, credential[attr])
+                key = (barriers, tuple(sorted(definition.attributes.items())))
+            keys[definition] = key
+            if key not in kept:
+                kept[key] = definition
+                order.append(key)
+        positions = dict([(key, i) for i, key in enumerate(order)])
+        # Addresses of each key, sorted
+        items = list(IntervalMap([(begin, end, keys[definition])
+                                  for begin, end, definition in
+                                  self._get_ranges()]))
+        owned = dict()
+        for i, (begin, end, key) in enumerate(items):
+            owned.setdefault(key, list()).append(i)
+        removed = [definition for definition in keys
+                   if kept[keys[definition]] is not definition]
+        for key in order:
+            definition = kept[key]
+            if key is definition:
+                continue
+            if key not in owned:
+                removed.append(definition)
+                continue
+            addresses = list()
+            previous = None
+            for i in owned[key]:
+                begin, end = items[i][:2]
+                if previous is not None and \
+                   self._is_hidden(items, previous, i, positions[key],
+                                   positions):
+                    addresses[-1] = (addresses[-1][0], end)
+                else:
+                    addresses.append((begin, end))
+                previous = i
+            removed.extend(self._set_addresses(definition, addresses))
+        self._index.remove_many(removed)
+        summary.count(self._index, summary.after)
+        return summary
+
+    def _is_hidden(self, items, first, last, position, positions):
+        """
+        Return True if the addresses between the items first and last of a
+        normalized definition are all given to the definitions before it,
+        at the given positions, so its ranges can be joined.
+        """
+        for i in xrange(first + 1, last + 1):
+            if items[i - 1][1] + 1 != items[i][0]:
+                return False
+            if i < last and positions[items[i][2]] >= position:
+                return False
+        return True
+
+    def find_definition(self, addr, definitions=None):
+        """
+        Return the definition used for addr, the root element for the default
+        credential, or None if addr is not a valid IPv4 address. definitions
+        is the result of get_lookup(), built again if not given.
+        """
+        if definitions is None:
+            definitions = self.get_lookup()
+        try:
+            key = int(IP(addr))
+        except (AssertionError, ValueError):
+            return None
+        return definitions.get(key, self._config)
+
+    def lookup(self, addresses):
+        """
+        Iterate over the (address, definition) pairs of addresses, see
+        find_definition(). Each lookup is done in O(log n), plus the test of
+        the 'ip-match' patterns.
+        """
+        definitions = self.get_lookup()
+        for addr in addresses:
+            yield addr, self.find_definition(addr, definitions)
 
-    def add(self, **args):
-        """ Add SNMP or WMI creditentials """
-        proto = None
+    def describe(self, definition, definitions=None):
+        """
+        Return a description of a definition returned by lookup(), without
+        its secrets (see secret_attributes). definitions is the result of
+        get_lookup(), built again if not given.
+        """
+        if definition.isSameNode(self._config):
+            name = "default"
+        else:
+            if definitions is None:
+                definitions = self.get_lookup()
+            name = "definition %d" % (definitions.position(definition) + 1)
+        attributes = list()
+        for attr, value in sorted(definition.attributes.items()):
+            if attr in self.secret_attributes:
+                value = "****"
+            attributes.append("%s='%s'" % (attr, value))
+        return "%s: %s" % (name, " ".join(attributes))
+
+    def _prepare(self, args):
+        """
+        Return the attributes of a credential given as the arguments of add().
+        """
+        args = dict(args)
         msg = lambda p, t, n: "\tAdding %s credential for %s '%s'" % (p, t, n)
         if "username" in args and "domain" in args: # WMI
             if self.verbosity > 1:
                 print msg("WMI", "user",
                           "%s/%s" % (args["username"], args["domain"])),
-            proto = "wmi"
         elif "username" not in args and "domain" not in args: # SNMP
             if "community" in args:
                 if self.verbosity > 1:
                     print msg("SNMP", "community", args["community"]),
                 args["read-community"] = args["community"]
                 del args["community"]
-                proto = "snmp"
         if "begin" not in args:
             if self.verbosity > 1:
                 print "as the default credential ..."
@@ -592,7 +1190,20 @@ class Credentials(XMLConfig):
         else:
             if self.verbosity > 1:
                 print "for '%s' to '%s' ..." % (args["begin"], args["end"])
-        self.create_element(proto, **args)
+        return args
+
+    def add(self, **args):
+        """ Add SNMP or WMI creditentials """
+        self._define([self._prepare(args)])
+
+    def add_many(self, credentials):
+        """
+        Add SNMP or WMI credentials, given as dictionaries of the arguments
+        of add(), in a single pass. The order is kept: a credential replaces
+        the addresses it shares with the previous ones. credentials can be
+        any iterable, it is read once by chunks of chunk_size.
+        """
+        self._define(itertools.imap(self._prepare, credentials))
 
 
 class SnmpCredentials(Credentials):
@@ -609,46 +1220,28 @@ class Capabilities(XMLConfig):
     addresses for the SNMP or WMI protocol.
     """
 
-    def _add_property(self, plugin, key, value):
-        """
-        Internal method
-        Add a element named 'property' to the given 'plugin' element with two
-        attributes: 'key' and 'value'.
-        """
-        prop = self._doc.createElement("property")
-        prop.setAttribute("key", key)
-        prop.setAttribute("value", value)
-        plugin.appendChild(prop)
+    _wmi_plugin = XMLTemplate("""
+        <protocol-plugin protocol="WMI"
+            class-name="org.opennms.netmgt.capsd.plugins.WmiPlugin" scan="on"
+            user-defined="false">
+            <property key="timeout" value="2000"/>
+            <property key="retry" value="1"/>
+            <property key="matchType" value="all"/>
+            <property key="wmiClass" value="Win32_ComputerSystem"/>
+            <property key="wmiObject" value="Status"/>
+            <property key="compareOp" value="EQ"/>
+            <property key="compareValue" value="OK"/>
+            <property key="service-name" value="WMI"/>
+        </protocol-plugin>
+        """)
 
     def add_wmi(self):
         """ Add WMI protocol to the discovery daemon Capsd """
         if self.verbosity > 1:
             print "\tAdding WMI discovery capacibility ..."
-        """
-        root = self._doc.getElementsByTagName("capsd-configuration")
-        assert root.length == 1
-        config = root.item(0)
-        """
-        # Remove all hypothetical old entries
-        for old_plugin in self._doc.getElementsByTagName("protocol-plugin"):
-            if old_plugin.getAttribute("protocol") == "WMI":
-                self._config.removeChild(old_plugin)
-        plugin = self._doc.createElement("protocol-plugin")
-        self._config.appendChild(plugin)
-        plugin.setAttribute("protocol", "WMI")
-        plugin.setAttribute("class-name",
-                            "org.opennms.netmgt.capsd.plugins.WmiPlugin")
-        plugin.setAttribute("scan", "on")
-        plugin.setAttribute("user-defined", "false")
-        prop = lambda k, v: self._add_property(plugin, k, v)
-        prop("timeout", "2000")
-        prop("retry", "1")
-        prop("matchType", "all")
-        prop("wmiClass", "Win32_ComputerSystem")
-        prop("wmiObject", "Status")
-        prop("compareOp", "EQ")
-        prop("compareValue", "OK")
-        prop("service-name", "WMI")
+        # Replace the old entries, unless they are already up to date
+        self._upsert(self._config, self._wmi_plugin.create(self._doc),
+                     "protocol")
 
 class Authentification(XMLConfig):
 
@@ -657,29 +1250,61 @@ class Authentification(XMLConfig):
         Add new role everywhere old role is defined.
         """
         assert old != new
-        for url in self._doc.getElementsByTagName("intercept-url"):
+        for url in self._index.elements("intercept-url"):
             access = url.getAttribute("access")
             if not new in access.split(",") and old in access.split(","):
-                url.setAttribute("access", "%s,%s" % (access, new))
+                self._index.set_attribute(url, "access",
+                                          "%s,%s" % (access, new))
 
     def _remove_previous_bean(self, attr):
         """
         Remote any previous LDAP configuration.
         """
-        for bean in self._doc.getElementsByTagName("beans:bean"):
-            if bean.getAttribute("id") == attr:
-                bean.parentNode.removeChild(bean)
-
-    def _add_bean(self, attr_id, attr_class):
-        """
-        Add a bean to the configuration and return it.
-        """
-        self._remove_previous_bean(attr_id)
-        bean = self._doc.createElement("beans:bean")
-        self._config.appendChild(bean)
-        bean.setAttribute("id", attr_id)
-        bean.setAttribute("class", attr_class)
-        return bean
+        for bean in self._index.find_all("beans:bean", "id", attr):
+            self._index.remove(bean)
+
+    # Beans of the LDAP authentification
+    _ldap_beans = map(XMLTemplate, ["""
+        <beans:bean id="contextSource"
+            class="org.springframework.security.ldap.DefaultSpringSecurityContextSource">
+            <beans:constructor-arg value="ldap://%(address)s:%(port)s/%(domain)s"/>
+            <beans:property name="userDn" value="%(search_user)s"/>
+            <beans:property name="password" value="%(search_password)s"/>
+        </beans:bean>
+        """, """
+        <beans:bean id="ldapAuthProvider"
+            class="org.springframework.security.providers.ldap.LdapAuthenticationProvider">
+            <custom-authentication-provider/>
+            <beans:constructor-arg ref="ldapAuthenticator"/>
+            <beans:constructor-arg ref="ldapAuthoritiesPopulator"/>
+        </beans:bean>
+        """, """
+        <beans:bean id="ldapAuthenticator"
+            class="org.springframework.security.providers.ldap.authenticator.BindAuthenticator">
+            <beans:constructor-arg ref="contextSource"/>
+            <beans:property name="userSearch" ref="userSearch"/>
+        </beans:bean>
+        """, """
+        <beans:bean id="userSearch"
+            class="org.springframework.security.ldap.search.FilterBasedLdapUserSearch">
+            <beans:constructor-arg index="0" value="%(user_filter)s"/>
+            <beans:constructor-arg index="1" value="(%(auth_filter)s={0})"/>
+            <beans:constructor-arg index="2" ref="contextSource"/>
+            <beans:property name="searchSubtree" value="true"/>
+        </beans:bean>
+        """, """
+        <beans:bean id="ldapAuthoritiesPopulator"
+            class="org.springframework.security.ldap.populator.DefaultLdapAuthoritiesPopulator">
+            <beans:constructor-arg ref="contextSource"/>
+            <beans:constructor-arg value="%(role_filter)s"/>
+            <beans:property name="groupRoleAttribute" value="cn"/>
+            <beans:property name="groupSearchFilter" value="(member={0})"/>
+            <beans:property name="searchSubtree" value="true"/>
+            <beans:property name="rolePrefix" value=""/>
+            <beans:property name="convertToUpperCase" value="true"/>
+            <beans:property name="defaultRole" value="%(default_role)s"/>
+        </beans:bean>
+        """])
 
     def enable_ldap(self, address, port, domain, search_user, search_password,
                     user_filter, role_filter, auth_filter, default_role):
@@ -696,101 +1321,61 @@ class Authentification(XMLConfig):
             default_role:       Default role given to LDAP users
         """
 
-        sping = "org.springframework.security."
-
-        context_source = self._add_bean(
-            "contextSource",
-            sping + "ldap.DefaultSpringSecurityContextSource")
-        cons = self._doc.createElement("beans:constructor-arg")
-        context_source.appendChild(cons)
-        cons.setAttribute("value", "ldap://%s:%s/%s" % (address, port, domain))
-        prop = self._doc.createElement("beans:property")
-        context_source.appendChild(prop)
-        prop.setAttribute("name", "userDn")
-        prop.setAttribute("value", search_user)
-        prop = self._doc.createElement("beans:property")
-        context_source.appendChild(prop)
-        prop.setAttribute("name", "password")
-        prop.setAttribute("value", search_password)
-
-        ldap_auth_provider = self._add_bean(
-            "ldapAuthProvider",
-            sping + "providers.ldap.LdapAuthenticationProvider")
-        cust = self._doc.createElement("custom-authentication-provider")
-        ldap_auth_provider.appendChild(cust)
-        cons = self._doc.createElement("beans:constructor-arg")
-        ldap_auth_provider.appendChild(cons)
-        cons.setAttribute("ref", "ldapAuthenticator")
-        cons = self._doc.createElement("beans:constructor-arg")
-        ldap_auth_provider.appendChild(cons)
-        cons.setAttribute("ref", "ldapAuthoritiesPopulator")
-
-        ldap_auth = self._add_bean(
-            "ldapAuthenticator",
-            sping + "providers.ldap.authenticator.BindAuthenticator")
-        cons = self._doc.createElement("beans:constructor-arg")
-        ldap_auth.appendChild(cons)
-        cons.setAttribute("ref", "contextSource")
-        prop = self._doc.createElement("beans:property")
-        ldap_auth.appendChild(prop)
-        prop.setAttribute("name", "userSearch")
-        prop.setAttribute("ref", "userSearch")
-
-        user_search = self._add_bean(
-            "userSearch",
-            sping + "ldap.search.FilterBasedLdapUserSearch")
-        cons = self._doc.createElement("beans:constructor-arg")
-        user_search.appendChild(cons)
-        cons.setAttribute("index", "0")
-        cons.setAttribute("value", user_filter)
-        cons = self._doc.createElement("beans:constructor-arg")
-        user_search.appendChild(cons)
-        cons.setAttribute("index", "1")
-        cons.setAttribute("value", "(%s={0})" % auth_filter)
-        cons = self._doc.createElement("beans:constructor-arg")
-        user_search.appendChild(cons)
-        cons.setAttribute("index","2" )
-        cons.setAttribute("ref", "contextSource")
-        prop = self._doc.createElement("beans:property")
-        user_search.appendChild(prop)
-        prop.setAttribute("name", "searchSubtree")
-        prop.setAttribute("value", "true")
-
-        ldap_auth_populator = self._add_bean(
-            "ldapAuthoritiesPopulator",
-            sping + "ldap.populator.DefaultLdapAuthoritiesPopulator")
-        cons = self._doc.createElement("beans:constructor-arg")
-        ldap_auth_populator.appendChild(cons)
-        cons.setAttribute("ref", "contextSource")
-        cons = self._doc.createElement("beans:constructor-arg")
-        ldap_auth_populator.appendChild(cons)
-        cons.setAttribute("value", role_filter)
-        prop = self._doc.createElement("beans:property")
-        ldap_auth_populator.appendChild(prop)
-        prop.setAttribute("name", "groupRoleAttribute")
-        prop.setAttribute("value", "cn")
-        prop = self._doc.createElement("beans:property")
-        ldap_auth_populator.appendChild(prop)
-        prop.setAttribute("name", "groupSearchFilter")
-        prop.setAttribute("value", "(member={0})")
-        prop = self._doc.createElement("beans:property")
-        ldap_auth_populator.appendChild(prop)
-        prop.setAttribute("name", "searchSubtree")
-        prop.setAttribute("value", "true")
-        prop = self._doc.createElement("beans:property")
-        ldap_auth_populator.appendChild(prop)
-        prop.setAttribute("name", "rolePrefix")
-        prop.setAttribute("value", "")
-        prop = self._doc.createElement("beans:property")
-        ldap_auth_populator.appendChild(prop)
-        prop.setAttribute("name", "convertToUpperCase")
-        prop.setAttribute("value", "true")
-        prop = self._doc.createElement("beans:property")
-        ldap_auth_populator.appendChild(prop)
-        prop.setAttribute("name", "defaultRole")
-        prop.setAttribute("value", default_role)
+        parameters = dict(address=address, port=port, domain=domain,
+                          search_user=search_user,
+                          search_password=search_password,
+                          user_filter=user_filter, role_filter=role_filter,
+                          auth_filter=auth_filter, default_role=default_role)
+        for template in self._ldap_beans:
+            bean = template.create(self._doc, **parameters)
+            # Replace any previous bean with the same id
+            self._remove_previous_bean(bean.getAttribute("id"))
+            self._index.append(self._config, bean)
 
 class Mail(XMLConfig):
+    _sendmail_config = XMLTemplate("""
+        <sendmail-config name="%(name)s" attempt-interval="3000"
+            use-authentication="false" use-jmta="false" debug="false">
+            <sendmail-host host="%(server)s" port="25"/>
+            <sendmail-protocol char-set="utf-8" mailer="smtpsend"
+                message-content-type="text/plain" message-encoding="7-bit"
+                quit-wait="true" ssl-enable="false" start-tls="false"
+                transport="smtp"/>
+            <sendmail-message to="user@example.org" from="user@example.org"
+                subject="OpenNMS Test Message"
+                body="This is an OpenNMS test message."/>
+            <user-auth user-name="%(username)s" password="%(password)s"/>
+        </sendmail-config>
+        """)
+
+    _readmail_config = XMLTemplate("""
+        <readmail-config name="%(name)s" attempt-interval="1000"
+            delete-all-mail="false" mail-folder="INBOX" debug="true">
+            <javamail-property name="mail.pop3.apop.enable" value="false"/>
+            <javamail-property name="mail.pop3.rsetbeforequit" value="false"/>
+            <readmail-host host="%(server)s" port="143">
+                <readmail-protocol ssl-enable="false" start-tls="false"
+                    transport="pop3"/>
+            </readmail-host>
+            <user-auth user-name="%(username)s" password="%(password)s"/>
+        </readmail-config>
+        """)
+
+    _end2end_mail_config = XMLTemplate("""
+        <end2end-mail-config name="default" readmail-config-name="%(name)s"
+            sendmail-config-name="%(name)s"/>
+        """)
+
+    def __init__(self, xml_file, root_name = None):
+        XMLConfig.__init__(self, xml_file, root_name)
+        # JavaMail's .properties file, written on save()
+        self._properties = None
+
+    def save(self):
+        XMLConfig.save(self)
+        if self._properties is not None:
+            self._properties.write()
+
     def add(self, name, server, address, username, password):
         """
         Configure JavaMail with the following parameters:
@@ -805,105 +1390,33 @@ class Mail(XMLConfig):
         if self.verbosity > 1:
             print "\tConfiguring Mail ..."
 
-        self._doc.firstChild.setAttribute("default-read-config-name", name)
-        self._doc.firstChild.setAttribute("default-send-config-name", name)
-
-        for config in self._doc.getElementsByTagName("sendmail-config"):
-            if config.getAttribute("name") == name:
-                self._config.removeChild(config)
-        sendmail_config = self._doc.createElement("sendmail-config")
-        self._config.appendChild(sendmail_config)
-        sendmail_config.setAttribute("name", name)
-        sendmail_config.setAttribute("attempt-interval", "3000")
-        sendmail_config.setAttribute("use-authentication", "false")
-        sendmail_config.setAttribute("use-jmta", "false")
-        sendmail_config.setAttribute("debug", "false")
-
-        sendmail_host = self._doc.createElement("sendmail-host")
-        sendmail_config.appendChild(sendmail_host)
-        sendmail_host.setAttribute("host", server)
-        sendmail_host.setAttribute("port", "25")
-
-        sendmail_protocol = self._doc.createElement("sendmail-protocol")
-        sendmail_config.appendChild(sendmail_protocol)
-        sendmail_protocol.setAttribute("char-set", "utf-8")
-        sendmail_protocol.setAttribute("mailer", "smtpsend")
-        sendmail_protocol.setAttribute("message-content-type", "text/plain")
-        sendmail_protocol.setAttribute("message-encoding", "7-bit")
-        sendmail_protocol.setAttribute("quit-wait", "true")
-        sendmail_protocol.setAttribute("ssl-enable", "false")
-        sendmail_protocol.setAttribute("start-tls", "false")
-        sendmail_protocol.setAttribute("transport", "smtp")
-                     
-        sendmail_message = self._doc.createElement("sendmail-message")
-        sendmail_config.appendChild(sendmail_message)
-        sendmail_message.setAttribute("to", "user@example.org")
-        sendmail_message.setAttribute("from", "user@example.org")
-        sendmail_message.setAttribute("subject", "OpenNMS Test Message")
-        sendmail_message.setAttribute("body", "This is an OpenNMS test message.")
-
-        user_auth = self._doc.createElement("user-auth")
-        sendmail_config.appendChild(user_auth)
-        user_auth.setAttribute("user-name", username)
-        user_auth.setAttribute("password", password)
-
-        for config in self._doc.getElementsByTagName("readmail-config"):
-            if config.getAttribute("name") == name:
-                self._config.removeChild(config)
-        readmail_config = self._doc.createElement("readmail-config")
-        self._config.appendChild(readmail_config)
-        readmail_config.setAttribute("name", name)
-        readmail_config.setAttribute("attempt-interval", "1000")
-        readmail_config.setAttribute("delete-all-mail", "false")
-        readmail_config.setAttribute("mail-folder", "INBOX")
-        readmail_config.setAttribute("debug", "true")
-
-        javamail_property = self._doc.createElement("javamail-property")
-        readmail_config.appendChild(javamail_property)
-        javamail_property.setAttribute("name", "mail.pop3.apop.enable")
-        javamail_property.setAttribute("value", "false")
-
-        javamail_property = self._doc.createElement("javamail-property")
-        readmail_config.appendChild(javamail_property)
-        javamail_property.setAttribute("name", "mail.pop3.rsetbeforequit")
-        javamail_property.setAttribute("value", "false")
-
-        readmail_host = self._doc.createElement("readmail-host")
-        readmail_config.appendChild(readmail_host)
-        readmail_host.setAttribute("host", server)
-        readmail_host.setAttribute("port", "143")
-
-        readmail_protocol = self._doc.createElement("readmail-protocol")
-        readmail_host.appendChild(readmail_protocol)
-        readmail_protocol.setAttribute("ssl-enable", "false")
-        readmail_protocol.setAttribute("start-tls", "false")
-        readmail_protocol.setAttribute("transport", "pop3")
-
-        user_auth = self._doc.createElement("user-auth")
-        readmail_config.appendChild(user_auth)
-        user_auth.setAttribute("user-name", username)
-        user_auth.setAttribute("password", password)
-        
-        for config in self._doc.getElementsByTagName("end2end-mail-config"):
-            self._config.removeChild(config)
-        end2end_mail_config = self._doc.createElement("end2end-mail-config")
-        self._config.appendChild(end2end_mail_config)
-        end2end_mail_config.setAttribute("readmail-config-name", name)
-        end2end_mail_config.setAttribute("sendmail-config-name", name)
-        end2end_mail_config.setAttribute("name", "default")
+        self._index.set_attribute(self._doc.firstChild,
+                                  "default-read-config-name", name)
+        self._index.set_attribute(self._doc.firstChild,
+                                  "default-send-config-name", name)
+
+        parameters = dict(name=name, server=server, username=username,
+                          password=password)
+        self._upsert(self._config,
+                     self._sendmail_config.create(self._doc, **parameters),
+                     "name")
+        self._upsert(self._config,
+                     self._readmail_config.create(self._doc, **parameters),
+                     "name")
+        # There is only one end-to-end configuration
+        self._upsert(self._config,
+                     self._end2end_mail_config.create(self._doc, **parameters))
 
         admin_conf = "%s/javamail-configuration.properties" \
                      % os.path.dirname(self._xml_file)
         if self.verbosity > 1:
             print "\tConfiguring .properties file ..."       
-        with open(admin_conf, 'w') as f:
-            f.write("org.opennms.core.utils.fromAddress=%s\n" % address)
-            f.write("org.opennms.core.utils.mailHost=%s\n" % server)
-            f.write("org.opennms.core.utils.useJMTA=false\n")
-            f.write("org.opennms.core.utils.authenticate=false\n")
-            f.write("org.opennms.core.utils.messageContentType=text/plain\n")
-            f.write("org.opennms.core.utils.charset=utf-8\n")
-        f.close()
+        self._properties = PropertiesFile(admin_conf)
+        for key, value in (("fromAddress", address), ("mailHost", server),
+                           ("useJMTA", "false"), ("authenticate", "false"),
+                           ("messageContentType", "text/plain"),
+                           ("charset", "utf-8")):
+            self._properties.set("org.opennms.core.utils.%s" % key, value)
         
 ##########################################
 #             Main Function              #
@@ -942,10 +1455,30 @@ def main():
         help = "Preview modifications of OpenNMS configuration",
         action = "store_true",
         dest = "pretty_print")
+    parser.add_option("--reformat", \
+        help = "Rewrite the whole XML files with the pretty printer instead of "
+               "only the modified elements",
+        action = "store_true")
+    parser.add_option("--discovery-cost", \
+        help = "Estimate the number of addresses probed by a discovery cycle " \
+               "and its duration",
+        action = "store_true",
+        dest = "discovery_cost")
+    parser.add_option("--no-validate", \
+        help = "Do not validate the XML files against OpenNMS's schemas " \
+               "before writing them",
+        action = "store_false",
+        default = True,
+        dest = "validate")
 
 
     (options, args) = parser.parse_args()
 
+    # The rules read from files are unicode, they are printed in UTF-8 when
+    # the output is not a terminal
+    if sys.stdout.encoding is None:
+        sys.stdout = UTF8Output(sys.stdout)
+
     # Check if we've got a valid configuration directory
     if not os.path.isfile("%s/opennms.properties" % options.configuration_path):
         print >> sys.stderr, \
@@ -971,11 +1504,36 @@ def main():
     errors_detected = 0
     print_error = lambda l, n, t: "Error in %s: '%s' is not a valid %s!" \
                                   % (l, n, t)
+    # Check the required parameters of the rules which can be read from
+    # files, the files are read again when the rules are applied
+    required = {
+        "USERS": ["uid", "pwd"],
+        "ADD_ADDRESSES": ["addr"],
+        "INCLUDE_RANGES": ["begin", "end"],
+        "EXCLUDE_RANGES": ["begin", "end"],
+        "SNMP_CREDENTIALS": [],
+        "WMI_CREDENTIALS": [],
+    }
+    known_uids = set()
+    for name, parameters in required.items():
+        try:
+            for rule in get_rules(config_rules, name):
+                for parameter in parameters:
+                    if parameter not in rule:
+                        errors_detected += 1
+                        print >> sys.stderr, "Error in %s: '%s' is " \
+                                             "missing in %s!" \
+                                             % (name, parameter, rule)
+                if name == "USERS":
+                    known_uids.add(rule.get('uid'))
+        except (IOError, ValueError), e:
+            errors_detected += 1
+            print >> sys.stderr, "Error in %s: %s" % (name, e)
     # Check if all users mentionned in GROUPS exist in USERS
     for uids in [group['users'] for group in config_rules.GROUPS if 'users'
                                                                      in group]:
         for uid in uids:
-            if uid not in [user['uid'] for user in config_rules.USERS]:
+            if uid not in known_uids:
                 errors_detected += 1
                 print >> sys.stderr, print_error("GROUPS", uid, "user")
     # Check if all groups mentionned in ROLES exist in GROUPS
@@ -987,7 +1545,7 @@ def main():
     # Check if all users mentionned in ROLES exist in USERS
     for uid in [role['supervisor'] for role in config_rules.ROLES
                                                       if 'supervisor' in role]:
-        if uid not in [user['uid'] for user in config_rules.USERS]:
+        if uid not in known_uids:
             errors_detected += 1
             print >> sys.stderr, print_error("ROLES", uid, "user")
     # Exit if errors detected
@@ -1028,6 +1586,34 @@ def main():
     ]    
     is_mail_enabled = lambda c: not False in [is_def(c, v) for v in mail_vars]
 
+    # Load the unchanged XML files from the cache of the previous runs
+    try:
+        XMLFile.set_cache(XMLCache("%s/xml" % params.opennms_script_state_path))
+    except OSError, e:
+        print >> sys.stderr, "Warning: the XML cache is disabled (%s)" % e
+
+    # Keep the text of the XML files, except for the modified elements
+    XMLFile.set_preserve_format(not options.reformat)
+
+    # Share the XML trees between the configuration objects and the plugins,
+    # each file will be parsed once and written once at the end
+    registry = XMLRegistry(options.verbosity)
+    XMLFile.set_registry(registry)
+
+    # Check the XML files against the schemas of OpenNMS before writing them
+    if options.validate:
+        if not xmlvalidate.is_available():
+            if options.verbosity > 0:
+                print "Validation disabled: 'lxml' is not installed"
+        elif not os.path.isdir(params.opennms_xsd_path):
+            if options.verbosity > 0:
+                print "Validation disabled: '%s' doesn't exist" \
+                      % params.opennms_xsd_path
+        else:
+            registry.validator = xmlvalidate.SchemaValidator(
+                params.opennms_xsd_path,
+                "%s/xsd" % params.opennms_script_state_path)
+
     # Apply modifications listed in 'config_rules.py'
     print "#" * 80
     print "Loading modifications listed in 'config_rules.py' ..."
@@ -1063,6 +1649,8 @@ def main():
             # Get LDAP USERS
             ldap_group = None
             ldap_group_users = list()
+            # LDAP users, imported with the other users
+            new_elements = list()
             if key in ("users", "groups") and is_ldap_enabled(config_rules):
                    try:
                        import ldap
@@ -1106,18 +1694,34 @@ def main():
                                                      "LDAP_USERS_PASSWORD")
                                elem['ro'] = getattr(config_rules,
                                                     "LDAP_USERS_READ_ONLY")
-                               config.add(**elem)
+                               new_elements.append(elem)
                            elif key == "groups":
                                # Populate the ldap default group
                                ldap_group_users.append(elem['uid'])
 
             # Add elements to the XML configuration
-            if hasattr(config_rules, key.upper()):
+            if key in ["users", "snmp_credentials", "wmi_credentials"]:
+                # The rules are read from their files while they are added
+                new_elements = itertools.chain(new_elements,
+                                               get_rules(config_rules,
+                                                         key.upper()))
+            elif hasattr(config_rules, key.upper()):
                 for elem in getattr(config_rules, key.upper()):
                     if key == "groups" and ldap_group is not None and \
                        elem['name'] == ldap_group:
                            elem['users'].extend(ldap_group_users)
                     config.add(**elem)
+            if key == "users":
+                summary = config.add_many(new_elements)
+                if options.verbosity > 0:
+                    print "Users: %s" % summary
+            elif key in ["snmp_credentials", "wmi_credentials"]:
+                config.add_many(new_elements)
+                if getattr(config_rules, "NORMALIZE_%s" % key.upper(), False):
+                    summary = config.normalize()
+                    if options.verbosity > 0:
+                        print "Normalized %s: %s" \
+                              % (key.replace("_", " "), summary)
             if key == "mail":
                 name = getattr(config_rules, "MAIL_NAME")
                 server = getattr(config_rules, "MAIL_SERVER")
@@ -1145,11 +1749,16 @@ def main():
                 getattr(config, "add_wmi")()
                 
         elif key == "discovery":
-            for action in ["include_ranges", "exclude_ranges", "add_addresses"]:
-                config_param = action.upper()
-                if hasattr(config_rules, config_param):
-                    for elem in getattr(config_rules, config_param):
-                        getattr(config, action.split("_")[0])(**elem)
+            config.manage_ranges(get_rules(config_rules, "INCLUDE_RANGES"),
+                                 get_rules(config_rules, "EXCLUDE_RANGES"))
+            for elem in get_rules(config_rules, "ADD_ADDRESSES"):
+                config.add(**elem)
+            if getattr(config_rules, "COMPACT_ADDRESSES", False):
+                config.compact()
+            if options.discovery_cost:
+                print "Discovery cost:"
+                for line in str(config.estimate_cost()).split("\n"):
+                    print "\t%s" % line
                         
         elif key == "authentification" and is_ldap_enabled(config_rules):
             ldap_address = getattr(config_rules, "LDAP_ADDRESS")
@@ -1187,7 +1796,11 @@ def main():
             if getattr(options, param):
                 getattr(config, param)()
 
-    for plugin_type in ["PLUGINS", "PROCESS", "WIN32_SERVICES", 
+    # The plugins must not write the modifications which have not been saved
+    if not options.save:
+        registry.clear()
+
+    for plugin_type in ["PLUGINS", "PROCESS", "WIN32_SERVICES",
                         "ORACLE_INSTANCE_LINUX", "DATABASE"]:
         if not hasattr(config_rules, plugin_type):
             continue
@@ -1216,7 +1829,18 @@ def main():
                     print "... for '%s'" % plugin_name["database"]
                 elif not plugin_type == "PLUGINS":
                     print "... for daemon '%s'" % plugin_name["name"]
-        
+
+    # Write every modified XML file
+    written = registry.flush()
+    if options.verbosity > 0:
+        print "%d XML file(s) written" % written
+        if XMLFile.get_cache() is not None:
+            print "XML cache: %s" % XMLFile.get_cache()
+        if registry.validator is not None:
+            print "XML validation: %s" % registry.validator
+    if registry.invalid:
+        sys.exit("Error: %d XML file(s) not written because they are not " \
+                 "valid" % len(registry.invalid))
                 
 if __name__ == "__main__":
 
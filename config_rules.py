@@ -22,6 +22,18 @@
 #     detect a previous version if his is different.
 #   * One more time: "backup.py" and "restore.py" are easy so use them!
 #
+# The users, addresses, ranges and credentials can also be read from files
+# listed by the variables ending with "_FILES", with paths relative to this
+# file: CSV files whose first row names the parameters, or JSON-lines files
+# holding one object by line. The rules of the files are applied after those
+# of this file, and the files are read as they are applied so their size
+# doesn't matter. Ex:
+#     USERS_FILES = ["users.csv"] with "users.csv" containing:
+#         uid,pwd,name,mail,ro
+#         carol,carolsecret,Carol,carol@example.com,False
+#     SNMP_CREDENTIALS_FILES = ["snmp.jsonl"] with "snmp.jsonl" containing:
+#         {"community": "private", "begin": "10.0.0.1", "end": "10.0.0.9"}
+#
 
 ################################################################################
 # Add a list of users to the default configuration
@@ -47,6 +59,7 @@ USERS = [
     {'uid': 'bob', 'pwd': 'bobsecret', 'name': 'Bob', 'mail': 'bob@example.com'},
     {'uid': 'eve', 'pwd': 'evesecret', 'name': 'Eve', 'ro' : 'True'},
 ]
+USERS_FILES = []
 
 ################################################################################
 # Add a list of groups to the default configuration
@@ -98,6 +111,11 @@ ADD_ADDRESSES = [
     {'addr': '192.168.1.13'},
     {'addr': '192.168.1.37'},
 ]
+ADD_ADDRESSES_FILES = []
+
+# Remove the addresses already included by a range, and replace the runs of
+# consecutive addresses with the same retries and timeout by include ranges
+COMPACT_ADDRESSES = False
 
 ################################################################################
 # Include a list of IP address to the default configuration
@@ -114,6 +132,7 @@ REMOVE_PREVIOUS_INCLUDE_RANGES = True
 INCLUDE_RANGES = [
     {'begin': '192.168.0.1', 'end': '192.168.0.254'},
 ]
+INCLUDE_RANGES_FILES = []
 
 ################################################################################
 # Exclude a list of IP address from the default configuration
@@ -128,6 +147,7 @@ REMOVE_PREVIOUS_EXCLUDE_RANGES = True
 EXCLUDE_RANGES = [
 #    {'begin': '10.0.2.0', 'end': '10.0.2.255'},
 ]
+EXCLUDE_RANGES_FILES = []
 
 ################################################################################
 # Set the status of one or more of the following services:
@@ -157,12 +177,15 @@ SNMP_THRESHOLDING = True
 # and refer to a specific IP address
 #
 REMOVE_PREVIOUS_SNMP_CREDENTIALS = True
+# Merge the definitions with the same attributes and their ranges
+NORMALIZE_SNMP_CREDENTIALS = False
 SNMP_CREDENTIALS = [
     {'community': 'public', 'version': 'v2c'},
     {'community': 'public', 'begin': '192.168.0.10', 'end': '192.168.0.19', 'version': 'v1'},
     {'community': 'private', 'begin': '192.168.1.13'},
     {'community': 'private', 'begin': '192.168.1.37'},
 ]
+SNMP_CREDENTIALS_FILES = []
 
 ################################################################################
 # Add WMI credentials to the default configuration (OpenNMS > 1.7)
@@ -187,13 +210,16 @@ SNMP_CREDENTIALS = [
 # Ex:
 #     If we define [192.168.0.1-192.168.0.254] for user A and [192.168.0.8] for
 #     user B, user A will get [192.168.0.1-192.168.0.7] and
-#     [192.168.0.7-192.168.0.254].
+#     [192.168.0.9-192.168.0.254].
 #
 #
 REMOVE_PREVIOUS_WMI_CREDENTIALS = True
+# Merge the definitions with the same attributes and their ranges
+NORMALIZE_WMI_CREDENTIALS = False
 WMI_CREDENTIALS = [
 #    {'username': 'wmiuser', 'domain': 'EXAMPLE', 'password': 'secret'},
 ]
+WMI_CREDENTIALS_FILES = []
 
 ################################################################################
 # Add a list of plugin to the default configuration
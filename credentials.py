@@ -0,0 +1,102 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Copyright (C) 2010 Vincent Ollivier <contact@vincentollivier.com>
+
+This file is part of OpenNMS Configuration Tools.
+
+OpenNMS Configuration Tools is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Foobar is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with OpenNMS Configuration Tools. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import optparse
+import os
+import sys
+
+import params
+from config import SnmpCredentials, WmiCredentials
+
+##########################################
+#             Main Function              #
+##########################################
+
+def main():
+
+    ##########################################
+    #            Parse arguments             #
+    ##########################################
+
+    parser = optparse.OptionParser(usage="%prog [options] [<address> ...]",
+                                   version="%prog 0.1.1")
+    parser.add_option("-c", "--configuration-path",
+        help = "If OpenNMS's configuration path is not '%s', fix it to the " \
+               "given path." % params.opennms_config_path,
+        metavar = "<path>",
+        default = params.opennms_config_path)
+    parser.add_option("-p", "--protocol",
+        help = "Look for the credentials of the given protocol only, 'snmp' " \
+               "or 'wmi'.",
+        metavar = "<protocol>",
+        choices = ["snmp", "wmi"])
+
+    (options, args) = parser.parse_args()
+
+    # Read the addresses on the standard input if none are given
+    if not args or args == ["-"]:
+        addresses = (line.strip() for line in sys.stdin)
+        addresses = (addr for addr in addresses
+                     if addr and not addr.startswith("#"))
+    else:
+        addresses = args
+
+    # Load the credentials of each protocol
+    credentials = list()
+    for protocol, cls in [("snmp", SnmpCredentials),
+                          ("wmi", WmiCredentials)]:
+        if options.protocol not in (None, protocol):
+            continue
+        config_file = "%s/%s-config.xml" % (options.configuration_path,
+                                            protocol)
+        if not os.path.isfile(config_file):
+            if options.protocol is not None:
+                sys.exit("Cannot open '%s': No such file" % config_file)
+            continue
+        config = cls(config_file, "%s-config" % protocol)
+        config.verbosity = 0
+        credentials.append((protocol, config, config.get_lookup(), dict()))
+    if not credentials:
+        sys.exit("No credential file found in '%s'" \
+                 % options.configuration_path)
+
+    # Look for the definition used for each address
+    errors = 0
+    for addr in addresses:
+        for protocol, config, definitions, descriptions in credentials:
+            definition = config.find_definition(addr, definitions)
+            if definition is None:
+                print >> sys.stderr, "Error: '%s' is not a valid IPv4 " \
+                                     "address!" % addr
+                errors += 1
+                break
+            if definition not in descriptions:
+                descriptions[definition] = config.describe(definition,
+                                                           definitions)
+            print "%s\t%s\t%s" % (addr, protocol, descriptions[definition])
+    if errors:
+        sys.exit(os.EX_DATAERR)
+
+if __name__ == "__main__":
+
+    main()
+    sys.exit(os.EX_OK)
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (C) 2010 Vincent Ollivier <contact@vincentollivier.com>
+
+This file is part of OpenNMS Configuration Tools.
+
+OpenNMS Configuration Tools is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Foobar is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with OpenNMS Configuration Tools. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import bisect
+import heapq
+import sys
+
+"""
+This library contains sets of integer intervals and maps of integer intervals
+to values, kept sorted and disjoint, used to merge ranges of IP addresses.
+The intervals are inclusive (begin, end) pairs.
+"""
+
+class IntervalSet(object):
+    """
+    This class is a set of integers stored as sorted disjoint intervals: the
+    overlapping and adjacent intervals given are merged. The sets computed
+    from a set are of its class.
+    """
+
+    def __init__(self, intervals=()):
+        self._begins = list()
+        self._ends = list()
+        for begin, end in sorted(intervals):
+            assert begin <= end
+            if self._ends and begin <= self._ends[-1] + 1:
+                if end > self._ends[-1]:
+                    self._ends[-1] = end
+            else:
+                self._begins.append(begin)
+                self._ends.append(end)
+
+    def __iter__(self):
+        return iter(zip(self._begins, self._ends))
+
+    def __len__(self):
+        """
+        Return the number of intervals.
+        """
+        return len(self._begins)
+
+    def __contains__(self, value):
+        i = bisect.bisect_right(self._begins, value) - 1
+        return i >= 0 and value <= self._ends[i]
+
+    def __eq__(self, other):
+        if not isinstance(other, IntervalSet):
+            return NotImplemented
+        return self._begins == other._begins and self._ends == other._ends
+
+    def __ne__(self, other):
+        if not isinstance(other, IntervalSet):
+            return NotImplemented
+        return not self == other
+
+    __hash__ = None
+
+    def count(self):
+        """
+        Return the number of integers of the set.
+        """
+        return sum([end - begin + 1 for begin, end in self])
+
+    def union(self, other):
+        return self.__class__(list(self) + list(other))
+
+    def intersection(self, other):
+        """
+        Return the set of the integers which are also in other.
+        """
+        intervals = list()
+        i = j = 0
+        while i < len(self._begins) and j < len(other._begins):
+            begin = max(self._begins[i], other._begins[j])
+            end = min(self._ends[i], other._ends[j])
+            if begin <= end:
+                intervals.append((begin, end))
+            # Move past the interval which ends first
+            if self._ends[i] < other._ends[j]:
+                i += 1
+            else:
+                j += 1
+        return self.__class__(intervals)
+
+    def overlapping(self, begin, end):
+        """
+        Return the intervals of the set overlapping (begin, end).
+        """
+        i = max(bisect.bisect_right(self._begins, begin) - 1, 0)
+        intervals = list()
+        while i < len(self._begins) and self._begins[i] <= end:
+            if self._ends[i] >= begin:
+                intervals.append((self._begins[i], self._ends[i]))
+            i += 1
+        return intervals
+
+    def subtract(self, begin, end):
+        """
+        Return the parts of (begin, end) which are not in the set.
+        """
+        parts = list()
+        for excluded_begin, excluded_end in self.overlapping(begin, end):
+            if excluded_begin > begin:
+                parts.append((begin, excluded_begin - 1))
+            begin = excluded_end + 1
+        if begin <= end:
+            parts.append((begin, end))
+        return parts
+
+    def difference(self, other):
+        """
+        Return the set of the integers which are not in other.
+        """
+        intervals = list()
+        for begin, end in self:
+            intervals.extend(other.subtract(begin, end))
+        return self.__class__(intervals)
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+
+class IntervalMap(object):
+    """
+    This class map sorted disjoint intervals to values. The (begin, end,
+    value) items are applied in the order given, so the last one wins where
+    they overlap, and the adjacent intervals of equal values are merged.
+    """
+
+    def __init__(self, items=()):
+        items = list(items)
+        self._items = list()
+        if not items:
+            return
+        # Sweep the bounds of the intervals, keeping the intervals covering
+        # the current position in a heap ordered by priority
+        points = set()
+        for begin, end, value in items:
+            assert begin <= end
+            points.add(begin)
+            points.add(end + 1)
+        points = sorted(points)
+        starts = sorted(range(len(items)), key=lambda i: items[i][0])
+        heap = list()
+        next_start = 0
+        for i, point in enumerate(points[:-1]):
+            while next_start < len(starts) and \
+                  items[starts[next_start]][0] == point:
+                heapq.heappush(heap, -starts[next_start])
+                next_start += 1
+            while heap and items[-heap[0]][1] < point:
+                heapq.heappop(heap)
+            if heap:
+                self._add(point, points[i + 1] - 1, items[-heap[0]][2])
+
+    def _add(self, begin, end, value):
+        """
+        Add an interval after the last one.
+        """
+        if self._items:
+            last_begin, last_end, last_value = self._items[-1]
+            if last_end + 1 == begin and last_value == value:
+                self._items[-1] = (last_begin, end, value)
+                return
+        self._items.append((begin, end, value))
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        """
+        Return the value of the interval containing key.
+        """
+        i = bisect.bisect_right(self._items, (key, sys.maxint)) - 1
+        if i >= 0 and key <= self._items[i][1]:
+            return self._items[i][2]
+        return default
+
+    def difference(self, interval_set):
+        """
+        Return the map without the integers of interval_set.
+        """
+        result = IntervalMap()
+        for begin, end, value in self._items:
+            for part_begin, part_end in interval_set.subtract(begin, end):
+                result._add(part_begin, part_end, value)
+        return result
@@ -18,45 +18,341 @@ You should have received a copy of the GNU General Public License
 along with OpenNMS Configuration Tools. If not, see <http://www.gnu.org/licenses/>.
 """
 
-import sys
 
-class IP:
+import array
+import re
+
+from intervals import IntervalSet
+
+"""
+This library contains an IPv4 address type backed by an integer, with a
+cached parser of the dot-decimal notation, a parser of whole lists of
+addresses, a set of IPv4 addresses stored as ranges, and the 'ip-match'
+patterns of OpenNMS.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Number of dot-decimal strings whose value is cached by parse_ip()
+PARSE_CACHE_SIZE = 8192
+
+# Values of the recently parsed strings, in two generations: when the new
+# one is full it becomes the old one, and the strings found in the old one
+# are moved back to the new one, so the least recently used are dropped
+_new_parsed = dict()
+_old_parsed = dict()
+
+# Dot-decimal notation, with the same rules as _parse_ips_numpy(): int()
+# alone would accept signs, blanks and non-ASCII digits
+_DOTTED = re.compile(r"([0-9]{1,3})\.([0-9]{1,3})\."
+                     r"([0-9]{1,3})\.([0-9]{1,3})\Z")
+
+# Decimal notation of the bytes
+_BYTES = [str(byte) for byte in range(256)]
+
+# Type of the arrays of addresses without NumPy, of at least 32 bits
+_ARRAY_TYPE = array.array("I").itemsize >= 4 and "I" or "L"
+
+def parse_ip(ip_address):
+    """
+    Return the integer value of an IPv4 address in dot-decimal notation, or
+    raise ValueError if it is not valid.
+    """
+    global _new_parsed, _old_parsed
+    value = _new_parsed.get(ip_address)
+    if value is not None:
+        return value
+    value = _old_parsed.get(ip_address)
+    if value is None:
+        match = _DOTTED.match(ip_address)
+        if match is None:
+            raise ValueError("'%s' is not an IPv4 address" % ip_address)
+        a, b, c, d = map(int, match.groups())
+        if (a | b | c | d) >> 8:
+            raise ValueError("'%s' is not an IPv4 address" % ip_address)
+        value = (a << 24) | (b << 16) | (c << 8) | d
+    if len(_new_parsed) >= PARSE_CACHE_SIZE / 2:
+        _old_parsed = _new_parsed
+        _new_parsed = dict()
+    _new_parsed[ip_address] = value
+    return value
+
+def _check_integer(value):
+    """
+    Return value, the integer value of an IPv4 address, or raise ValueError if
+    it is out of range.
+    """
+    if not 0 <= value <= 0xFFFFFFFF:
+        raise ValueError("%d is not the value of an IPv4 address" % value)
+    return value
+
+def format_ip(value):
+    """
+    Return the dot-decimal notation of the integer value of an IPv4 address,
+    or raise ValueError if it is out of range.
+    """
+    _check_integer(value)
+    return "%s.%s.%s.%s" % (_BYTES[value >> 24], _BYTES[(value >> 16) & 255],
+                            _BYTES[(value >> 8) & 255], _BYTES[value & 255])
+
+def _parse_ips_numpy(addresses):
+    try:
+        strings = numpy.array(addresses, dtype=str)
+    except UnicodeError:
+        raise ValueError("the addresses are not ASCII")
+    # One row of characters by address, padded with NUL
+    chars = strings.view(numpy.uint8).reshape(len(addresses), -1)
+    valid = (chars == 46).sum(axis=1) == 3
+    if valid.all():
+        # One row of characters by byte
+        tokens = numpy.array(".".join(strings.tolist()).split("."))
+        chars = tokens.view(numpy.uint8).reshape(len(tokens), -1)
+        is_char = chars != 0
+        is_digit = (chars >= 48) & (chars <= 57)
+        values = numpy.zeros(len(tokens), dtype=numpy.int64)
+        for column in range(chars.shape[1]):
+            values = numpy.where(is_char[:, column],
+                                 values * 10 + chars[:, column] - 48, values)
+        lengths = is_char.sum(axis=1)
+        valid_bytes = (is_digit | ~is_char).all(axis=1) & \
+                      (lengths >= 1) & (lengths <= 3) & (values <= 255)
+        valid = valid_bytes.reshape(-1, 4).all(axis=1)
+    if not valid.all():
+        raise ValueError("'%s' is not an IPv4 address"
+                         % addresses[int(numpy.argmin(valid))])
+    values = values.reshape(-1, 4)
+    return ((values[:, 0] << 24) | (values[:, 1] << 16) |
+            (values[:, 2] << 8) | values[:, 3]).astype(numpy.uint32)
+
+def parse_ips(addresses, sort=False, unique=False):
+    """
+    Return the integer values of the IPv4 addresses in dot-decimal
+    notation, sorted or sorted without duplicates if asked, as a NumPy
+    array of uint32 if NumPy is installed or an array.array otherwise. Use
+    tolist() to get Python integers. Raise ValueError on the first address
+    which is not valid.
+    """
+    addresses = [address.strip() for address in addresses]
+    if numpy is not None:
+        if not addresses:
+            return numpy.zeros(0, dtype=numpy.uint32)
+        values = _parse_ips_numpy(addresses)
+        if unique:
+            return numpy.unique(values)
+        if sort:
+            values.sort()
+        return values
+    values = [parse_ip(address) for address in addresses]
+    if unique:
+        values = list(set(values))
+    if sort or unique:
+        values.sort()
+    return array.array(_ARRAY_TYPE, values)
+
+def parse_range(text):
+    """
+    Return the first and last addresses, as integers, of a range written as
+    'begin-end', as a CIDR block 'address/prefix' or as a single address.
+    Raise ValueError if it is not valid.
+    """
+    text = text.strip()
+    if "/" in text:
+        address, prefix = text.split("/", 1)
+        prefix = int(prefix)
+        if not 0 <= prefix <= 32:
+            raise ValueError("'%s' is not a valid CIDR block" % text)
+        begin = parse_ip(address.strip())
+        size = 1 << (32 - prefix)
+        if begin & (size - 1):
+            raise ValueError("'%s' has host bits set" % text)
+        return begin, begin + size - 1
+    if "-" in text:
+        begin, end = [parse_ip(address.strip())
+                      for address in text.split("-", 1)]
+        if begin > end:
+            raise ValueError("'%s' is not a valid range" % text)
+        return begin, end
+    value = parse_ip(text)
+    return value, value
+
+def _integer(address):
+    """
+    Return the integer value of an address given as a string, an integer or
+    an IP.
+    """
+    if isinstance(address, basestring):
+        return parse_ip(address.strip())
+    return _check_integer(int(address))
+
+
+class IP(object):
     """
     Class for comparing IP address and do some math with them
     """
 
+    __slots__ = ("_ip_integer",)
+
     def __init__(self, ip_address):
         """
-        Create a new IP object from a given string containing the address
-        in quad dotted notation or from an integer.
+        Create a new IP object from a given string containing the address
+        in quad dotted notation, from an integer or from another IP. Raise
+        ValueError if the address is not valid or the integer out of range.
         """
-        try:
-            # Assume first that 'ip_address' is in quad dotted notation
-            ip_list = ip_address.split('.')
-        except AttributeError:
-            # Otherwise assume it is an integer
-            self._ip_integer = ip_address
+        if isinstance(ip_address, basestring):
+            self._ip_integer = parse_ip(ip_address)
+        elif isinstance(ip_address, IP):
+            self._ip_integer = ip_address._ip_integer
         else:
-            self._ip_integer = 0
-            assert len(ip_list) == 4
-            for index, number in enumerate(ip_list):
-                self._ip_integer += int(number) * 256 ** (3 - index)
+            self._ip_integer = _check_integer(int(ip_address))
 
     def __str__(self):
-        ip_integer = self._ip_integer
-        ip_string = ""
-        for exp in range(3, -1, -1):
-            ip_string += str(ip_integer / ( 256 ** exp )) + "."
-            ip_integer %= 256 ** exp
-        return(ip_string.rstrip('.'))
-
-    def __cmp__(self, other):
-        ret = self._ip_integer - other._ip_integer
-        return sys.maxint if ret > sys.maxint else -sys.maxint \
-                          if ret < -sys.maxint else ret
+        return format_ip(self._ip_integer)
+
+    def __repr__(self):
+        return "IP('%s')" % format_ip(self._ip_integer)
+
+    def __int__(self):
+        return self._ip_integer
+
+    def __hash__(self):
+        return hash(self._ip_integer)
+
+    def __eq__(self, other):
+        if not isinstance(other, IP):
+            return NotImplemented
+        return self._ip_integer == other._ip_integer
+
+    def __ne__(self, other):
+        if not isinstance(other, IP):
+            return NotImplemented
+        return self._ip_integer != other._ip_integer
+
+    def __lt__(self, other):
+        if not isinstance(other, IP):
+            return NotImplemented
+        return self._ip_integer < other._ip_integer
+
+    def __le__(self, other):
+        if not isinstance(other, IP):
+            return NotImplemented
+        return self._ip_integer <= other._ip_integer
+
+    def __gt__(self, other):
+        if not isinstance(other, IP):
+            return NotImplemented
+        return self._ip_integer > other._ip_integer
+
+    def __ge__(self, other):
+        if not isinstance(other, IP):
+            return NotImplemented
+        return self._ip_integer >= other._ip_integer
 
     def __add__(self, num):
         return IP(self._ip_integer + num)
 
     def __sub__(self, num):
         return IP(self._ip_integer - num)
+
+
+class IPSet(IntervalSet):
+    """
+    This class is a set of IPv4 addresses stored as sorted disjoint ranges,
+    so large ranges are handled at once. It is built from addresses (strings,
+    integers or IP), ranges written as 'begin-end' or as CIDR blocks (see
+    parse_range()) and (begin, end) pairs of addresses, and combined with
+    union(), intersection() and difference() (or |, & and -).
+    """
+
+    def __init__(self, ranges=()):
+        IntervalSet.__init__(self, [self._parse(item) for item in ranges])
+
+    def _parse(self, item):
+        if isinstance(item, basestring):
+            return parse_range(item)
+        if isinstance(item, tuple):
+            return (_integer(item[0]), _integer(item[1]))
+        value = _integer(item)
+        return value, value
+
+    def __contains__(self, address):
+        return IntervalSet.__contains__(self, _integer(address))
+
+    def ranges(self):
+        """
+        Iterate over the ranges of the set as (begin, end) pairs of IP.
+        """
+        for begin, end in IntervalSet.__iter__(self):
+            yield IP(begin), IP(end)
+
+    def _format_ranges(self):
+        """
+        Return the ranges of the set written as 'begin-end' or as a single
+        address.
+        """
+        ranges = list()
+        for begin, end in IntervalSet.__iter__(self):
+            if begin == end:
+                ranges.append(format_ip(begin))
+            else:
+                ranges.append("%s-%s" % (format_ip(begin), format_ip(end)))
+        return ranges
+
+    def __str__(self):
+        return ", ".join(self._format_ranges())
+
+    def __repr__(self):
+        return "IPSet(%r)" % self._format_ranges()
+
+
+class IPMatch(object):
+    """
+    This class is an 'ip-match' pattern of OpenNMS: it matches the IPv4
+    addresses whose four bytes are each in a list of values and ranges of
+    values separated by commas, or anything for '*'. Ex: '10.0-2.*.1,5,9-12'.
+    Raise ValueError if the pattern is not valid.
+    """
+
+    def __init__(self, pattern):
+        self.pattern = pattern.strip()
+        parts = self.pattern.split(".")
+        if len(parts) != 4:
+            raise ValueError("'%s' is not an ip-match pattern" % pattern)
+        self._bytes = [self._parse(part.strip()) for part in parts]
+
+    def _parse(self, part):
+        """
+        Return the set of the values of a byte.
+        """
+        if part == "*":
+            return IntervalSet([(0, 255)])
+        intervals = list()
+        for item in part.split(","):
+            bounds = item.strip().split("-")
+            for bound in bounds:
+                if not bound.isdigit() or int(bound) > 255:
+                    raise ValueError("'%s' is not an ip-match pattern"
+                                     % self.pattern)
+            if len(bounds) == 1:
+                intervals.append((int(bounds[0]), int(bounds[0])))
+            elif len(bounds) == 2 and int(bounds[0]) <= int(bounds[1]):
+                intervals.append((int(bounds[0]), int(bounds[1])))
+            else:
+                raise ValueError("'%s' is not an ip-match pattern"
+                                 % self.pattern)
+        return IntervalSet(intervals)
+
+    def __contains__(self, address):
+        value = _integer(address)
+        return (value >> 24) in self._bytes[0] and \
+               (value >> 16) & 255 in self._bytes[1] and \
+               (value >> 8) & 255 in self._bytes[2] and \
+               value & 255 in self._bytes[3]
+
+    def __str__(self):
+        return self.pattern
+
+    def __repr__(self):
+        return "IPMatch(%r)" % self.pattern
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (C) 2010 Vincent Ollivier <contact@vincentollivier.com>
+
+This file is part of OpenNMS Configuration Tools.
+
+OpenNMS Configuration Tools is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Foobar is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with OpenNMS Configuration Tools. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import textwrap
+
+import system
+
+"""
+This library contains an editor of Java .properties files: the file is parsed
+once, modified in memory, and written back at once. The lines of the
+properties which are not modified, comments included, are kept as they are.
+"""
+
+# Maximum length of the lines of the properties written
+LINE_LENGTH = 80
+
+_WHITESPACES = " \t\f"
+_ESCAPES = {"t": "\t", "n": "\n", "r": "\r", "f": "\f"}
+
+def _continues(line):
+    """
+    Return True if line ends with an odd number of backslashes.
+    """
+    count = len(line) - len(line.rstrip("\\"))
+    return count % 2 == 1
+
+def _unescape(data):
+    chars = list()
+    i = 0
+    while i < len(data):
+        char = data[i]
+        if char == "\\" and i + 1 < len(data):
+            i += 1
+            char = data[i]
+            if char == "u" and i + 4 < len(data):
+                char = unichr(int(data[i + 1:i + 5], 16))
+                i += 4
+            else:
+                char = _ESCAPES.get(char, char)
+        chars.append(char)
+        i += 1
+    return "".join(chars)
+
+def _escape(data, is_key=False):
+    data = data.replace("\\", "\\\\")
+    for char, escape in (("\t", "\\t"), ("\n", "\\n"), ("\r", "\\r"),
+                         ("\f", "\\f")):
+        data = data.replace(char, escape)
+    if is_key:
+        for char in "=: #!":
+            data = data.replace(char, "\\" + char)
+    elif data[:1] == " ":
+        data = "\\" + data
+    if isinstance(data, unicode):
+        data = "".join([ord(c) < 128 and c or "\\u%04x" % ord(c)
+                        for c in data]).encode("ascii")
+    return data
+
+def _split(logical_line):
+    """
+    Return the key and the value of a logical line.
+    """
+    line = logical_line.lstrip(_WHITESPACES)
+    i = 0
+    while i < len(line):
+        if line[i] == "\\":
+            i += 2
+            continue
+        if line[i] in "=:" or line[i] in _WHITESPACES:
+            break
+        i += 1
+    key = line[:i]
+    rest = line[i:].lstrip(_WHITESPACES)
+    if rest[:1] in ("=", ":"):
+        rest = rest[1:].lstrip(_WHITESPACES)
+    return _unescape(key), _unescape(rest)
+
+def split_list(value, separator=","):
+    """
+    Return the items of a list value.
+    """
+    return [item.strip() for item in value.split(separator) if item.strip()]
+
+
+class _Entry(object):
+    """
+    A property (key is not None) or a comment or blank line, with its text as
+    it is in the file, or None if it has been modified.
+    """
+
+    __slots__ = ("key", "value", "text", "removed")
+
+    def __init__(self, key, value, text):
+        self.key = key
+        self.value = value
+        self.text = text
+        self.removed = False
+
+
+def parse(text):
+    """
+    Return the list of the entries of the properties in text.
+    """
+    entries = list()
+    lines = text.splitlines(True)
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        i += 1
+        content = line.rstrip("\r\n").lstrip(_WHITESPACES)
+        if not content or content[0] in "#!":
+            entries.append(_Entry(None, None, line))
+            continue
+        raw = [line]
+        logical = content
+        while _continues(logical) and i < len(lines):
+            line = lines[i]
+            i += 1
+            raw.append(line)
+            logical = logical[:-1] + \
+                      line.rstrip("\r\n").lstrip(_WHITESPACES)
+        if _continues(logical):
+            logical = logical[:-1]
+        key, value = _split(logical)
+        entries.append(_Entry(key, value, "".join(raw)))
+    return entries
+
+
+class PropertiesFile(object):
+    """
+    This class load a .properties file, or start an empty one if it doesn't
+    exist, and apply the modifications done through set(), append(),
+    remove_from_list(), remove() and merge() when write() is called.
+    The new properties are added after the last property of the file.
+    """
+
+    def __init__(self, filename):
+        self._filename = filename
+        try:
+            f = open(filename, "rb")
+            try:
+                text = f.read()
+            finally:
+                f.close()
+        except IOError:
+            text = ""
+        self._entries = parse(text)
+        # Last entry of each key
+        self._index = dict()
+        for entry in self._entries:
+            if entry.key is not None:
+                self._index[entry.key] = entry
+
+    def get_filename(self):
+        return self._filename
+
+    def keys(self):
+        return [entry.key for entry in self._entries
+                if entry.key is not None and not entry.removed]
+
+    def has_key(self, key):
+        return key in self._index
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def get(self, key, default=None):
+        entry = self._index.get(key)
+        if entry is None:
+            return default
+        return entry.value
+
+    def get_list(self, key, separator=","):
+        return split_list(self.get(key, ""), separator)
+
+    def _insert_position(self):
+        """
+        Return the position following the last property.
+        """
+        for i in xrange(len(self._entries) - 1, -1, -1):
+            entry = self._entries[i]
+            if entry.key is not None and not entry.removed:
+                return i + 1
+        return len(self._entries)
+
+    def set(self, key, value):
+        """
+        Set the value of key, adding it if needed.
+        """
+        entry = self._index.get(key)
+        if entry is None:
+            entry = _Entry(key, value, None)
+            self._entries.insert(self._insert_position(), entry)
+            self._index[key] = entry
+        elif entry.value != value:
+            entry.value = value
+            entry.text = None
+
+    def append(self, key, values, separator=", "):
+        """
+        Add the values which are not already in the list value of key.
+        """
+        items = self.get_list(key, separator.strip() or separator)
+        known = set(items)
+        for value in values:
+            if value not in known:
+                items.append(value)
+                known.add(value)
+        self.set(key, separator.join(items))
+
+    def remove_from_list(self, key, values, separator=", "):
+        """
+        Remove values from the list value of key.
+        """
+        if key not in self._index:
+            return
+        values = set(values)
+        items = self.get_list(key, separator.strip() or separator)
+        kept = [item for item in items if item not in values]
+        if len(kept) != len(items):
+            self.set(key, separator.join(kept))
+
+    def remove(self, key):
+        """
+        Remove every occurence of key.
+        """
+        if self._index.pop(key, None) is None:
+            return
+        for entry in self._entries:
+            if entry.key == key:
+                entry.removed = True
+
+    def merge(self, text):
+        """
+        Add the properties of text, with its comments and layout, or replace
+        those already defined. The common indentation of text is removed.
+        """
+        entries = parse(textwrap.dedent(text).strip("\n") + "\n")
+        new_entries = list()
+        for entry in entries:
+            if entry.key is None:
+                new_entries.append(entry)
+                continue
+            old_entry = self._index.get(entry.key)
+            if old_entry is None:
+                new_entries.append(entry)
+                self._index[entry.key] = entry
+            elif old_entry.value != entry.value:
+                old_entry.value = entry.value
+                old_entry.text = entry.text
+        if not [entry for entry in new_entries if entry.key is not None]:
+            return
+        position = self._insert_position()
+        if position and self._entries[position - 1].text is not None and \
+           self._entries[position - 1].text.strip():
+            # Separate the new block by a blank line
+            new_entries.insert(0, _Entry(None, None, "\n"))
+        self._entries[position:position] = new_entries
+
+    def _format(self, entry):
+        line = "%s=%s" % (_escape(entry.key, True), _escape(entry.value))
+        if len(line) <= LINE_LENGTH or ", " not in line:
+            return line + "\n"
+        # Break the long lists after their separators
+        lines = list()
+        current = ""
+        for item in line.split(", "):
+            if current and len(current) + len(item) + 4 > LINE_LENGTH:
+                lines.append(current + ", \\\n")
+                current = "    "
+            elif current:
+                current += ", "
+            current += item
+        lines.append(current + "\n")
+        return "".join(lines)
+
+    def __str__(self):
+        chunks = list()
+        # Whether the last line written is blank and a removed entry follows
+        blank = False
+        removed = False
+        for entry in self._entries:
+            if entry.removed:
+                removed = True
+                continue
+            text = entry.text
+            if text is None:
+                text = self._format(entry)
+            is_blank = entry.key is None and not text.strip()
+            if is_blank and blank and removed:
+                # Do not leave the blank lines around removed properties
+                continue
+            if chunks and not chunks[-1].endswith("\n"):
+                chunks[-1] += "\n"
+            chunks.append(text)
+            blank = is_blank
+            removed = False
+        return "".join(chunks)
+
+    def write(self):
+        """
+        Replace the file atomically, unless it is unchanged. Return True if
+        the file have been written.
+        """
+        return system.write_file(self._filename, str(self))
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (C) 2010 Vincent Ollivier <contact@vincentollivier.com>
+
+This file is part of OpenNMS Configuration Tools.
+
+OpenNMS Configuration Tools is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Foobar is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with OpenNMS Configuration Tools. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import csv
+import itertools
+import os
+
+
+"""
+This library contains readers of the rules stored in files rather than in
+'config_rules.py': each rule is a dictionary, read from a row of a CSV file
+whose first row names the columns, or from a line of a JSON-lines file
+holding one object. The rules are read one at a time, so a file of any size
+can be imported without loading it.
+"""
+
+try:
+    # Python version >= 2.6
+    import json
+except ImportError:
+    try:
+        import simplejson as json
+    except ImportError:
+        json = None
+
+# Extensions of the files by format
+CSV_EXTENSIONS = (".csv",)
+JSON_EXTENSIONS = (".json", ".jsonl", ".ldjson")
+
+def _clean(record, where):
+    """
+    Return record without its empty values, with str keys so it can be
+    given as keyword arguments, and its values as unicode strings like the
+    values of the XML files: the numbers and booleans are converted and the
+    bytes decoded from UTF-8. Raise ValueError on a list, an object or bytes
+    not in UTF-8, where being the position of the record in its file.
+    """
+    rule = dict()
+    for key, value in record.items():
+        if key is None or value is None:
+            continue
+        if isinstance(value, bool):
+            value = value and u"true" or u"false"
+        elif isinstance(value, (int, long, float)):
+            value = unicode(value)
+        elif isinstance(value, str):
+            try:
+                value = value.decode("utf-8")
+            except UnicodeDecodeError:
+                raise ValueError("%s: the value of '%s' is not in UTF-8"
+                                 % (where, key))
+        elif not isinstance(value, unicode):
+            raise ValueError("%s: the value of '%s' is not a string, a "
+                             "number or a boolean" % (where, key))
+        value = value.strip()
+        if value:
+            rule[str(key).strip()] = value
+    return rule
+
+def _read_csv(f, filename):
+    reader = csv.DictReader(f, skipinitialspace=True)
+    for record in reader:
+        if record.get(None):
+            raise ValueError("%s:%d: too many values"
+                             % (filename, reader.line_num))
+        rule = _clean(record, "%s:%d" % (filename, reader.line_num))
+        if rule:
+            yield rule
+
+def _read_json(f, filename):
+    for number, line in enumerate(f):
+        line = line.strip()
+        if not line or line[0] == "#":
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError, e:
+            raise ValueError("%s:%d: %s" % (filename, number + 1, e))
+        if not isinstance(record, dict):
+            raise ValueError("%s:%d: not an object" % (filename, number + 1))
+        yield _clean(record, "%s:%d" % (filename, number + 1))
+
+def read_rules(filename):
+    """
+    Iterate over the rules of filename, a CSV or JSON-lines file according
+    to its extension. The empty values are left out, so the rule gets the
+    default value of the missing parameters. Raise ValueError on the first
+    malformed line.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in CSV_EXTENSIONS:
+        read = _read_csv
+    elif extension in JSON_EXTENSIONS:
+        if json is None:
+            raise ValueError("%s: reading JSON needs Python 2.6 or "
+                             "'simplejson'" % filename)
+        read = _read_json
+    else:
+        raise ValueError("%s: unknown format, the extension must be one of "
+                         "%s" % (filename,
+                                 ", ".join(CSV_EXTENSIONS + JSON_EXTENSIONS)))
+    f = open(filename, "rb")
+    try:
+        for rule in read(f, filename):
+            yield rule
+    finally:
+        f.close()
+
+def chain_rules(rules=(), filenames=()):
+    """
+    Iterate over rules, then over the rules of each file of filenames.
+    """
+    return itertools.chain(rules, *[read_rules(filename)
+                                    for filename in filenames])
+
+def chunks(iterable, size):
+    """
+    Iterate over the items of iterable by lists of up to size items.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
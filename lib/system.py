@@ -23,9 +23,16 @@ import re
 import subprocess
 import sys
 import shutil
+import tempfile
 import urllib2
 import base64
 
+try:
+    # Python version >= 2.5
+    import hashlib as md5
+except:
+    import md5
+
 """
 This library contains some system command wrapper
 """
@@ -140,6 +147,126 @@ def backup(filename):
     shutil.copy2(filename, backupname)
     return backupname
 
+def _file_digest(filename, chunk_size=64 * 1024):
+    """
+    Return the md5 digest of filename or None if it cannot be read.
+    """
+    try:
+        f = open(filename, "rb")
+    except IOError:
+        return None
+    digest = md5.md5()
+    try:
+        chunk = f.read(chunk_size)
+        while chunk:
+            digest.update(chunk)
+            chunk = f.read(chunk_size)
+    finally:
+        f.close()
+    return digest.digest()
+
+
+class AtomicFile(object):
+    """
+    File object replacing the content of filename atomically: the data is
+    written to a temporary file of the same directory which is renamed over
+    filename by commit(), so the file is never seen half written.
+    If filename already contains the same data, commit() leaves it untouched.
+    """
+
+    def __init__(self, filename):
+        self.name = filename
+        self._dirname = os.path.dirname(os.path.abspath(filename))
+        fd, self._tmp_name = tempfile.mkstemp(
+            prefix=".%s." % os.path.basename(filename), dir=self._dirname)
+        self._file = os.fdopen(fd, "wb")
+        self._digest = md5.md5()
+
+    def write(self, data):
+        self._digest.update(data)
+        self._file.write(data)
+
+    def commit(self):
+        """
+        Replace the file if its content have changed and return True, or
+        return False if it is unchanged.
+        """
+        try:
+            if _file_digest(self.name) == self._digest.digest():
+                self.discard()
+                return False
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            try:
+                st = os.stat(self.name)
+            except OSError:
+                # mkstemp() creates a file only readable by its owner
+                umask = os.umask(0)
+                os.umask(umask)
+                os.chmod(self._tmp_name, 0666 & ~umask)
+            else:
+                # Keep the permissions of the file we replace
+                os.chmod(self._tmp_name, st.st_mode & 07777)
+                if os.geteuid() == 0:
+                    os.chown(self._tmp_name, st.st_uid, st.st_gid)
+            os.rename(self._tmp_name, self.name)
+        except:
+            self.discard()
+            raise
+        # Make the rename itself durable
+        try:
+            dir_fd = os.open(self._dirname, os.O_RDONLY)
+        except OSError:
+            return True
+        try:
+            os.fsync(dir_fd)
+        except OSError:
+            pass
+        os.close(dir_fd)
+        return True
+
+    def discard(self):
+        """
+        Forget the data written, filename is left untouched.
+        """
+        self._file.close()
+        if os.path.exists(self._tmp_name):
+            os.remove(self._tmp_name)
+
+
+def write_file(filename, content):
+    """
+    Replace the content of filename atomically, see AtomicFile.
+    Nothing is done if filename already contains content, return False in
+    this case and True otherwise.
+    """
+    f = AtomicFile(filename)
+    try:
+        f.write(content)
+    except:
+        f.discard()
+        raise
+    return f.commit()
+
+
+class UTF8Output(object):
+    """
+    Wrapper of an output stream writing the unicode strings in UTF-8 and the
+    byte strings as they are, for the outputs without an encoding.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode("utf-8")
+        self._stream.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
 def get_parent_dir(path):
     parent_level = len(path.split("/")) - 1
     return "/".join(path.split("/")[:parent_level])
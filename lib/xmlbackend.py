@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (C) 2010 Vincent Ollivier <contact@vincentollivier.com>
+
+This file is part of OpenNMS Configuration Tools.
+
+OpenNMS Configuration Tools is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Foobar is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with OpenNMS Configuration Tools. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import gc
+import re
+import xml.dom
+import xml.dom.minidom
+import xml.parsers.expat
+
+import xmlwriter
+
+from StringIO import StringIO
+
+"""
+This library contains the parsers used by XMLFile to load a configuration file
+into a DOM tree. Every backend return a 'xml.dom.minidom.Document' so the
+classes using XMLFile don't have to care about which one is used.
+"""
+
+try:
+    # lxml is the fastest one and keep track of the namespace prefixes
+    import lxml.etree as etree
+except ImportError:
+    try:
+        # Python version >= 2.5
+        import xml.etree.cElementTree as etree
+    except ImportError:
+        etree = None
+
+
+class Backend(object):
+    """
+    Generic parser, a backend must at least define parse_string(string),
+    which parse the given string and return its DOM tree.
+    """
+
+    name = None
+
+    def parse(self, filename):
+        """
+        Parse filename and return its DOM tree.
+        """
+        f = open(filename)
+        try:
+            return self.parse_string(f.read())
+        finally:
+            f.close()
+
+    def create_document(self):
+        """
+        Return a new empty DOM tree.
+        """
+        return xml.dom.minidom.Document()
+
+    def serialize(self, doc):
+        """
+        Convert the given DOM tree to a string.
+        """
+        stream = StringIO()
+        xmlwriter.XMLWriter(stream).write_document(doc)
+        return stream.getvalue()
+
+
+class MinidomBackend(Backend):
+    """
+    Parser of the standard library, always available but slow.
+    """
+
+    name = "minidom"
+
+    def parse(self, filename):
+        return xml.dom.minidom.parse(filename)
+
+    def parse_string(self, string):
+        return xml.dom.minidom.parseString(string)
+
+
+class _Unsupported(Exception):
+    """
+    Raised when a document cannot be loaded by the ElementTree backend
+    without losing some of its content.
+    """
+
+
+class _Attr(xml.dom.minidom.Attr):
+    """
+    Attribute node created without the overhead of Attr.__init__(), its
+    content is set by _DOMTreeBuilder.
+    """
+
+    def __init__(self):
+        pass
+
+_Text = xml.dom.minidom.Text
+_NodeList = xml.dom.minidom.NodeList
+
+def set_new_attribute(doc, elem, name, value):
+    """
+    Faster equivalent of elem.setAttribute(name, value) for a new element of
+    doc, the same shortcut is taken by 'xml.dom.expatbuilder'.
+    """
+    text = _Text()
+    d = text.__dict__
+    d["data"] = d["nodeValue"] = value
+    attr = _Attr()
+    d = attr.__dict__
+    d["nodeName"] = d["name"] = name
+    d["namespaceURI"] = d["prefix"] = None
+    d["childNodes"] = _NodeList((text,))
+    d["value"] = d["nodeValue"] = value
+    d["ownerDocument"] = doc
+    d["ownerElement"] = elem
+    elem._attrs[name] = attr
+    elem._attrsNS[(None, name.split(":", 1)[-1])] = attr
+
+
+class _DOMTreeBuilder(object):
+    """
+    ElementTree parser target building a minidom tree from the parser events.
+    """
+
+    def __init__(self, prefixes):
+        self._doc = xml.dom.minidom.Document()
+        self._stack = [self._doc]
+        self._text = []
+        # Namespaces URI and their prefix ("" for the default namespace)
+        self._prefixes = prefixes
+        # Cache of the converted tag names
+        self._qnames = dict()
+
+    def _qname(self, tag):
+        """
+        Convert '{uri}local' to 'prefix:local' as minidom would name it.
+        """
+        try:
+            return self._qnames[tag]
+        except KeyError:
+            qname = self._qnames[tag] = self._convert_qname(tag)
+            return qname
+
+    def _convert_qname(self, tag):
+        if tag[:1] != "{":
+            if "" in self._prefixes.values():
+                # Element out of the default namespace (xmlns="")
+                raise _Unsupported(tag)
+            return tag
+        uri, local = tag[1:].split("}", 1)
+        if uri not in self._prefixes:
+            raise _Unsupported(tag)
+        prefix = self._prefixes[uri]
+        return "%s:%s" % (prefix, local) if prefix else local
+
+    def _flush_text(self):
+        if self._text:
+            parent = self._stack[-1]
+            # Whitespaces outside of the root are not part of the DOM
+            if parent is not self._doc:
+                text = self._doc.createTextNode("".join(self._text))
+                xml.dom.minidom._append_child(parent, text)
+            self._text = []
+
+    def _set_attribute(self, elem, name, value):
+        set_new_attribute(self._doc, elem, name, value)
+
+    def start(self, tag, attrib, nsmap=None):
+        self._flush_text()
+        elem = self._doc.createElement(self._qname(tag))
+        if len(self._stack) == 1:
+            # Declare every namespace on the root element
+            for uri, prefix in self._prefixes.items():
+                self._set_attribute(elem,
+                                    "xmlns:%s" % prefix if prefix else "xmlns",
+                                    uri)
+        for name, value in attrib.items():
+            # Unprefixed attributes are never in the default namespace
+            if name[:1] == "{":
+                name = self._qname(name)
+            self._set_attribute(elem, name, value)
+        xml.dom.minidom._append_child(self._stack[-1], elem)
+        self._stack.append(elem)
+
+    def end(self, tag):
+        self._flush_text()
+        self._stack.pop()
+
+    def data(self, data):
+        self._text.append(data)
+
+    def comment(self, text):
+        self._flush_text()
+        comment = self._doc.createComment(text)
+        xml.dom.minidom._append_child(self._stack[-1], comment)
+
+    def pi(self, target, data=None):
+        self._flush_text()
+        pi = self._doc.createProcessingInstruction(target, data or "")
+        xml.dom.minidom._append_child(self._stack[-1], pi)
+
+    def close(self):
+        return self._doc
+
+
+class ElementTreeBackend(Backend):
+    """
+    Parser using the C implementation of ElementTree (or lxml) and building the
+    DOM tree from its events, which is a lot faster than minidom's builder.
+    Documents this parser could alter (doctype, conflicting namespaces) are
+    given to minidom instead.
+    """
+
+    name = "etree"
+
+    _xmlns = re.compile(r"""\sxmlns(?::([\w.-]+))?\s*=\s*["']([^"']*)["']""")
+
+    def __init__(self):
+        assert etree is not None
+        self._fallback = MinidomBackend()
+
+    def _get_prefixes(self, string):
+        """
+        Return a map of the namespaces URI to their prefix or None if a
+        namespace is bound to several prefixes or the reverse.
+        """
+        prefixes = dict()
+        for prefix, uri in self._xmlns.findall(string):
+            if prefixes.get(uri, prefix) != prefix:
+                return None
+            prefixes[uri] = prefix
+        if len(set(prefixes.values())) != len(prefixes):
+            return None
+        return prefixes
+
+    def parse_string(self, string):
+        prefixes = self._get_prefixes(string)
+        if prefixes is None or "<!DOCTYPE" in string:
+            return self._fallback.parse_string(string)
+        parser = etree.XMLParser(target=_DOMTreeBuilder(prefixes))
+        # The DOM tree is made of reference cycles, running the garbage
+        # collector every few hundreds of new nodes would take more time than
+        # the parsing itself.
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            parser.feed(string)
+            return parser.close()
+        except _Unsupported:
+            return self._fallback.parse_string(string)
+        except SyntaxError, e:
+            # Both cElementTree.ParseError and lxml.etree.XMLSyntaxError are
+            # SyntaxError, give the callers the same error as minidom.
+            raise xml.parsers.expat.ExpatError(str(e))
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+
+BACKENDS = {
+    MinidomBackend.name: MinidomBackend,
+    ElementTreeBackend.name: ElementTreeBackend,
+}
+
+def available_backends():
+    """
+    Return the names of the backends usable on this system, the fastest first.
+    """
+    names = [MinidomBackend.name]
+    if etree is not None:
+        names.insert(0, ElementTreeBackend.name)
+    return names
+
+def get_backend(name=None):
+    """
+    Return an instance of the backend called name or of the fastest available
+    backend if name is None.
+    """
+    if name is None:
+        name = available_backends()[0]
+    if name not in available_backends():
+        raise ValueError("XML backend '%s' is not available" % name)
+    return BACKENDS[name]()
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (C) 2010 Vincent Ollivier <contact@vincentollivier.com>
+
+This file is part of OpenNMS Configuration Tools.
+
+OpenNMS Configuration Tools is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Foobar is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with OpenNMS Configuration Tools. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import gc
+import marshal
+import os
+import time
+import xml.dom
+import xml.dom.minidom
+
+import xmlbackend
+
+try:
+    # Python version >= 2.5
+    import hashlib as md5
+except:
+    import md5
+
+"""
+This library contains a persistent cache of parsed XML files. A file is stored
+as nested tuples dumped with 'marshal', which is much faster to load than the
+file itself is to parse.
+"""
+
+# Increase it when the format of the cached trees change
+CACHE_FORMAT = 1
+
+_ELEMENT = xml.dom.Node.ELEMENT_NODE
+_TEXT = xml.dom.Node.TEXT_NODE
+_CDATA = xml.dom.Node.CDATA_SECTION_NODE
+_COMMENT = xml.dom.Node.COMMENT_NODE
+_PI = xml.dom.Node.PROCESSING_INSTRUCTION_NODE
+
+def dump_tree(node):
+    """
+    Convert a DOM node to nested tuples:
+        element:                (ELEMENT_NODE, tag, attributes, children)
+        text and comment:       (nodeType, data)
+        processing instruction: (PROCESSING_INSTRUCTION_NODE, target, data)
+    where attributes is a tuple of (name, value) and children a tuple of nodes.
+    The document itself is dumped as the tuple of its children.
+    """
+    if node.nodeType == xml.dom.Node.DOCUMENT_NODE:
+        return tuple([dump_tree(child) for child in node.childNodes])
+    elif node.nodeType == _ELEMENT:
+        return (_ELEMENT, node.tagName, tuple(node.attributes.items()),
+                tuple([dump_tree(child) for child in node.childNodes]))
+    elif node.nodeType == _PI:
+        return (_PI, node.target, node.data)
+    elif node.nodeType in (_TEXT, _CDATA, _COMMENT):
+        return (node.nodeType, node.data)
+    raise ValueError("cannot cache node of type %d" % node.nodeType)
+
+def load_tree(tree):
+    """
+    Rebuild the DOM document dumped by dump_tree().
+    """
+    builder = xmlbackend._DOMTreeBuilder(dict())
+    doc = builder.close()
+    append_child = xml.dom.minidom._append_child
+    set_attribute = builder._set_attribute
+    def load_nodes(parent, nodes):
+        for node in nodes:
+            node_type = node[0]
+            if node_type == _ELEMENT:
+                child = doc.createElement(node[1])
+                for name, value in node[2]:
+                    set_attribute(child, name, value)
+                load_nodes(child, node[3])
+            elif node_type == _TEXT:
+                child = doc.createTextNode(node[1])
+            elif node_type == _CDATA:
+                child = doc.createCDATASection(node[1])
+            elif node_type == _COMMENT:
+                child = doc.createComment(node[1])
+            else:
+                child = doc.createProcessingInstruction(node[1], node[2])
+            append_child(parent, child)
+    # See ElementTreeBackend.parse_string()
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        load_nodes(doc, tree)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return doc
+
+
+class XMLCache(object):
+    """
+    This class store the parsed XML files in a directory. An entry is valid as
+    long as the file have the same inode, size, modification time and content.
+    Entries not used since max_age seconds are removed, then the oldest ones
+    until the directory is smaller than max_size bytes.
+    """
+
+    def __init__(self, path, max_size=64 * 1024 * 1024, max_age=30 * 86400):
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if not os.path.isdir(path):
+            os.makedirs(path, 0700)
+
+    def _entry_name(self, filename):
+        """
+        Return the name of the cache entry of filename.
+        """
+        digest = md5.md5(os.path.abspath(filename)).hexdigest()
+        return os.path.join(self.path, "%s.xmlcache" % digest)
+
+    def _identity(self, filename, content):
+        """
+        Return the key identifying the given version of the file.
+        """
+        st = os.stat(filename)
+        return (CACHE_FORMAT, st.st_ino, st.st_size, int(st.st_mtime),
+                md5.md5(content).hexdigest())
+
+    def load(self, filename, backend):
+        """
+        Return the DOM tree of filename from the cache, or parse the file
+        with backend and store it in the cache.
+        """
+        f = open(filename)
+        try:
+            content = f.read()
+        finally:
+            f.close()
+        identity = self._identity(filename, content)
+        entry = self._entry_name(filename)
+        try:
+            f = open(entry, "rb")
+            try:
+                cached_identity, tree = marshal.load(f)
+            finally:
+                f.close()
+        except (IOError, EOFError, ValueError, TypeError):
+            cached_identity = None
+        if cached_identity == identity:
+            self.hits += 1
+            try:
+                os.utime(entry, None)
+            except OSError:
+                pass
+            return load_tree(tree)
+        self.misses += 1
+        doc = backend.parse_string(content)
+        self.store(filename, content, doc, identity)
+        return doc
+
+    def store(self, filename, content, doc, identity=None):
+        """
+        Store the DOM tree of filename whose text is content.
+        """
+        if identity is None:
+            identity = self._identity(filename, content)
+        entry = self._entry_name(filename)
+        tmp_entry = "%s.%d.tmp" % (entry, os.getpid())
+        try:
+            f = open(tmp_entry, "wb")
+            try:
+                marshal.dump((identity, dump_tree(doc)), f)
+            finally:
+                f.close()
+            os.rename(tmp_entry, entry)
+        except (IOError, OSError, ValueError):
+            # The cache is only an optimization, never fail because of it
+            if os.path.exists(tmp_entry):
+                os.remove(tmp_entry)
+            return
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the entries too old or too many for the cache size.
+        """
+        entries = list()
+        now = time.time()
+        for name in os.listdir(self.path):
+            if not name.endswith(".xmlcache"):
+                continue
+            entry = os.path.join(self.path, name)
+            try:
+                st = os.stat(entry)
+            except OSError:
+                continue
+            if now - st.st_mtime > self.max_age:
+                self._remove(entry)
+            else:
+                entries.append((st.st_mtime, st.st_size, entry))
+        size = sum([entry[1] for entry in entries])
+        entries.sort()
+        while entries and size > self.max_size:
+            mtime, entry_size, entry = entries.pop(0)
+            self._remove(entry)
+            size -= entry_size
+
+    def _remove(self, entry):
+        try:
+            os.remove(entry)
+        except OSError:
+            return
+        self.evictions += 1
+
+    def clear(self):
+        """
+        Remove every entry of the cache.
+        """
+        for name in os.listdir(self.path):
+            if name.endswith(".xmlcache"):
+                self._remove(os.path.join(self.path, name))
+
+    def __str__(self):
+        return "%d hit(s), %d miss(es), %d eviction(s)" \
+               % (self.hits, self.misses, self.evictions)
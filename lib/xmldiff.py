@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (C) 2010 Vincent Ollivier <contact@vincentollivier.com>
+
+This file is part of OpenNMS Configuration Tools.
+
+OpenNMS Configuration Tools is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Foobar is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with OpenNMS Configuration Tools. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import xml.dom
+
+"""
+This library contains a structural diff between two DOM trees: the elements
+are matched by their key (see KEY_NAMES) rather than by their position, and
+only the added, removed and changed ones are reported.
+"""
+
+# Attributes, or child elements, identifying an element among its siblings
+KEY_NAMES = ("user-id", "name", "protocol", "service", "key")
+
+ADDED = "added"
+REMOVED = "removed"
+CHANGED = "changed"
+
+_ELEMENT = xml.dom.Node.ELEMENT_NODE
+_TEXT = xml.dom.Node.TEXT_NODE
+_CDATA = xml.dom.Node.CDATA_SECTION_NODE
+
+def _text(element):
+    """
+    Return the text directly contained by element, stripped.
+    """
+    return u"".join([child.data for child in element.childNodes
+                     if child.nodeType in (_TEXT, _CDATA)]).strip()
+
+def _str(value):
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    return value
+
+def _quote(value):
+    if len(value) > 60:
+        value = value[:57] + "..."
+    return "'%s'" % _str(value)
+
+
+class Change(object):
+    """
+    Difference on the element at path: kind is ADDED, REMOVED or CHANGED, and
+    details is the list of the changes of its attributes and text.
+    """
+
+    def __init__(self, kind, path, details=None):
+        self.kind = kind
+        self.path = path
+        self.details = details or list()
+
+    def __str__(self):
+        sign = {ADDED: "+", REMOVED: "-", CHANGED: "~"}[self.kind]
+        if not self.details:
+            return "%s %s" % (sign, self.path)
+        return "%s %s: %s" % (sign, self.path, ", ".join(self.details))
+
+
+class TreeDiff(object):
+    """
+    This class compare two documents (a missing one is None) and list their
+    differences in self.changes.
+    """
+
+    def __init__(self, old, new, key_names=KEY_NAMES):
+        self._key_names = key_names
+        self.changes = list()
+        old_root = old is not None and old.documentElement or None
+        new_root = new is not None and new.documentElement or None
+        if old_root is None and new_root is None:
+            return
+        if old_root is None or new_root is None or \
+           old_root.tagName != new_root.tagName:
+            if old_root is not None:
+                self.changes.append(Change(REMOVED,
+                                           "/" + _str(old_root.tagName)))
+            if new_root is not None:
+                self.changes.append(Change(ADDED,
+                                           "/" + _str(new_root.tagName)))
+            return
+        self._diff(old_root, new_root, "/" + _str(new_root.tagName))
+
+    def _key(self, element):
+        """
+        Return the value of the first key attribute or key child element of
+        element, or None.
+        """
+        for name in self._key_names:
+            if element.hasAttribute(name):
+                return element.getAttribute(name)
+        for child in element.childNodes:
+            if child.nodeType == _ELEMENT and child.tagName in self._key_names:
+                return _text(child)
+        return None
+
+    def _children(self, element, path):
+        """
+        Return the child elements of element as an ordered list of
+        (identity, path, child) where identity is unique among the siblings.
+        """
+        elements = [child for child in element.childNodes
+                    if child.nodeType == _ELEMENT]
+        tags = dict()
+        for child in elements:
+            tags[child.tagName] = tags.get(child.tagName, 0) + 1
+        children = list()
+        seen = dict()
+        for child in elements:
+            key = self._key(child)
+            identity = (child.tagName, key)
+            count = seen.get(identity, 0)
+            seen[identity] = count + 1
+            tag = _str(child.tagName)
+            if key is None and tags[child.tagName] == 1:
+                child_path = "%s/%s" % (path, tag)
+            elif key is None:
+                child_path = "%s/%s[%d]" % (path, tag, count + 1)
+            else:
+                child_path = "%s/%s[%s]" % (path, tag, _str(key))
+                if count:
+                    child_path += "[%d]" % (count + 1)
+            children.append((identity + (count,), child_path, child))
+        return children
+
+    def _diff(self, old, new, path):
+        details = list()
+        old_attributes = dict(old.attributes.items())
+        new_attributes = dict(new.attributes.items())
+        names = old_attributes.keys()
+        names.extend([n for n in new_attributes.keys()
+                      if n not in old_attributes])
+        names.sort()
+        for name in names:
+            old_value = old_attributes.get(name)
+            new_value = new_attributes.get(name)
+            if old_value == new_value:
+                continue
+            elif old_value is None:
+                details.append("+%s=%s" % (_str(name), _quote(new_value)))
+            elif new_value is None:
+                details.append("-%s" % _str(name))
+            else:
+                details.append("%s %s -> %s" % (_str(name), _quote(old_value),
+                                                _quote(new_value)))
+        old_text = _text(old)
+        new_text = _text(new)
+        if old_text != new_text:
+            details.append("text %s -> %s" % (_quote(old_text),
+                                              _quote(new_text)))
+        if details:
+            self.changes.append(Change(CHANGED, path, details))
+        old_children = self._children(old, path)
+        new_children = self._children(new, path)
+        olds = dict([(identity, child)
+                     for identity, child_path, child in old_children])
+        news = dict([(identity, child)
+                     for identity, child_path, child in new_children])
+        for identity, child_path, child in old_children:
+            if identity not in news:
+                self.changes.append(Change(REMOVED, child_path))
+        for identity, child_path, child in new_children:
+            if identity not in olds:
+                self.changes.append(Change(ADDED, child_path))
+            else:
+                self._diff(olds[identity], child, child_path)
+
+    def count(self, kind):
+        return len([change for change in self.changes if change.kind == kind])
+
+    def summary(self):
+        return "%d added, %d removed, %d changed" \
+               % (self.count(ADDED), self.count(REMOVED), self.count(CHANGED))
@@ -18,8 +18,18 @@ You should have received a copy of the GNU General Public License
 along with OpenNMS Configuration Tools. If not, see <http://www.gnu.org/licenses/>.
 """
 
+import os
 import sys
 import xml.dom.minidom
+import xml.parsers.expat
+
+import system
+import xmlbackend
+import xmlindex
+import xmlsplice
+import xmlwriter
+
+from StringIO import StringIO
 
 class XMLFile(object):
     """
@@ -27,28 +37,121 @@ class XMLFile(object):
     to it.
     """
 
+    # Parser shared by every XMLFile, see 'set_backend()'
+    _backend = None
+    # Documents shared during a run, see 'set_registry()'
+    _current_registry = None
+    # Persistent cache of the parsed files, see 'set_cache()'
+    _cache = None
+    # Keep the text of the files, see 'set_preserve_format()'
+    _preserve_format = True
+
     def __init__(self):
         """
         """
         self._rootName = None
         self._doc = None
+        self._registry = None
+        # Identity of the file the tree has been parsed from
+        self._source = None
+        # Indexes of the elements, see 'get_index()'
+        self._index = None
+
+    @classmethod
+    def get_backend(cls):
+        """
+        Return the backend used to parse the files, the fastest available one
+        if none have been chosen.
+        """
+        if cls._backend is None:
+            cls._backend = xmlbackend.get_backend()
+        return cls._backend
+
+    @classmethod
+    def set_backend(cls, name=None):
+        """
+        Choose the backend used to parse the files by its name (see
+        'xmlbackend.available_backends()').
+        """
+        cls._backend = xmlbackend.get_backend(name)
+
+    @classmethod
+    def get_cache(cls):
+        return cls._cache
+
+    @classmethod
+    def set_cache(cls, cache):
+        """
+        Load the files through the given 'xmlcache.XMLCache' instead of parsing
+        them every time, or stop using a cache if cache is None.
+        """
+        cls._cache = cache
+
+    @classmethod
+    def get_preserve_format(cls):
+        return cls._preserve_format
+
+    @classmethod
+    def set_preserve_format(cls, preserve):
+        """
+        Write only the elements modified since the files have been parsed and
+        keep the rest of their text as it is, or rewrite the whole files with
+        the pretty printer if preserve is False.
+        """
+        cls._preserve_format = preserve
+
+    @classmethod
+    def parse_document(cls, fileName):
+        """
+        Return the DOM tree of fileName, from the cache if possible.
+        """
+        backend = cls.get_backend()
+        if cls._cache is not None:
+            return cls._cache.load(fileName, backend)
+        return backend.parse(fileName)
+
+    @classmethod
+    def get_registry(cls):
+        """
+        Return the registry sharing the documents or None if every call to
+        open() parse its file again.
+        """
+        return cls._current_registry
+
+    @classmethod
+    def set_registry(cls, registry):
+        """
+        Share the documents opened from now on through registry, or stop
+        sharing them if registry is None.
+        """
+        cls._current_registry = registry
 
     @classmethod
     def open(cls, fileName, mode = "r"):
         """
         Parse fileName to an XML tree if exist, otherwise create a new one if
         mode is set to "w".
+        If a registry is set, the tree already opened for fileName is returned
+        instead.
         """
+        if cls._current_registry is not None:
+            return cls._current_registry.open(fileName, mode)
+        return cls._load(fileName, mode)
+
+    @classmethod
+    def _load(cls, fileName, mode):
         #print "DEBUG: open('%s', '%s') ..." % (fileName, mode)
         xml_file = XMLFile()
         xml_file._fileName = fileName
         try:
-            xml_file._doc = xml.dom.minidom.parse(fileName)
+            xml_file._source = xml_file._stat()
+            xml_file._doc = cls.parse_document(fileName)
         except (IOError, xml.parsers.expat.ExpatError), e:
             if mode == "r":
                 sys.exit(e)
             elif mode == "w":
-                xml_file._doc = xml.dom.minidom.Document()
+                xml_file._doc = cls.get_backend().create_document()
+                xml_file._source = None
         except:
             raise
         else:
@@ -85,7 +188,10 @@ class XMLFile(object):
         self._rootName = tagName
         if not self._doc.hasChildNodes():
             root = self._doc.createElement(tagName)
-            self._doc.appendChild(root)
+            if self._index is not None:
+                self._index.append(self._doc, root)
+            else:
+                self._doc.appendChild(root)
         #else:
         #    # What if there is already a root?
     root = property(get_root, set_root)
@@ -96,6 +202,17 @@ class XMLFile(object):
         """
         return self._doc
 
+    def get_index(self):
+        """
+        Return the indexes of the elements of the tree (see
+        'xmlindex.XMLIndex'), built on the first call. Every modification of
+        the tree must then be done through them.
+        """
+        if self._index is None:
+            self._index = xmlindex.XMLIndex(self._doc)
+        return self._index
+    index = property(get_index)
+
     def __clean_rec(self, node):
         """
         When not using 'xml.dom.ext', the value of a empty attribute is None.
@@ -115,30 +232,474 @@ class XMLFile(object):
         """
         self.__clean_rec(self.root)
 
+    def get_filename(self):
+        return self._fileName
+
     def write(self):
         """
         Write the modifications done to the XML tree to the file.
+        If the tree belongs to a registry, the file will be written when the
+        registry is flushed.
+        """
+        if self._registry is not None:
+            self._registry.mark_dirty(self)
+        else:
+            self._write()
+
+    def _write(self, content=None):
         """
-        f = open(self._fileName, "w")
-        f.write(self.read())
-        f.close()
+        Replace the file atomically by content, by default the text given by
+        get_content(), unless it is unchanged.
+        Return True if the file have been written.
+        """
+        f = system.AtomicFile(self._fileName)
+        try:
+            if content is None and XMLFile._preserve_format:
+                content = self._splice()
+            if content is not None:
+                f.write(content)
+            else:
+                self.write_to(f)
+        except:
+            f.discard()
+            raise
+        written = f.commit()
+        self._source = self._stat()
+        return written
+
+    def get_content(self):
+        """
+        Return the text which would be written to the file.
+        """
+        content = None
+        if XMLFile._preserve_format:
+            content = self._splice()
+        if content is None:
+            stream = StringIO()
+            self.write_to(stream)
+            content = stream.getvalue()
+        return content
+
+    def _stat(self):
+        try:
+            st = os.stat(self._fileName)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime)
+
+    def _splice(self):
+        """
+        Return the text of the file with the modifications of the tree, or
+        None if the file has changed since it has been parsed or its text
+        cannot be kept.
+        """
+        if self._source is None or self._source != self._stat():
+            return None
+        f = open(self._fileName, "rb")
+        try:
+            text = f.read()
+        finally:
+            f.close()
+        return xmlsplice.splice(text, self._doc)
+
+    def write_to(self, stream):
+        """
+        Write the XML tree to the given stream with the pretty printer.
+        """
+        xmlwriter.XMLWriter(stream).write_document(self._doc)
 
     def read(self):
         """
-        Convert the XML tree to a string (with the pretty printer from
-        Python-XML if exist).
+        Convert the XML tree to a string with the pretty printer.
         """
         return self.__str__()
 
     def __str__(self):
+        stream = StringIO()
+        self.write_to(stream)
+        return stream.getvalue()
+
+
+class XMLRegistry(object):
+    """
+    This class share the XML trees between every user of a file during a run,
+    so each file is parsed once and written once whatever the number of
+    modifications done to it.
+    """
+
+    def __init__(self, verbosity=0, validator=None):
+        self._files = dict()
+        self._dirty = list()
+        self.verbosity = verbosity
+        # Schema validator of the files before writing them (see xmlvalidate)
+        self.validator = validator
+        # Errors of the files not written because they are invalid
+        self.invalid = dict()
+
+    def open(self, fileName, mode = "r"):
+        """
+        Return the tree of fileName, parsing it on the first call only.
+        """
+        path = os.path.abspath(fileName)
+        if path not in self._files:
+            xml_file = XMLFile._load(fileName, mode)
+            xml_file._registry = self
+            self._files[path] = xml_file
+        return self._files[path]
+
+    def mark_dirty(self, xml_file):
+        """
+        Schedule the writing of xml_file for the next flush().
+        """
+        if xml_file not in self._dirty:
+            self._dirty.append(xml_file)
+
+    def is_dirty(self, xml_file):
+        return xml_file in self._dirty
+
+    def is_open(self, fileName):
+        """
+        Return True if the tree of fileName is held by the registry.
+        """
+        return os.path.abspath(fileName) in self._files
+
+    def flush(self):
+        """
+        Write every modified file once and return the number of files which
+        have really changed.
+        If there is a validator, the files are validated all together first
+        and the invalid ones are not written (see self.invalid).
+        """
+        contents = dict()
+        invalid = dict()
+        if self.validator is not None and self._dirty:
+            for xml_file in self._dirty:
+                contents[xml_file] = xml_file.get_content()
+            invalid = self.validator.validate(
+                [(xml_file.get_filename(), content)
+                 for xml_file, content in contents.items()])
+            self.invalid.update(invalid)
+        written = 0
+        while self._dirty:
+            xml_file = self._dirty.pop(0)
+            filename = xml_file.get_filename()
+            if filename in invalid:
+                print >> sys.stderr, "Error: '%s' is not valid, it has not " \
+                                     "been written" % filename
+                for error in invalid[filename]:
+                    print >> sys.stderr, "\t%s" % error
+            elif xml_file._write(contents.get(xml_file)):
+                if self.verbosity > 1:
+                    print "Writing '%s' ..." % xml_file.get_filename()
+                written += 1
+            elif self.verbosity > 1:
+                print "'%s' is unchanged ..." % xml_file.get_filename()
+        return written
+
+    def clear(self):
+        """
+        Forget every tree, the modifications not flushed are lost.
+        """
+        self._files.clear()
+        del self._dirty[:]
+
+
+class Insert(object):
+    """
+    Edit inserting fragment, a string containing one element, at the end of
+    the first element named parent, or of the parent of the first element named
+    sibling. The fragment goes at the end of the root if none is found.
+    """
+
+    def __init__(self, fragment, parent=None, sibling=None):
+        self.fragment = fragment
+        self.parent = parent
+        self.sibling = sibling
+        self.node = xml.dom.minidom.parseString(fragment).documentElement
+
+
+class Remove(object):
+    """
+    Edit removing the elements named tag whose every attribute has the same
+    value in the dict attributes, or every element named tag if attributes is
+    None.
+    """
+
+    def __init__(self, tag, attributes=None):
+        self.tag = tag
+        self.attributes = attributes
+
+    def matches(self, tag, attributes):
+        if tag != self.tag:
+            return False
+        if self.attributes is None:
+            return True
+        for name, value in attributes.iteritems():
+            if self.attributes.get(name) != value:
+                return False
+        return True
+
+
+class ReplaceAll(object):
+    """
+    Edit removing every element named tag and inserting fragment in place of
+    the first one, or in the root if there is none (see Insert).
+    """
+
+    def __init__(self, tag, fragment):
+        self.tag = tag
+        self.fragment = fragment
+
+
+class _NullStream(object):
+    """
+    Stream discarding what is written, for the simulated runs.
+    """
+
+    def write(self, data):
+        pass
+
+
+class _StreamElement(object):
+    """
+    Element of the path to the current node of XMLStreamEditor.
+    """
+
+    __slots__ = ("tag", "unclosed", "children", "raw", "inserts")
+
+    def __init__(self, tag):
+        self.tag = tag
+        # The start tag waits for its '>' or '/>'
+        self.unclosed = True
+        self.children = False
+        # The content is written as it is, not indented
+        self.raw = False
+        self.inserts = list()
+
+
+class XMLStreamEditor(object):
+    """
+    This class apply a list of edits (Insert, Remove and ReplaceAll) to a file
+    while it is parsed and written to the pretty printer, so only the path to
+    the current element is held in memory whatever the size of the file.
+    The output is the same as the one of the pretty printer (XMLFile.write()
+    with the format not preserved), except for elements mixing text and child
+    elements: they are written as they are only from their first non blank
+    text.
+    """
+
+    def __init__(self, fileName, edits=()):
+        self._fileName = fileName
+        self._inserts = list()
+        self._removes = list()
+        # Inserts of the ReplaceAll edits, written in place of their sibling
+        self._replacements = list()
+        for edit in edits:
+            self.add(edit)
+        # Counters of the last run
+        self.inserted = 0
+        self.removed = 0
+
+    def add(self, edit):
+        if isinstance(edit, ReplaceAll):
+            insert = Insert(edit.fragment, sibling=edit.tag)
+            self._removes.append(Remove(edit.tag))
+            self._inserts.append(insert)
+            self._replacements.append(insert)
+        elif isinstance(edit, Insert):
+            self._inserts.append(edit)
+        elif isinstance(edit, Remove):
+            self._removes.append(edit)
+        else:
+            raise TypeError("unknown edit %r" % edit)
+
+    def run(self, simulate_only=False):
+        """
+        Apply the edits and replace the file atomically, unless the file is
+        unchanged. Return True if the file have been written. If simulate_only
+        is set, the edits are only counted and nothing is written.
+        """
+        if simulate_only:
+            self.write_to(_NullStream())
+            return False
+        f = system.AtomicFile(self._fileName)
+        try:
+            self.write_to(f)
+        except:
+            f.discard()
+            raise
+        return f.commit()
+
+    def write_to(self, stream):
+        """
+        Write the edited file to the given stream.
+        """
+        self._writer = xmlwriter.XMLWriter(stream)
+        self._out = self._writer.write
+        self._indent = self._writer._indent
+        self._path = list()
+        self._text = list()
+        self._cdata = False
+        # Depth inside a removed element
+        self._skip = 0
+        # Inserts whose target have not been found yet
+        self._pending = list(self._inserts)
+        self.inserted = 0
+        self.removed = 0
+        parser = xml.parsers.expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = self._start
+        parser.EndElementHandler = self._end
+        parser.CharacterDataHandler = self._data
+        parser.CommentHandler = self._comment
+        parser.ProcessingInstructionHandler = self._pi
+        parser.StartCdataSectionHandler = self._start_cdata
+        parser.EndCdataSectionHandler = self._end_cdata
+        parser.StartDoctypeDeclHandler = self._doctype
+        self._writer.write_declaration()
+        f = open(self._fileName, "rb")
         try:
-            from xml.dom.ext import PrettyPrint
-            from StringIO import StringIO
-        except ImportError:
-            print >> sys.stderr, \
-                     "Warning: module 'xml.dom.ext' should be installed!"
-            return self._doc.toxml('utf-8')
+            parser.ParseFile(f)
+        finally:
+            f.close()
+        self._out("\n")
+        self._writer.flush()
+
+    def _begin_child(self):
+        """
+        Close the start tag of the current element if needed and indent the
+        next child.
+        """
+        if not self._path:
+            self._out("\n")
+            return
+        element = self._path[-1]
+        if element.unclosed:
+            self._out(">")
+            element.unclosed = False
+        element.children = True
+        if not element.raw:
+            self._out("\n" + self._indent * len(self._path))
+
+    def _flush_text(self, at_end=False):
+        """
+        Write the text read since the last node, blank text is dropped unless
+        it is the whole content of an element ending (at_end).
+        """
+        if not self._text:
+            return
+        data = "".join(self._text)
+        del self._text[:]
+        if not self._path:
+            return
+        element = self._path[-1]
+        if not element.raw:
+            if not data.strip() and (element.children or not at_end):
+                return
+            element.raw = True
+        self._begin_child()
+        self._out(xmlwriter.escape_text(data))
+
+    def _start(self, tag, attributes):
+        if self._skip:
+            self._skip += 1
+            return
+        if self._path:
+            parent = self._path[-1]
+            for insert in self._pending[:]:
+                if insert.sibling != tag:
+                    continue
+                self._pending.remove(insert)
+                if insert in self._replacements:
+                    # The fragment takes the place of the element removed
+                    self._flush_text()
+                    self._begin_child()
+                    self._writer.write_node(insert.node, len(self._path))
+                    self.inserted += 1
+                else:
+                    parent.inserts.append(insert)
+        for remove in self._removes:
+            if remove.matches(tag, attributes):
+                self._skip = 1
+                self.removed += 1
+                return
+        self._flush_text()
+        self._begin_child()
+        element = _StreamElement(tag)
+        for insert in self._pending[:]:
+            if insert.parent == tag:
+                element.inserts.append(insert)
+                self._pending.remove(insert)
+        self._path.append(element)
+        out = self._out
+        out("<" + tag)
+        attributes = attributes.items()
+        attributes.sort()
+        for name, value in attributes:
+            out(' %s="%s"' % (name, xmlwriter.escape_attribute(value)))
+
+    def _end(self, tag):
+        if self._skip:
+            self._skip -= 1
+            return
+        element = self._path[-1]
+        if len(self._path) == 1:
+            # The inserts without target go in the root
+            element.inserts.extend(self._pending)
+            del self._pending[:]
+        self._flush_text(not element.inserts)
+        for insert in element.inserts:
+            self._begin_child()
+            self._writer.write_node(insert.node, len(self._path))
+            self.inserted += 1
+        self._path.pop()
+        if element.unclosed:
+            self._out("/>")
+        elif element.raw:
+            self._out("</%s>" % tag)
+        else:
+            self._out("\n%s</%s>" % (self._indent * len(self._path), tag))
+
+    def _data(self, data):
+        if self._skip:
+            return
+        if self._cdata:
+            self._out(data)
         else:
-            tmpStream = StringIO()
-            PrettyPrint(self._doc, stream=tmpStream, encoding='utf-8')
-            return tmpStream.getvalue()
+            self._text.append(data)
+
+    def _comment(self, data):
+        if self._skip:
+            return
+        self._flush_text()
+        self._begin_child()
+        self._out("<!--%s-->" % data)
+
+    def _pi(self, target, data):
+        if self._skip:
+            return
+        self._flush_text()
+        self._begin_child()
+        self._out("<?%s %s?>" % (target, data))
+
+    def _start_cdata(self):
+        if self._skip:
+            return
+        self._flush_text()
+        self._path[-1].raw = True
+        self._begin_child()
+        self._out("<![CDATA[")
+        self._cdata = True
+
+    def _end_cdata(self):
+        if self._skip:
+            return
+        self._out("]]>")
+        self._cdata = False
+
+    def _doctype(self, name, system_id, public_id, has_internal_subset):
+        if has_internal_subset:
+            raise ValueError("cannot stream '%s': it has an internal DTD "
+                             "subset" % self._fileName)
+        self._begin_child()
+        self._out(xmlwriter.doctype(name, public_id, system_id))
@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (C) 2010 Vincent Ollivier <contact@vincentollivier.com>
+
+This file is part of OpenNMS Configuration Tools.
+
+OpenNMS Configuration Tools is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Foobar is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with OpenNMS Configuration Tools. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import xml.dom
+
+"""
+This library contains indexes of the elements of a DOM tree by tag name and
+by key, kept up to date while the tree is modified through them, so finding
+an element does not need to scan the whole document.
+"""
+
+_ELEMENT = xml.dom.Node.ELEMENT_NODE
+_TEXT = xml.dom.Node.TEXT_NODE
+_CDATA = xml.dom.Node.CDATA_SECTION_NODE
+
+def _text(element):
+    """
+    Return the text directly contained by element.
+    """
+    return u"".join([child.data for child in element.childNodes
+                     if child.nodeType in (_TEXT, _CDATA)])
+
+def key_of(element, key_name):
+    """
+    Return the key of element: the value of its attribute key_name, or else
+    the text of its first child element named key_name, or its own text if
+    key_name is None. Return None if element has no such key.
+    """
+    if key_name is None:
+        return _text(element)
+    if element.hasAttribute(key_name):
+        return element.getAttribute(key_name)
+    for child in element.childNodes:
+        if child.nodeType == _ELEMENT and child.tagName == key_name:
+            return _text(child)
+    return None
+
+def same_tree(element, other):
+    """
+    Return True if the elements element and other have the same tag,
+    attributes and stripped text, and the same child elements recursively.
+    """
+    if element.tagName != other.tagName or \
+       dict(element.attributes.items()) != dict(other.attributes.items()) or \
+       _text(element).strip() != _text(other).strip():
+        return False
+    children = [child for child in element.childNodes
+                if child.nodeType == _ELEMENT]
+    other_children = [child for child in other.childNodes
+                      if child.nodeType == _ELEMENT]
+    if len(children) != len(other_children):
+        return False
+    for child, other_child in zip(children, other_children):
+        if not same_tree(child, other_child):
+            return False
+    return True
+
+
+class XMLIndex(object):
+    """
+    This class index the elements of a document by tag name, and by key (see
+    key_of()) for the (tag, key_name) pairs searched at least once.
+    The tree must be modified through append(), insert_before(),
+    insert_many(), upsert(), remove(), remove_many(), replace() and
+    set_attribute() to keep the indexes up to date, or
+    refresh() must be called on the modified element.
+    The elements are returned in the order they have been indexed, which is
+    the document order for the elements of the parsed file and for the
+    elements appended at the end of their parent.
+    """
+
+    def __init__(self, doc):
+        self._doc = doc
+        # Order of indexing of the elements by tag
+        self._tags = dict()
+        self._count = 0
+        # Key names searched by tag
+        self._key_names = dict()
+        # Elements by key value by (tag, key_name)
+        self._keys = dict()
+        # Key values by key name by element
+        self._element_keys = dict()
+        self._add_tree(doc)
+
+    def _sorted(self, tag, elements):
+        order = self._tags.get(tag, {})
+        return sorted(elements, key=order.get)
+
+    def elements(self, tag):
+        """
+        Return the list of the elements named tag.
+        """
+        return self._sorted(tag, self._tags.get(tag, {}).keys())
+
+    def first(self, tag):
+        """
+        Return the first element named tag, or None.
+        """
+        order = self._tags.get(tag)
+        if not order:
+            return None
+        return min(order, key=order.get)
+
+    def find_all(self, tag, key_name, value):
+        """
+        Return the list of the elements named tag whose key is value.
+        """
+        self._register(tag, key_name)
+        return self._sorted(tag,
+                            self._keys[(tag, key_name)].get(value, ()))
+
+    def find(self, tag, key_name, value):
+        """
+        Return the first element named tag whose key is value, or None.
+        """
+        elements = self.find_all(tag, key_name, value)
+        if elements:
+            return elements[0]
+        return None
+
+    def append(self, parent, child):
+        """
+        Append child to parent.
+        """
+        self._detach(child)
+        parent.appendChild(child)
+        self._attach(parent, child)
+        return child
+
+    def insert_before(self, parent, child, reference):
+        """
+        Insert child in parent before reference.
+        """
+        self._detach(child)
+        parent.insertBefore(child, reference)
+        self._attach(parent, child)
+        return child
+
+    def insert_many(self, parent, insertions):
+        """
+        Insert in parent the children of the (child, reference) pairs before
+        their reference, or at the end if it is None, in the order given.
+        """
+        before = dict()
+        for child, reference in insertions:
+            self._detach(child)
+            before.setdefault(reference, list()).append(child)
+        children = list()
+        for node in parent.childNodes:
+            children.extend(before.pop(node, ()))
+            children.append(node)
+        children.extend(before.pop(None, ()))
+        assert not before, "reference is not a child of parent"
+        self._set_children(parent, children)
+        for child, reference in insertions:
+            self._attach(parent, child)
+
+    def upsert(self, parent, child, key_names=()):
+        """
+        Put child in parent in place of the children with its tag and its
+        keys (see key_of()) for each of key_names, or of all the children
+        with its tag if key_names is empty. The first one is kept if it is
+        the same as child (see same_tree()) and replaced by child otherwise,
+        the others are removed, and child is appended if there is none.
+        Return the element left in parent.
+        """
+        keys = [key_of(child, key_name) for key_name in key_names]
+        if key_names:
+            candidates = self.find_all(child.tagName, key_names[0], keys[0])
+        else:
+            candidates = self.elements(child.tagName)
+        matches = [element for element in candidates
+                   if element.parentNode is parent and
+                   [key_of(element, key_name)
+                    for key_name in key_names[1:]] == keys[1:]]
+        if not matches:
+            return self.append(parent, child)
+        if same_tree(matches[0], child):
+            child = matches[0]
+        else:
+            self.replace(child, matches[0])
+        self.remove_many(matches[1:])
+        return child
+
+    def remove(self, child):
+        """
+        Remove child from its parent.
+        """
+        parent = child.parentNode
+        parent.removeChild(child)
+        if self._is_indexed(parent):
+            self._remove_tree(child)
+            self._changed(parent, child)
+        return child
+
+    def remove_many(self, children):
+        """
+        Remove children from their parents.
+        """
+        removed = dict()
+        for child in children:
+            removed.setdefault(child.parentNode, set()).add(child)
+        for parent, nodes in removed.items():
+            self._set_children(parent, [node for node in parent.childNodes
+                                        if node not in nodes])
+            if self._is_indexed(parent):
+                for child in nodes:
+                    self._remove_tree(child)
+                    self._changed(parent, child)
+
+    def replace(self, new_child, old_child):
+        """
+        Replace old_child by new_child in its parent.
+        """
+        parent = old_child.parentNode
+        self._detach(new_child)
+        parent.replaceChild(new_child, old_child)
+        if self._is_indexed(parent):
+            self._remove_tree(old_child)
+            self._add_tree(new_child)
+            self._changed(parent, new_child)
+        return old_child
+
+    def set_attribute(self, element, name, value):
+        element.setAttribute(name, value)
+        if self._is_indexed(element):
+            self._update_keys(element)
+
+    def remove_attribute(self, element, name):
+        element.removeAttribute(name)
+        if self._is_indexed(element):
+            self._update_keys(element)
+
+    def refresh(self, node):
+        """
+        Index again node and its descendants after they have been modified
+        without this index.
+        """
+        if node.nodeType == _ELEMENT:
+            self._remove_tree(node)
+            if node.parentNode is not None and \
+               self._is_indexed(node.parentNode):
+                self._add_tree(node)
+                self._changed(node.parentNode, node)
+        else:
+            self._remove_tree(node)
+            self._add_tree(node)
+
+    def _is_indexed(self, node):
+        if node is self._doc:
+            return True
+        if node.nodeType != _ELEMENT:
+            return False
+        return node in self._tags.get(node.tagName, ())
+
+    def _set_children(self, parent, children):
+        """
+        Replace the children of parent by children at once, since the DOM
+        inserts or removes a child in linear time. The nodes which stay
+        children of parent stay indexed.
+        """
+        # Removing the first child is fast
+        while parent.firstChild is not None:
+            parent.removeChild(parent.firstChild)
+        for node in children:
+            parent.appendChild(node)
+
+    def _detach(self, child):
+        # The DOM moves a child which already have a parent
+        parent = child.parentNode
+        if parent is not None and self._is_indexed(parent):
+            self._remove_tree(child)
+            parent.removeChild(child)
+            self._changed(parent, child)
+
+    def _attach(self, parent, child):
+        if self._is_indexed(parent):
+            self._add_tree(child)
+            self._changed(parent, child)
+
+    def _changed(self, parent, child):
+        """
+        Update the keys depending on the children of parent.
+        """
+        if parent.nodeType != _ELEMENT:
+            return
+        self._update_keys(parent)
+        if child.nodeType != _ELEMENT:
+            # The text of a child element can be the key of its parent
+            grand_parent = parent.parentNode
+            if grand_parent is not None and grand_parent.nodeType == _ELEMENT:
+                self._update_keys(grand_parent)
+
+    def _walk(self, node):
+        """
+        Return the elements of the subtree of node in document order.
+        """
+        elements = list()
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.nodeType == _ELEMENT:
+                elements.append(node)
+            stack.extend(reversed(node.childNodes))
+        return elements
+
+    def _add_tree(self, node):
+        for element in self._walk(node):
+            tag = element.tagName
+            self._tags.setdefault(tag, dict())[element] = self._count
+            self._count += 1
+            for key_name in self._key_names.get(tag, ()):
+                self._add_key(element, key_name, key_of(element, key_name))
+
+    def _remove_tree(self, node):
+        for element in self._walk(node):
+            order = self._tags.get(element.tagName)
+            if order is None or element not in order:
+                continue
+            del order[element]
+            keys = self._element_keys.pop(element, None)
+            if keys is None:
+                continue
+            for key_name, value in keys.items():
+                self._remove_key(element, key_name, value)
+
+    def _add_key(self, element, key_name, value):
+        self._element_keys.setdefault(element, dict())[key_name] = value
+        if value is not None:
+            self._keys[(element.tagName, key_name)].setdefault(
+                value, list()).append(element)
+
+    def _remove_key(self, element, key_name, value):
+        if value is None:
+            return
+        values = self._keys[(element.tagName, key_name)]
+        elements = values[value]
+        elements.remove(element)
+        if not elements:
+            del values[value]
+
+    def _update_keys(self, element):
+        key_names = self._key_names.get(element.tagName)
+        if not key_names:
+            return
+        keys = self._element_keys.setdefault(element, dict())
+        for key_name in key_names:
+            old_value = keys.get(key_name)
+            new_value = key_of(element, key_name)
+            if new_value != old_value:
+                self._remove_key(element, key_name, old_value)
+                self._add_key(element, key_name, new_value)
+
+    def _register(self, tag, key_name):
+        """
+        Start indexing the elements named tag by key_name.
+        """
+        if (tag, key_name) in self._keys:
+            return
+        self._key_names.setdefault(tag, list()).append(key_name)
+        self._keys[(tag, key_name)] = dict()
+        for element in self._tags.get(tag, ()):
+            self._add_key(element, key_name, key_of(element, key_name))
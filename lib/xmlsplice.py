@@ -0,0 +1,555 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (C) 2010 Vincent Ollivier <contact@vincentollivier.com>
+
+This file is part of OpenNMS Configuration Tools.
+
+OpenNMS Configuration Tools is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Foobar is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with OpenNMS Configuration Tools. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import difflib
+import gc
+import re
+import xml.dom
+import xml.parsers.expat
+
+import xmlwriter
+
+from StringIO import StringIO
+
+try:
+    # Python version >= 2.5
+    import hashlib as md5
+except:
+    import md5
+
+"""
+This library contains a writer keeping the original text of a file: the DOM
+tree is compared to the elements of the text and only the byte ranges of the
+modified ones are replaced, so comments, indentation and attribute order
+survive and a change gives a diff of a few lines.
+"""
+
+_DOCUMENT = xml.dom.Node.DOCUMENT_NODE
+_ELEMENT = xml.dom.Node.ELEMENT_NODE
+_TEXT = xml.dom.Node.TEXT_NODE
+_CDATA = xml.dom.Node.CDATA_SECTION_NODE
+_COMMENT = xml.dom.Node.COMMENT_NODE
+_PI = xml.dom.Node.PROCESSING_INSTRUCTION_NODE
+
+# Start tag, the quoted values may contain '>'
+_START_TAG = re.compile(r"""<[^\s/>]+(?:\s+[^\s=/>]+\s*=\s*(?:"[^"]*"|'[^']*'))*"""
+                        r"""\s*/?>""")
+_DECLARATION = re.compile(r"(?:\xef\xbb\xbf)?<\?xml[^>]*\?>")
+_ENCODING = re.compile(r"""encoding\s*=\s*["']([^"']+)""")
+
+_NO_ATTRIBUTES = frozenset()
+
+def _utf8(data):
+    if isinstance(data, unicode):
+        return data.encode("utf-8")
+    return data
+
+def _attributes(pairs):
+    """
+    Return the attributes as a set of (name, value), their order is
+    meaningless.
+    """
+    if not pairs:
+        return _NO_ATTRIBUTES
+    return frozenset(pairs)
+
+def _digest(kind, *parts):
+    """
+    Return the MD5 digest of a node of type kind, parts being its strings (in
+    UTF-8 so an ASCII str has the digest of its unicode) and the digests of
+    its children. The parts are prefixed by their length.
+    """
+    digest = md5.md5(str(kind))
+    for part in parts:
+        part = _utf8(part)
+        digest.update("%d:" % len(part))
+        digest.update(part)
+    return digest.digest()
+
+def _element_digest(name, pairs, digests):
+    """
+    Return the digest of an element from its attributes, in any order, and
+    the digests of its children.
+    """
+    pairs = sorted([(_utf8(n), _utf8(v)) for n, v in pairs or ()])
+    parts = [name, str(len(pairs))]
+    for pair in pairs:
+        parts.extend(pair)
+    parts.extend(digests)
+    return _digest(_ELEMENT, *parts)
+
+
+class _Unsupported(Exception):
+    """
+    Raised when the text of a file cannot be kept.
+    """
+
+
+class _Span(object):
+    """
+    Node of the original text: an element, a run of text, a comment or a
+    processing instruction, with its position in the text.
+    """
+
+    __slots__ = ("kind", "name", "attributes", "data", "start", "end",
+                 "inner_start", "inner_end", "empty", "children", "digest")
+
+    def __init__(self, kind, start):
+        self.kind = kind
+        self.start = start
+        self.children = list()
+
+
+class _Scanner(object):
+    """
+    This class read the text of a file into a tree of _Span. Blank text is not
+    part of the tree, it is kept in the gaps between the spans.
+    """
+
+    def __init__(self, text):
+        self._text = text
+        self._run = None
+        # End of the last markup, where the next text starts
+        self._last_end = 0
+        self.document = _Span(_DOCUMENT, 0)
+        match = _DECLARATION.match(text)
+        if match is not None:
+            encoding = _ENCODING.search(match.group())
+            if encoding is not None and encoding.group(1).lower() not in \
+                                        ("utf-8", "utf8", "us-ascii", "ascii"):
+                # The new parts are written in UTF-8
+                raise _Unsupported("encoding %s" % encoding.group(1))
+            self.document.inner_start = match.end()
+        else:
+            self.document.inner_start = 0
+        self.document.inner_end = len(text)
+        self._stack = [self.document]
+
+    def scan(self):
+        parser = xml.parsers.expat.ParserCreate()
+        parser.ordered_attributes = True
+        parser.buffer_text = True
+        parser.StartElementHandler = self._start
+        parser.EndElementHandler = self._end
+        parser.CharacterDataHandler = self._data
+        parser.CommentHandler = self._comment
+        parser.ProcessingInstructionHandler = self._pi
+        parser.StartDoctypeDeclHandler = self._doctype
+        self._parser = parser
+        parser.Parse(self._text, True)
+        self._end_run(len(self._text))
+        document = self.document
+        document.digest = _digest(_DOCUMENT, *[child.digest for child
+                                               in document.children])
+        return document
+
+    def _end_run(self, index):
+        if self._run is None:
+            return
+        start, chunks = self._run
+        self._run = None
+        data = u"".join(chunks)
+        if not data.strip():
+            return
+        span = _Span(_TEXT, start)
+        span.end = index
+        span.data = data
+        span.digest = _digest(_TEXT, data)
+        self._stack[-1].children.append(span)
+
+    def _data(self, data):
+        if self._run is None:
+            self._run = (self._last_end, [])
+        self._run[1].append(data)
+
+    def _start(self, name, attributes):
+        index = self._parser.CurrentByteIndex
+        if self._run is not None:
+            self._end_run(index)
+        match = _START_TAG.match(self._text, index)
+        if match is None:
+            raise _Unsupported("start tag at %d" % index)
+        span = _Span(_ELEMENT, index)
+        span.name = name
+        span.attributes = attributes
+        span.inner_start = self._last_end = match.end()
+        span.empty = match.group().endswith("/>")
+        self._stack[-1].children.append(span)
+        self._stack.append(span)
+
+    def _end(self, name):
+        index = self._parser.CurrentByteIndex
+        if self._run is not None:
+            self._end_run(index)
+        span = self._stack.pop()
+        if span.empty:
+            span.inner_end = span.end = span.inner_start
+        else:
+            span.inner_end = index
+            span.end = self._text.index(">", index) + 1
+        self._last_end = span.end
+        attributes = span.attributes
+        if attributes:
+            span.attributes = zip(attributes[::2], attributes[1::2])
+        span.digest = _element_digest(span.name, span.attributes,
+                                      [child.digest for child
+                                       in span.children])
+
+    def _comment(self, data):
+        index = self._parser.CurrentByteIndex
+        self._end_run(index)
+        span = _Span(_COMMENT, index)
+        span.end = self._last_end = self._text.index("-->", index) + 3
+        span.digest = _digest(_COMMENT, data)
+        self._stack[-1].children.append(span)
+
+    def _pi(self, target, data):
+        index = self._parser.CurrentByteIndex
+        self._end_run(index)
+        span = _Span(_PI, index)
+        span.name = target
+        span.end = self._last_end = self._text.index("?>", index) + 2
+        span.digest = _digest(_PI, target, data)
+        self._stack[-1].children.append(span)
+
+    def _doctype(self, *args):
+        raise _Unsupported("document type declaration")
+
+
+class _Splicer(object):
+    """
+    This class write the DOM tree doc over the text it has been parsed from.
+    """
+
+    def __init__(self, text, doc):
+        self._text = text
+        self._doc = doc
+        self._digests = dict()
+        self._children_cache = dict()
+
+    def run(self):
+        original = _Scanner(self._text).scan()
+        self._unit = self._find_unit(original)
+        self._stream = StringIO()
+        # XML declaration
+        self._stream.write(self._text[:original.inner_start])
+        self._splice_content(original, self._doc, "", "")
+        return self._stream.getvalue()
+
+    def document_digest(self):
+        return _digest(_DOCUMENT, *[digest for digest, kind, value
+                                    in self._children(self._doc)])
+
+    def _children(self, node):
+        """
+        Return the significant children of node as (digest, kind, value)
+        where value is the node itself, or the text of a run of text nodes.
+        """
+        children = self._children_cache.get(id(node))
+        if children is not None:
+            return children
+        children = list()
+        run = list()
+        for child in node.childNodes + [None]:
+            if child is not None and child.nodeType in (_TEXT, _CDATA):
+                run.append(child.data)
+                continue
+            if run:
+                data = u"".join(run)
+                if data.strip():
+                    children.append((_digest(_TEXT, data), _TEXT, data))
+                run = list()
+            if child is None:
+                break
+            if child.nodeType in (_ELEMENT, _COMMENT, _PI):
+                children.append((self._digest(child), child.nodeType, child))
+            else:
+                raise _Unsupported("node of type %d" % child.nodeType)
+        self._children_cache[id(node)] = children
+        return children
+
+    def _digest(self, node):
+        digest = self._digests.get(id(node))
+        if digest is not None:
+            return digest
+        if node.nodeType == _ELEMENT:
+            digest = _element_digest(node.tagName, node.attributes.items(),
+                                     [d for d, kind, value
+                                      in self._children(node)])
+        elif node.nodeType == _COMMENT:
+            digest = _digest(_COMMENT, node.data)
+        else:
+            digest = _digest(_PI, node.target, node.data)
+        self._digests[id(node)] = digest
+        return digest
+
+    def _line_indent(self, index):
+        """
+        Return the indentation of the line containing index.
+        """
+        line_start = self._text.rfind("\n", 0, index) + 1
+        return re.match(r"[ \t]*", self._text[line_start:index]).group()
+
+    def _find_unit(self, span):
+        """
+        Return the indentation step of the file, the one of the pretty
+        printer if it cannot be found.
+        """
+        stack = [span]
+        while stack:
+            span = stack.pop()
+            if span.kind == _ELEMENT and span.children and \
+               "\n" in self._text[span.inner_start:span.children[0].start]:
+                own = self._line_indent(span.start)
+                child = self._line_indent(span.children[0].start)
+                if child.startswith(own) and len(child) > len(own):
+                    return child[len(own):]
+            stack.extend(reversed(span.children))
+        return "  "
+
+    def _write_new(self, kind, value, margin):
+        if kind == _TEXT:
+            self._stream.write(_utf8(xmlwriter.escape_text(value)))
+        else:
+            writer = xmlwriter.XMLWriter(self._stream, indent=self._unit,
+                                         margin=margin)
+            writer.write_node(value)
+            writer.flush()
+
+    def _start_tag(self, span, node, empty):
+        """
+        Return the start tag of node keeping the order of the attributes of
+        span, the new ones come last.
+        """
+        parts = [u"<" + span.name]
+        kept = set()
+        for name, value in span.attributes:
+            if node.hasAttribute(name):
+                parts.append(u' %s="%s"' % (name, xmlwriter.escape_attribute(
+                                                    node.getAttribute(name))))
+                kept.add(name)
+        names = node.attributes.keys()
+        names.sort()
+        for name in names:
+            if name not in kept:
+                parts.append(u' %s="%s"' % (name, xmlwriter.escape_attribute(
+                                                    node.getAttribute(name))))
+        parts.append(empty and u"/>" or u">")
+        return _utf8(u"".join(parts))
+
+    def _splice_element(self, span, node):
+        text = self._text
+        out = self._stream.write
+        if self._digest(node) == span.digest:
+            out(text[span.start:span.end])
+            return
+        news = self._children(node)
+        if self._has_text(span.children, news) and \
+           not self._pairable(span.children, news):
+            # The text would merge with the blank text around it
+            self._write_new(_ELEMENT, node, self._line_indent(span.start))
+            return
+        attributes = dict(span.attributes)
+        if attributes == dict(node.attributes.items()):
+            start_tag = text[span.start:span.inner_start]
+            if span.empty and news:
+                start_tag = start_tag[:-2].rstrip() + ">"
+        else:
+            start_tag = self._start_tag(span, node, span.empty and not news)
+        out(start_tag)
+        if span.empty and not news:
+            return
+        indent = self._line_indent(span.start)
+        if span.children:
+            child_indent = self._line_indent(span.children[0].start)
+        else:
+            child_indent = indent + self._unit
+        self._splice_content(span, node, indent, child_indent)
+        if span.empty:
+            out("</%s>" % _utf8(span.name))
+        else:
+            out(text[span.inner_end:span.end])
+
+    def _splice_content(self, span, node, indent, child_indent):
+        """
+        Write the content of span changed to the one of node.
+        """
+        text = self._text
+        out = self._stream.write
+        olds = span.children
+        news = self._children(node)
+        if not olds:
+            # Only blank text to replace
+            if news:
+                for digest, kind, value in news:
+                    out("\n" + child_indent)
+                    self._write_new(kind, value, child_indent)
+                out("\n" + indent)
+            else:
+                out(text[span.inner_start:span.inner_end])
+            return
+        if self._has_text(olds, news):
+            # Pairable, see _splice_element()
+            pos = span.inner_start
+            for old, (digest, kind, value) in zip(olds, news):
+                out(text[pos:old.start])
+                if kind == _ELEMENT:
+                    self._splice_element(old, value)
+                elif digest == old.digest:
+                    out(text[old.start:old.end])
+                else:
+                    self._write_new(kind, value, child_indent)
+                pos = old.end
+            out(text[pos:span.inner_end])
+            return
+        # Indent the new nodes unless the content is on a single line
+        separator = ""
+        if span.kind == _DOCUMENT:
+            separator = "\n"
+        else:
+            bounds = [span.inner_start]
+            for old in olds:
+                bounds.extend((old.start, old.end))
+            bounds.append(span.inner_end)
+            for i in range(0, len(bounds), 2):
+                if "\n" in text[bounds[i]:bounds[i + 1]]:
+                    separator = "\n" + child_indent
+                    break
+        pos = self._splice_block(span.inner_start, olds, news,
+                                 separator, child_indent)
+        out(text[pos:span.inner_end])
+
+    def _has_text(self, olds, news):
+        for old in olds:
+            if old.kind == _TEXT:
+                return True
+        for digest, kind, value in news:
+            if kind == _TEXT:
+                return True
+        return False
+
+    def _pairable(self, olds, news):
+        """
+        Return True if each old node can be edited into the new node at the
+        same position.
+        """
+        if len(olds) != len(news):
+            return False
+        for old, (digest, kind, value) in zip(olds, news):
+            if old.kind != kind or \
+               (kind == _ELEMENT and old.name != value.tagName):
+                return False
+        return True
+
+    def _shape(self, kind, value, level):
+        """
+        Return what identify a node whose content may have been modified: the
+        name and attributes of an element at level 1, its name at level 2.
+        """
+        if kind != _ELEMENT:
+            return kind
+        if level == 2:
+            return value.tagName
+        return (value.tagName, _attributes(value.attributes.items()))
+
+    def _span_shape(self, span, level):
+        if span.kind != _ELEMENT:
+            return span.kind
+        if level == 2:
+            return span.name
+        return (span.name, _attributes(span.attributes))
+
+    def _splice_block(self, pos, olds, news, separator, child_indent,
+                      level=0):
+        """
+        Write the nodes news in place of the nodes olds, whose text start at
+        pos, and return the position of the text following them.
+        The nodes are aligned by digest, then the differing ones by shape so
+        a modified element is edited in place rather than written again.
+        """
+        text = self._text
+        out = self._stream.write
+        if level:
+            old_keys = [self._span_shape(old, level) for old in olds]
+            new_keys = [self._shape(kind, value, level)
+                        for digest, kind, value in news]
+        else:
+            old_keys = [old.digest for old in olds]
+            new_keys = [new[0] for new in news]
+        try:
+            matcher = difflib.SequenceMatcher(None, old_keys, new_keys,
+                                              autojunk=False)
+        except TypeError:
+            # Python version < 2.7.1
+            matcher = difflib.SequenceMatcher(None, old_keys, new_keys)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal" and not level:
+                out(text[pos:olds[i2 - 1].end])
+                pos = olds[i2 - 1].end
+                continue
+            pairs = zip(olds[i1:i2], news[j1:j2])
+            if tag == "equal" or (i2 - i1 == j2 - j1 and
+               not [old for old, new in pairs if old.kind != new[1] or
+                    (old.kind == _ELEMENT and old.name != new[2].tagName)]):
+                # Same nodes modified, edit them in place
+                for old, (digest, kind, value) in pairs:
+                    out(text[pos:old.start])
+                    if kind == _ELEMENT:
+                        self._splice_element(old, value)
+                    else:
+                        self._write_new(kind, value, child_indent)
+                    pos = old.end
+                continue
+            if tag == "replace" and level < 2:
+                pos = self._splice_block(pos, olds[i1:i2], news[j1:j2],
+                                         separator, child_indent, level + 1)
+                continue
+            # Drop the old nodes with their indentation and add the new ones
+            if i2 > i1:
+                pos = olds[i2 - 1].end
+            for digest, kind, value in news[j1:j2]:
+                out(separator)
+                self._write_new(kind, value, child_indent)
+        return pos
+
+
+def splice(text, doc):
+    """
+    Return text, the content of a file, with the modifications done to doc,
+    the DOM tree parsed from it. Only the modified elements are written again.
+    Return None if the text cannot be kept (DOCTYPE, encoding other than
+    UTF-8, ...).
+    """
+    splicer = _Splicer(text, doc)
+    # See ElementTreeBackend.parse_string()
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        try:
+            result = splicer.run()
+            # Never write something which would not parse to the same tree
+            if _Scanner(result).scan().digest != splicer.document_digest():
+                return None
+        except (_Unsupported, xml.parsers.expat.ExpatError):
+            return None
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return result
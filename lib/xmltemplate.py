@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (C) 2010 Vincent Ollivier <contact@vincentollivier.com>
+
+This file is part of OpenNMS Configuration Tools.
+
+OpenNMS Configuration Tools is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Foobar is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with OpenNMS Configuration Tools. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import xml.dom.minidom
+import xml.parsers.expat
+
+from xmlbackend import set_new_attribute
+
+"""
+This library contains templates of XML fragments: a fragment is parsed once,
+and copies of it are created in a document by giving the value of its
+parameters, written %(name)s in its attribute values and its text.
+"""
+
+# Templates by fragment, see get_template()
+_templates = dict()
+
+def _is_format(data):
+    return "%" in data
+
+
+class XMLTemplate(object):
+    """
+    This class parse an XML fragment with one root element, whose copies are
+    created by create(). The attribute values and the text are formatted
+    with the % operator, so '%' is written '%%' everywhere, unless no
+    parameter is given: they are then copied as they are. The blank text is
+    dropped unless blanks is True. The prefixes of the tag names
+    ('beans:bean') are kept as they are.
+    """
+
+    def __init__(self, fragment, blanks=False):
+        if isinstance(fragment, unicode):
+            fragment = fragment.encode("utf-8")
+        self._blanks = blanks
+        # The elements are (tag, attributes, children) where attributes is a
+        # list of (name, value, is_format), and the text is (data, is_format)
+        self._root = None
+        self._stack = [["", list()]]
+        parser = xml.parsers.expat.ParserCreate("utf-8")
+        parser.ordered_attributes = True
+        parser.StartElementHandler = self._start
+        parser.EndElementHandler = self._end
+        parser.CharacterDataHandler = self._data
+        parser.Parse(fragment.strip(), True)
+        del self._stack
+
+    def _flush_text(self):
+        text, children = self._stack[-1]
+        if text and (self._blanks or text.strip()):
+            children.append((text, _is_format(text)))
+        self._stack[-1][0] = ""
+
+    def _start(self, tag, attributes):
+        self._flush_text()
+        pairs = zip(attributes[::2], attributes[1::2])
+        element = (tag, [(name, value, _is_format(value))
+                         for name, value in pairs], list())
+        self._stack[-1][1].append(element)
+        self._stack.append(["", element[2]])
+
+    def _end(self, tag):
+        self._flush_text()
+        self._stack.pop()
+        if len(self._stack) == 1:
+            self._root = self._stack[0][1][0]
+
+    def _data(self, data):
+        self._stack[-1][0] += data
+
+    def create(self, doc, **parameters):
+        """
+        Return a new copy of the fragment owned by doc, not yet added to it.
+        """
+        return self._create(doc, self._root, parameters or None)
+
+    def _create(self, doc, node, parameters):
+        # The element is new, the checks of the DOM methods are not needed
+        tag, attributes, children = node
+        element = doc.createElement(tag)
+        for name, value, is_format in attributes:
+            if is_format and parameters is not None:
+                value = value % parameters
+            set_new_attribute(doc, element, name, value)
+        for child in children:
+            if len(child) == 3:
+                child = self._create(doc, child, parameters)
+            else:
+                data, is_format = child
+                if is_format and parameters is not None:
+                    data = data % parameters
+                child = doc.createTextNode(data)
+            xml.dom.minidom._append_child(element, child)
+        return element
+
+
+def get_template(fragment, blanks=False):
+    """
+    Return the XMLTemplate of fragment, parsed at the first call only.
+    """
+    template = _templates.get((fragment, blanks))
+    if template is None:
+        template = _templates[(fragment, blanks)] = XMLTemplate(fragment,
+                                                                 blanks)
+    return template
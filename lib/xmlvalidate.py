@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (C) 2010 Vincent Ollivier <contact@vincentollivier.com>
+
+This file is part of OpenNMS Configuration Tools.
+
+OpenNMS Configuration Tools is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Foobar is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with OpenNMS Configuration Tools. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import marshal
+import os
+import sys
+import time
+
+try:
+    # Python version >= 2.5
+    import hashlib as md5
+except:
+    import md5
+
+"""
+This library contains the validation of the XML files against the schemas
+(XSD) shipped with OpenNMS, done before writing them.
+"""
+
+try:
+    import lxml.etree as etree
+except ImportError:
+    etree = None
+
+try:
+    # Python version >= 2.6
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+# Number of documents known to be valid kept between runs
+MAX_RESULTS = 4096
+
+# Compiled schemas of the current process by digest of their file
+_schemas = dict()
+
+def is_available():
+    """
+    Return True if the schemas can be checked ('lxml' is installed).
+    """
+    return etree is not None
+
+def _digest_file(filename):
+    f = open(filename, "rb")
+    try:
+        return md5.md5(f.read()).hexdigest()
+    finally:
+        f.close()
+
+def _validate(job):
+    """
+    Validate a document and return (filename, errors), errors being None if
+    the schema cannot be used. Run in the worker processes.
+    """
+    filename, content, xsd, xsd_digest = job
+    schema = _schemas.get(xsd_digest)
+    if schema is None:
+        try:
+            schema = etree.XMLSchema(etree.parse(xsd))
+        except (IOError, etree.XMLSchemaParseError, etree.XMLSyntaxError):
+            return (filename, None)
+        _schemas[xsd_digest] = schema
+    try:
+        doc = etree.fromstring(content)
+    except etree.XMLSyntaxError, e:
+        return (filename, [str(e)])
+    if schema.validate(doc):
+        return (filename, [])
+    return (filename, ["line %d: %s" % (error.line,
+                                        error.message.encode("utf-8"))
+                       for error in schema.error_log])
+
+
+class SchemaValidator(object):
+    """
+    This class validate documents against the schema named like them in
+    xsd_path ('users.xml' against 'users.xsd'). Several documents are
+    validated at once by up to processes worker processes, and the documents
+    found valid are remembered in cache_path so they are not validated again
+    while they and their schema are unchanged.
+    """
+
+    def __init__(self, xsd_path, cache_path=None, processes=None):
+        self.xsd_path = xsd_path
+        self.cache_path = cache_path
+        if processes is None:
+            processes = multiprocessing and multiprocessing.cpu_count() or 1
+        self.processes = processes
+        # Digests of the schemas by file name
+        self._xsd_digests = dict()
+        # Last use of the keys of the valid documents
+        self._results = None
+        # Counters
+        self.validated = 0
+        self.cached = 0
+        self.skipped = 0
+
+    def find_schema(self, filename):
+        """
+        Return the schema of filename or None if there is none.
+        """
+        name = os.path.splitext(os.path.basename(filename))[0]
+        xsd = os.path.join(self.xsd_path, "%s.xsd" % name)
+        if os.path.isfile(xsd):
+            return xsd
+        return None
+
+    def _xsd_digest(self, xsd):
+        if xsd not in self._xsd_digests:
+            self._xsd_digests[xsd] = _digest_file(xsd)
+        return self._xsd_digests[xsd]
+
+    def _load_results(self):
+        if self._results is not None:
+            return
+        self._results = dict()
+        if self.cache_path is None:
+            return
+        try:
+            f = open(os.path.join(self.cache_path, "valid"), "rb")
+            try:
+                self._results = marshal.load(f)
+            finally:
+                f.close()
+        except (IOError, EOFError, ValueError, TypeError):
+            pass
+
+    def _save_results(self):
+        if self.cache_path is None:
+            return
+        results = self._results.items()
+        if len(results) > MAX_RESULTS:
+            # Keep the most recently used
+            results.sort(key=lambda item: item[1])
+            results = results[-MAX_RESULTS:]
+        filename = os.path.join(self.cache_path, "valid")
+        tmp_filename = "%s.%d.tmp" % (filename, os.getpid())
+        try:
+            if not os.path.isdir(self.cache_path):
+                os.makedirs(self.cache_path, 0700)
+            f = open(tmp_filename, "wb")
+            try:
+                marshal.dump(dict(results), f)
+            finally:
+                f.close()
+            os.rename(tmp_filename, filename)
+        except (IOError, OSError):
+            # The cache is only an optimization
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+
+    def validate(self, documents):
+        """
+        Validate documents, a list of (filename, content), and return a dict
+        of the errors of each invalid document by filename.
+        """
+        if etree is None:
+            self.skipped += len(documents)
+            return dict()
+        self._load_results()
+        jobs = list()
+        keys = dict()
+        for filename, content in documents:
+            xsd = self.find_schema(filename)
+            if xsd is None:
+                self.skipped += 1
+                continue
+            xsd_digest = self._xsd_digest(xsd)
+            key = "%s:%s" % (xsd_digest, md5.md5(content).hexdigest())
+            if key in self._results:
+                self.cached += 1
+                self._results[key] = time.time()
+                continue
+            keys[filename] = key
+            jobs.append((filename, content, xsd, xsd_digest))
+        if len(jobs) > 1 and self.processes > 1:
+            pool = multiprocessing.Pool(min(self.processes, len(jobs)))
+            try:
+                results = pool.map(_validate, jobs)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = map(_validate, jobs)
+        invalid = dict()
+        for filename, errors in results:
+            if errors is None:
+                print >> sys.stderr, "Warning: the schema of '%s' cannot " \
+                                     "be loaded" % filename
+                self.skipped += 1
+            elif errors:
+                self.validated += 1
+                invalid[filename] = errors
+            else:
+                self.validated += 1
+                self._results[keys[filename]] = time.time()
+        self._save_results()
+        return invalid
+
+    def __str__(self):
+        return "%d validated, %d known valid, %d without schema" \
+               % (self.validated, self.cached, self.skipped)
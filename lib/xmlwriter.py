@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (C) 2010 Vincent Ollivier <contact@vincentollivier.com>
+
+This file is part of OpenNMS Configuration Tools.
+
+OpenNMS Configuration Tools is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Foobar is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with OpenNMS Configuration Tools. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import xml.dom
+
+"""
+This library contains a pretty printer writing a DOM tree to a stream as it
+walks through it, without building the whole document in memory.
+"""
+
+_ELEMENT = xml.dom.Node.ELEMENT_NODE
+_TEXT = xml.dom.Node.TEXT_NODE
+_CDATA = xml.dom.Node.CDATA_SECTION_NODE
+_COMMENT = xml.dom.Node.COMMENT_NODE
+_PI = xml.dom.Node.PROCESSING_INSTRUCTION_NODE
+_DOCTYPE = xml.dom.Node.DOCUMENT_TYPE_NODE
+
+def escape_text(data):
+    if "&" in data:
+        data = data.replace("&", "&amp;")
+    if "<" in data:
+        data = data.replace("<", "&lt;")
+    if ">" in data:
+        data = data.replace(">", "&gt;")
+    return data
+
+def escape_attribute(data):
+    data = escape_text(data)
+    if '"' in data:
+        data = data.replace('"', "&quot;")
+    # Keep the whitespaces a parser would normalize
+    if "\n" in data:
+        data = data.replace("\n", "&#10;")
+    if "\r" in data:
+        data = data.replace("\r", "&#13;")
+    if "\t" in data:
+        data = data.replace("\t", "&#9;")
+    return data
+
+def doctype(name, public_id=None, system_id=None, internal_subset=None):
+    """
+    Return the document type declaration with the given identifiers.
+    """
+    data = "<!DOCTYPE %s" % name
+    if public_id:
+        data += ' PUBLIC "%s" "%s"' % (public_id, system_id)
+    elif system_id:
+        data += ' SYSTEM "%s"' % system_id
+    if internal_subset:
+        data += " [%s]" % internal_subset
+    return data + ">"
+
+
+class XMLWriter(object):
+    """
+    This class write a DOM tree with one element per line, indented by their
+    depth. The text of elements containing text only, or mixing text and
+    elements, is written as it is. The attributes are sorted by name, so the
+    same tree always give the same bytes.
+    The output is given to the stream by chunks of about chunk_size bytes.
+    Every line but the first of a node starts with margin.
+    """
+
+    def __init__(self, stream, indent="  ", encoding="utf-8",
+                 chunk_size=64 * 1024, margin=""):
+        self._stream = stream
+        self._indent = indent
+        self._margin = margin
+        self._encoding = encoding
+        self._chunk_size = chunk_size
+        self._chunk = []
+        self._chunk_length = 0
+
+    def write(self, data):
+        """
+        Write data as it is.
+        """
+        if isinstance(data, unicode):
+            data = data.encode(self._encoding, "xmlcharrefreplace")
+        self._chunk.append(data)
+        self._chunk_length += len(data)
+        if self._chunk_length >= self._chunk_size:
+            self.flush()
+
+    _out = write
+
+    def flush(self):
+        """
+        Give the buffered output to the stream.
+        """
+        if self._chunk:
+            self._stream.write("".join(self._chunk))
+            self._chunk = []
+            self._chunk_length = 0
+
+    def write_document(self, doc):
+        """
+        Write the XML declaration and every node of the document.
+        """
+        self.write_declaration()
+        for node in doc.childNodes:
+            self._out("\n")
+            self.write_node(node)
+        self._out("\n")
+        self.flush()
+
+    def write_declaration(self):
+        self._out('<?xml version="1.0" encoding="%s"?>' % self._encoding)
+
+    def write_node(self, node, depth=0):
+        """
+        Write node and its descendants, without flushing the output.
+        """
+        out = self._out
+        indent = self._indent
+        # Stack of the nodes to write with their depth and whether they are
+        # written as they are (raw) or indented, and of the end tags.
+        stack = [(node, depth, False)]
+        first = True
+        while stack:
+            item = stack.pop()
+            if not isinstance(item, tuple):
+                out(item)
+                continue
+            node, depth, raw = item
+            if not raw and not first:
+                out("\n" + self._margin + indent * depth)
+            first = False
+            node_type = node.nodeType
+            if node_type == _ELEMENT:
+                self._write_element(node, depth, raw, stack)
+            elif node_type == _TEXT:
+                out(escape_text(node.data))
+            elif node_type == _CDATA:
+                out("<![CDATA[%s]]>" % node.data)
+            elif node_type == _COMMENT:
+                out("<!--%s-->" % node.data)
+            elif node_type == _PI:
+                out("<?%s %s?>" % (node.target, node.data))
+            elif node_type == _DOCTYPE:
+                out(doctype(node.name, node.publicId, node.systemId,
+                            node.internalSubset))
+            else:
+                raise ValueError("cannot write node of type %d"
+                                 % node.nodeType)
+
+    def _write_element(self, node, depth, raw, stack):
+        out = self._out
+        out("<" + node.tagName)
+        attributes = node.attributes.items()
+        attributes.sort()
+        for name, value in attributes:
+            out(' %s="%s"' % (name, escape_attribute(value)))
+        children = node.childNodes
+        if not children:
+            out("/>")
+            return
+        out(">")
+        if not raw:
+            # Indent the children only if we would not alter a text
+            has_elements = False
+            for child in children:
+                if child.nodeType in (_TEXT, _CDATA):
+                    if child.nodeType == _CDATA or child.data.strip():
+                        raw = True
+                        break
+                else:
+                    has_elements = True
+            raw = raw or not has_elements
+        if raw:
+            stack.append("</%s>" % node.tagName)
+            for child in reversed(children):
+                stack.append((child, depth + 1, True))
+        else:
+            stack.append("\n%s%s</%s>" % (self._margin, self._indent * depth,
+                                           node.tagName))
+            for child in reversed(children):
+                if child.nodeType != _TEXT:
+                    stack.append((child, depth + 1, False))
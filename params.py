@@ -44,6 +44,8 @@ if hasattr(config_rules, "USERS"):
 
 # Files path
 opennms_path = "/usr/share/opennms"
+# Directory where the scripts keep their state between runs (cache, ...)
+opennms_script_state_path = "/var/cache/opennms-tools"
 
 ################################################################################
 #
@@ -66,3 +68,5 @@ else:
 if unsupported_distribution:
     print "Warning: The current distribution is not supported by this script!"
 opennms_config_path = "%s/etc" % opennms_path
+# Schemas of the configuration files
+opennms_xsd_path = "%s/share/xsds" % opennms_path
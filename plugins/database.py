@@ -56,6 +56,10 @@ class Database(Plugin):
             "service": "poller-configuration.xml",
             "monitor": "poller-configuration.xml",
         }
+        # Values of the parameters of the XML nodes
+        self._xml_parameters = dict(name=name, database=database,
+                                    username=username, password=password,
+                                    driver=driver, jdbc=jdbc, port=port)
 
            # Add a node 'protocol-plugin' to the file 'capsd-configuration.xml'
         self._xml_protocol_plugin = """
@@ -67,7 +71,7 @@ class Database(Plugin):
             <property key="driver" value="%(driver)s"/>
             <property key="url" value="jdbc:%(jdbc)s://OPENNMS_JDBC_HOSTNAME:%(port)s/%(database)s"/>
         </protocol-plugin>
-        """ % vars()
+        """
         #jdbc:oracle:thin:@OPENNMS_JDBC_HOSTNAME:%(port)s:%(database)
         
         # Add a node 'service' to the file 'collectd-configuration.xml'
@@ -79,10 +83,10 @@ class Database(Plugin):
             <parameter key="driver" value="%(driver)s"/>
             <parameter key="url" value="jdbc:%(jdbc)s://OPENNMS_JDBC_HOSTNAME:%(port)s/%(database)s"/>
         </service>
-        """ % vars()
+        """
         
         # Add a node 'service' to the file 'collectd-configuration.xml'
         self._xml_monitor = """
         <monitor service="%(name)s-Connection-%(database)s" class-name="org.opennms.netmgt.poller.monitors.JDBCMonitor"/>
-        """ % vars()
+        """
         
\ No newline at end of file
@@ -39,6 +39,8 @@ class Oracle_Instance_Linux(Plugin):
             "service": "poller-configuration.xml",
             "monitor": "poller-configuration.xml",
         }
+        # Values of the parameters of the XML nodes
+        self._xml_parameters = dict(name=name, value=value)
         # Add a node 'protocol-plugin' to the file 'capsd-configuration.xml'
         # <specific>192.168.0.42</specific>
         self._xml_protocol_plugin = """
@@ -50,7 +52,7 @@ class Oracle_Instance_Linux(Plugin):
             <property key="service-name-oid" value=".1.3.6.1.2.1.25.4.2.1.4" />
             <property key="service-name" value="%(value)s" />
         </protocol-plugin>
-        """ % vars()
+        """
 
         # Add a node 'service' to the file 'collectd-configuration.xml'
         self._xml_service = """
@@ -62,10 +64,10 @@ class Oracle_Instance_Linux(Plugin):
             <parameter key="service-name" value="%(value)s" />
             <parameter key="match-all" value="true" />
         </service>
-        """ % vars()
+        """
 
         # Add a node 'service' to the file 'collectd-configuration.xml'
         self._xml_monitor = """
         <monitor service="Oracle-Instance-%(name)s" 
            class-name="org.opennms.netmgt.poller.monitors.HostResourceSwRunMonitor" />
-        """ % vars()
\ No newline at end of file
+        """
\ No newline at end of file
@@ -18,10 +18,12 @@ You should have received a copy of the GNU General Public License
 along with OpenNMS Configuration Tools. If not, see <http://www.gnu.org/licenses/>.
 """
 
-import re
-import fileinput
-import sys
-from lib.xmlfile import XMLFile
+import os
+from lib.properties import PropertiesFile
+from lib.xmldiff import KEY_NAMES
+from lib.xmlfile import XMLFile, XMLStreamEditor, Insert, Remove, ReplaceAll
+from lib.xmlindex import key_of
+from lib.xmltemplate import get_template
 import xml.dom.minidom
 
 from StringIO import StringIO
@@ -32,6 +34,10 @@ class Plugin(object):
     from Opennms configuration.
     """
 
+    # Size from which the XML files are edited while being streamed instead
+    # of being loaded into a DOM tree
+    stream_threshold = 1024 * 1024
+
     def __init__(self, path):
         self._path = path
 
@@ -40,99 +46,130 @@ class Plugin(object):
         self._list_xml_modifications = dict()
         self._report_defs = list()
         self._report_graph = r""
+        # Parameters of the XML nodes, written '%(name)s' in their text
+        self._xml_parameters = dict()
+        # Parent and next sibling of the nodes removed by disable() by file
+        # and node name, where enable() puts them back
+        self._positions = dict()
 
-        # Graphical report plugin definition
-        self._report_var = "[a-zA-Z0-9-.]+"
-        self._report_sep = "[, ]+"
-        self._report_line = r"(%s%s)+\\?\n" % (self._report_var,
-                                                 self._report_sep)
-        self._report_first_line = r"reports=%s" % self._report_line
-        self._report_last_line = r"(%s%s)*%s\n" % (self._report_var,
-                                                   self._report_sep,
-                                                   self._report_var)
-
-    def _is_part_of_report(self, line, previous_line_was_part_of_report_report):
-        return True if re.match(self._report_first_line, line) is not None \
-                    else True if previous_line_was_part_of_report_report and \
-                                 re.match(self._report_line, line) is not None \
-                    else True if previous_line_was_part_of_report_report and \
-                                 self._is_last_line_of_report(line) \
-                    else False
-
-    def _is_last_line_of_report(self, line):
+    def _get_node_xml(self, node_name):
         """
-        pattern = self._report_last_line
-        p = .compile()
-        ret = re.match(pattern, line)
-        if ret is not None:
-            return True
-        else:
-            return False
+        Return the XML text of the node node_name with its parameters.
+        """
+        node_xml = getattr(self, "_xml_%s" % node_name.replace("-", "_"))
+        if self._xml_parameters:
+            node_xml = node_xml % self._xml_parameters
+        return node_xml
+
+    def _create_node(self, node_name, doc):
+        """
+        Return a new node node_name owned by doc, created from its template
+        which is parsed once for all the plugins of the class.
+        """
+        node_xml = getattr(self, "_xml_%s" % node_name.replace("-", "_"))
+        return get_template(node_xml, True).create(doc,
+                                                   **self._xml_parameters)
+
+    def _use_stream(self, xml_file):
         """
-        return re.match(self._report_last_line, line) is not None
+        Return True if xml_file is big enough to be edited by XMLStreamEditor
+        and its tree is not already held by the XMLFile registry.
+        """
+        registry = XMLFile.get_registry()
+        if registry is not None and registry.is_open(xml_file):
+            return False
+        return os.path.exists(xml_file) and \
+               os.path.getsize(xml_file) >= self.stream_threshold
+
+    def _run_stream_editors(self, editors, simulate_only):
+        for xml_file, editor in editors.items():
+            if self.verbosity > 1:
+                print "\tStreaming '%s' ..." % xml_file
+            editor.run(simulate_only)
+            if self.verbosity > 2:
+                print "\t\t%d node(s) added, %d node(s) removed" \
+                      % (editor.inserted, editor.removed)
 
     def enable(self, simulate_only = True):
         print "Loading plugin '%s' ..." % self.__class__.__name__
+        # Edits of the big files, applied once per file at the end
+        editors = dict()
         for node_name in self._list_xml_modifications.keys():
-            # Load the XML tree of the node content
             node_ref = "_xml_%s" % node_name.replace("-", "_")
-            node_xml = getattr(self, node_ref)
-            doc_plugin = xml.dom.minidom.parseString(node_xml)
-            
+            replace_all = getattr(self, "%s_replace_all" % node_ref, False)
+
             # Load the XML configuration tree
             xml_file = "%s/%s" % (self._path,
                                   self._list_xml_modifications[node_name])
             if self.verbosity > 1:
                 print "\tAdding node '%s' to '%s' ..." % (node_name, xml_file)
-                
+
+            if self._use_stream(xml_file):
+                editor = editors.setdefault(xml_file,
+                                            XMLStreamEditor(xml_file))
+                node_xml = self._get_node_xml(node_name)
+                if replace_all == True:
+                    editor.add(ReplaceAll(node_name, node_xml))
+                else:
+                    editor.add(Insert(node_xml, sibling=node_name))
+                continue
+
             config = XMLFile.open(xml_file, "w")
+            index = config.get_index()
 
             # Try to find the node's parent in it
-            nodes = config.get_document().getElementsByTagName(node_name)
-            if nodes.length:
-                parent = nodes.item(0).parentNode
+            node = self._create_node(node_name, config.get_document())
+            # The node is identified by its first key, see lib.xmldiff, or
+            # else by all its attributes
+            key_names = [key_name for key_name in KEY_NAMES
+                         if key_of(node, key_name) is not None][:1] or \
+                        node.attributes.keys()
+            nodes = index.elements(node_name)
+            parent, reference = self._positions.pop((xml_file, node_name),
+                                                    (None, None))
+            if nodes:
+                parent = nodes[0].parentNode
+                reference = None
                 # If the plugin need to replace all previous nodes
-                if hasattr(self, "%s_replace_all" % node_ref) and \
-                   getattr(self, "%s_replace_all" % node_ref) == True:
-                       for node in nodes:
-                           parent.removeChild(node)
-            else:
+                if replace_all == True:
+                    key_names = []
+                    index.remove_many([old_node for old_node in nodes
+                                       if old_node.parentNode is not parent])
+            elif reference is None or reference.parentNode is not parent or \
+                 parent.ownerDocument is not config.get_document():
                 parent = config.get_root()
-                
-            # Merge the node content with the configuration tree
-            node = doc_plugin.getElementsByTagName(node_name).item(0)
-            parent.appendChild(node)
+                reference = None
+
+            if reference is not None:
+                # Put the node back where disable() removed it
+                index.insert_before(parent, node, reference)
+            else:
+                # Merge the node content with the configuration tree, the
+                # node with the same key is replaced unless it is already
+                # the same
+                index.upsert(parent, node, key_names)
             if not simulate_only:
                 # Write the modifications
                 config.write()
+        self._run_stream_editors(editors, simulate_only)
 
         if hasattr(self, "_report_defs") and hasattr(self, "_report_graph"):
             # Add graph definition
             graph_file = "%s/snmp-graph.properties" % self._path
             if self.verbosity > 1:
                 print "\tAdding graph in '%s' ..." % graph_file
-            # Is the current line part of the report graph declaration?
-            line_is_rep_dec = False
-            for line in fileinput.input(graph_file, inplace=1):
-                # In the first part of the file are declared the graph's names
-                # We have to add those from 'self._report_defs'
-                line_is_rep_dec = self._is_part_of_report(line, line_is_rep_dec)
-                if line_is_rep_dec and self._is_last_line_of_report(line):
-                    new_line = ""
-                    for report_plugin_variable in self._report_defs:
-                        new_line += "%s, " % report_plugin_variable
-                    new_line += "\\\n"
-                    if not simulate_only:
-                        sys.stdout.write(new_line)
-                # Add the graph content just before the last line
-                if "EOF" in line:
-                    sys.stdout.write(self._report_graph)
-                    sys.stdout.write("\n")
-                sys.stdout.write(line)
+            graphs = PropertiesFile(graph_file)
+            # The graph's names are declared in the list of the reports
+            graphs.append("reports", self._report_defs)
+            graphs.merge(self._report_graph)
+            if not simulate_only:
+                graphs.write()
 
     def disable(self, simulate_only = True):
         if self.verbosity > 1:
                 print "Unloading plugin '%s' ..." % self.__class__.__name__
+        # Edits of the big files, applied once per file at the end
+        editors = dict()
         for node_name in self._list_xml_modifications.keys():
             # Load the XML configuration tree
             xml_file = "%s/%s" % (self._path,
@@ -140,20 +177,26 @@ class Plugin(object):
             if self.verbosity > 1:
                 print "\tCheck in '%s' ..." % xml_file
 
-            config = XMLFile.open(xml_file, "w")
+            # Create the node to compare its attributes
+            node = self._create_node(node_name, xml.dom.minidom.Document())
 
-            # Load the XML tree of the node content
-            node_ref = "_xml_%s" % node_name.replace("-", "_")
-            node_xml = getattr(self, node_ref)
-            doc_plugin = xml.dom.minidom.parseString(node_xml)
-            node = doc_plugin.getElementsByTagName(node_name).item(0)
+            if self._use_stream(xml_file):
+                # Same matching as below
+                attributes = dict(node.attributes.items())
+                editor = editors.setdefault(xml_file,
+                                            XMLStreamEditor(xml_file))
+                editor.add(Remove(node_name, attributes))
+                continue
+
+            config = XMLFile.open(xml_file, "w")
+            index = config.get_index()
 
             # Try to find and remove the node
             same_nodes = list()
             if self.verbosity > 2:
                 print "\t\tSearch candidate node named '%s' for removal ..." \
                   % node_name
-            candidates = config.get_document().getElementsByTagName(node_name)
+            candidates = index.elements(node_name)
             for candidate in candidates:
                 if self.verbosity > 2:
                     print "\t\tFound a new candidate ..."
@@ -170,58 +213,32 @@ class Plugin(object):
             for candidate in same_nodes:
                 if self.verbosity > 2:
                     print "\t\tRemove old plugin node ..."
-                candidate.parentNode.removeChild(candidate)
+                self._positions.setdefault((xml_file, node_name),
+                                           (candidate.parentNode,
+                                            candidate.nextSibling))
+                index.remove(candidate)
                 candidate.unlink()
             if not config.get_document().hasChildNodes():
                 if self.verbosity > 2:
                     print "\t\t'%s' is now empty ..." % xml_file
             if not simulate_only: # Write the modifications
                 config.write()
+        self._run_stream_editors(editors, simulate_only)
 
         if hasattr(self, "_report_defs") and hasattr(self, "_report_graph"):
             # Remove report and graph plugin definition
             graph_file = "%s/snmp-graph.properties" % self._path
             if self.verbosity > 1:
                 print "\tCheck in '%s' ..." % graph_file
-            line_is_rep_dec = False
-            delete_next_line = False
-            for line in fileinput.input(graph_file, inplace=1):
-                # In the first part of the file are declared the graph's names
-                # We have to look in this for any mention of self._report_defs
-                line_is_rep_dec = self._is_part_of_report(line, line_is_rep_dec)
-                if line_is_rep_dec:
-                    for report_plugin_variable in self._report_defs:
-                        if not simulate_only:
-                            line = re.sub(r"%s,?\s*" % report_plugin_variable,
-                                          "", line)
-                    if re.match(r"\s*\\?\n", line) is None:
-                        sys.stdout.write(line)
-                    continue
-                # In the remaning part are the graph's definition
-                # We have to look and see if some match self._report_graph
-                graph_property_found = False
-                # Look if the line is the first of a graph definition
-                for report_plugin_variable in self._report_defs:
-                    p = r"\s*report\.%s\.\w+=.*\\?\n" % report_plugin_variable
-                    graph_property_found |= bool(re.match(p, line))
-                if not graph_property_found and not delete_next_line:
-                    # If the line, nor the last one are, graph definitions
-                    sys.stdout.write(line)
-                else:
-                    if simulate_only:
-                        sys.stdout.write(line)
-                    # Look if the line is a continuation of a graph definition
-                    graph_continuity = bool(re.match(r".*\\\n", line))
-                    delete_next_line = True if graph_continuity else False
-            # Remove any double whiteline
-            line_is_whiteline = False
-            for line in fileinput.input(graph_file, inplace=1):
-                previous_line_was_whiteline = line_is_whiteline
-                line_is_whiteline = bool(re.match(r"\s*\n", line))
-                if previous_line_was_whiteline and line_is_whiteline:
-                    continue
-                else:
-                    sys.stdout.write(line)
+            graphs = PropertiesFile(graph_file)
+            graphs.remove_from_list("reports", self._report_defs)
+            prefixes = tuple(["report.%s." % report_plugin_variable
+                              for report_plugin_variable in self._report_defs])
+            for key in graphs.keys():
+                if key.startswith(prefixes):
+                    graphs.remove(key)
+            if not simulate_only:
+                graphs.write()
 
     def get_verbosity(self):
         return self._verbosity
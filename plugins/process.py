@@ -39,6 +39,9 @@ class Process(Plugin):
             "service": "poller-configuration.xml",
             "monitor": "poller-configuration.xml",
         }
+        # Values of the parameters of the XML nodes
+        self._xml_parameters = dict(name=name, value=value,
+                                    run_level=run_level)
         # Add a node 'protocol-plugin' to the file 'capsd-configuration.xml'
         self._xml_protocol_plugin = """
         <protocol-plugin protocol="%(name)s-Process"
@@ -49,7 +52,7 @@ class Process(Plugin):
         <property key="service-name" value="%(value)s" />
         </protocol-plugin>
 
-        """ % vars()
+        """
 
         # Add a node 'service' to the file 'collectd-configuration.xml'
         self._xml_service = """
@@ -60,10 +63,10 @@ class Process(Plugin):
             <parameter key="run-level" value="%(run_level)s"/>
             <parameter key="match-all" value="true"/>
         </service>
-        """ % vars()
+        """
 
         # Add a node 'service' to the file 'collectd-configuration.xml'
         self._xml_monitor = """
         <monitor service="%(name)s-Process" 
            class-name="org.opennms.netmgt.poller.monitors.HostResourceSwRunMonitor"/>
-        """ % vars()
\ No newline at end of file
+        """
\ No newline at end of file
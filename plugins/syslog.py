@@ -52,11 +52,13 @@ class Syslog(Plugin):
 
         # Add a node 'service' to the file 'collectd-configuration.xml'
         self._xml_configuration_replace_all = True
-        self._xml_configuration = """
+        # The regular expression ends with a newline, written '&#10;' so it is
+        # not normalized into a space by the parser
+        self._xml_configuration = r"""
         <configuration
             syslog-port="10514"
             new-suspect-on-message="false"
-            forwarding-regexp="^((.+?) (.*))\n?$"
+            forwarding-regexp="^((.+?) (.*))&#10;?$"
             matching-group-host="2"
             matching-group-message="3"
             discard-uei="DISCARD-MATCHING-MESSAGES"
@@ -39,6 +39,8 @@ class Win32_Services(Plugin):
             "service": "poller-configuration.xml",
             "monitor": "poller-configuration.xml",
         }
+        # Values of the parameters of the XML nodes
+        self._xml_parameters = dict(name=name, value=value)
         # Add a node 'protocol-plugin' to the file 'capsd-configuration.xml'
         self._xml_protocol_plugin = """
         <protocol-plugin protocol="%(name)s-Service"
@@ -48,7 +50,7 @@ class Win32_Services(Plugin):
             <property key="retry" value="1" />
             <property key="service-name" value="%(value)s" />
         </protocol-plugin> 
-        """ % vars()
+        """
 
         # Add a node 'service' to the file 'collectd-configuration.xml'
         self._xml_service = """
@@ -59,10 +61,10 @@ class Win32_Services(Plugin):
             <parameter key="port" value="161"/>
             <parameter key="service-name" value="%(value)s"/>
         </service>
-        """ % vars()
+        """
 
         # Add a node 'service' to the file 'collectd-configuration.xml'
         self._xml_monitor = """
         <monitor service="%(name)s-Service" 
            class-name="org.opennms.netmgt.poller.monitors.Win32ServiceMonitor"/>
-        """ % vars()
+        """
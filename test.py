@@ -32,6 +32,8 @@ import xml.dom.minidom
 
 import lib.distrib
 import lib.system
+from lib.xmlcache import XMLCache
+from lib.xmlfile import XMLFile
 
 import params
 
@@ -225,8 +227,8 @@ class OpenNMSState(object):
         the given filename
         """
         try:
-            doc = xml.dom.minidom.parse("%s/%s" % (params.opennms_config_path, 
-                                                   filename))
+            doc = XMLFile.parse_document("%s/%s" % (params.opennms_config_path,
+                                                    filename))
         except IOError, e:
             print >> sys.stderr, e
         except:
@@ -407,6 +409,11 @@ def main():
     #    Collect data for Regression Test    #
     ##########################################
 
+    try:
+        XMLFile.set_cache(XMLCache("%s/xml" % params.opennms_script_state_path))
+    except OSError, e:
+        print >> sys.stderr, "Warning: the XML cache is disabled (%s)" % e
+
     print "Collecting data for Regression Test Sequence..."
     present_configuration.collect_informations()
     if options.verbosity > 1: